@@ -1,22 +1,54 @@
 #!/usr/bin/env python3
 """
 Helper script to add a new version to the download site
+
+Run without arguments for the interactive wizard, or publish many builds at
+once from a manifest: python add_version.py --manifest builds.csv
 """
+import argparse
+import csv
 import json
 import os
 import sys
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from file_info import format_size, inspect_file
+from versions_file import read_versions, update_versions, versions_lock, write_versions
+
 VERSIONS_FILE = 'versions.json'
 
 def get_file_size(filename):
     """Get human-readable file size"""
-    size = os.path.getsize(filename)
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size < 1024.0:
-            return f"{size:.1f} {unit}"
-        size /= 1024.0
-    return f"{size:.1f} TB"
+    return format_size(os.path.getsize(filename))
+
+def make_entry(version, filename, description=None, platform=None, changelog=None,
+               date=None, size="Unknown", file_info=None, legacy=False, mirrors=None):
+    """Build a versions.json entry"""
+    version_entry = {
+        "version": version,
+        "date": date or datetime.now().strftime("%Y-%m-%d"),
+        "description": description or f"Version {version} release",
+        "filename": filename,
+        "size": size,
+        "platform": platform or "All Platforms"
+    }
+    
+    if legacy:
+        version_entry["legacy"] = True
+    
+    if file_info:
+        version_entry.update(file_info)
+    
+    if changelog:
+        version_entry["changelog"] = changelog
+    
+    if mirrors:
+        version_entry["mirrors"] = mirrors
+    
+    return version_entry
 
 def add_version():
     """Interactive script to add a new version"""
@@ -24,11 +56,7 @@ def add_version():
     print("=" * 40)
     
     # Load existing versions
-    if os.path.exists(VERSIONS_FILE):
-        with open(VERSIONS_FILE, 'r') as f:
-            versions = json.load(f)
-    else:
-        versions = []
+    versions = read_versions(VERSIONS_FILE)
     
     # Get version info
     version = input("Version number (e.g., 1.0.1): ").strip()
@@ -42,7 +70,6 @@ def add_version():
         if response != 'y':
             print("Cancelled.")
             return
-        versions = [v for v in versions if v['version'] != version]
     
     description = input("Description: ").strip()
     if not description:
@@ -62,8 +89,11 @@ def add_version():
             print("Cancelled.")
             return
         size = "Unknown"
+        file_info = None
     else:
         size = get_file_size(filepath)
+        # sha256, exact byte length and mtime, used by the server as validators
+        file_info = inspect_file(filepath)
     
     platform = input("Platform (optional, press Enter to skip): ").strip()
     if not platform:
@@ -79,33 +109,175 @@ def add_version():
         changelog.append(item)
     
     # Create version entry
-    version_entry = {
-        "version": version,
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "description": description,
-        "filename": filename,
-        "size": size,
-        "platform": platform
-    }
+    version_entry = make_entry(version, filename, description, platform, changelog,
+                               size=size, file_info=file_info)
     
-    if changelog:
-        version_entry["changelog"] = changelog
-    
-    # Add to versions list
-    versions.append(version_entry)
-    
-    # Save
-    with open(VERSIONS_FILE, 'w') as f:
-        json.dump(versions, f, indent=2)
+    # Re-read under the lock so changes made while we were prompting aren't lost,
+    # then replace any entry with the same version and write atomically
+    with update_versions(VERSIONS_FILE) as versions:
+        versions[:] = [v for v in versions if v['version'] != version]
+        versions.append(version_entry)
     
     print(f"\n✓ Version {version} added successfully!")
     print(f"  File: {filename}")
     print(f"  Size: {size}")
+    if file_info:
+        print(f"  SHA-256: {file_info['sha256']}")
+
+def load_manifest(path):
+    """Read a JSON list or a CSV file of builds into a list of dicts.
+
+    CSV columns: version, filename, description, platform, date, legacy,
+    changelog and mirrors (both lists separated by "|").
+    """
+    with open(path, 'r', newline='') as f:
+        if path.lower().endswith('.csv'):
+            items = []
+            for row in csv.DictReader(f):
+                item = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+                item['changelog'] = [c.strip() for c in item.get('changelog', '').split('|')
+                                     if c.strip()]
+                item['mirrors'] = [m.strip() for m in item.get('mirrors', '').split('|')
+                                   if m.strip()]
+                item['legacy'] = item.get('legacy', '').lower() in ('1', 'true', 'yes')
+                items.append(item)
+            return items
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError("A JSON manifest must be a list of builds")
+    return items
+
+def inspect_release(filepath):
+    """Hash a release file and check that it is a complete, uncorrupted zip"""
+    file_info = inspect_file(filepath)
+    try:
+        with zipfile.ZipFile(filepath) as zf:
+            bad_member = zf.testzip()
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+        # RuntimeError: encrypted members, which players couldn't extract either
+        raise ValueError(f"not a valid zip ({e})")
+    if bad_member is not None:
+        raise ValueError(f"corrupt member {bad_member}")
+    return file_info
+
+def check_manifest_item(item):
+    """Problem with one manifest build, or None if it can be published"""
+    if not isinstance(item, dict):
+        return "expected an object with 'version' and 'filename'"
+    version = item.get('version')
+    if isinstance(version, bool) or not isinstance(version, (str, int, float)) \
+            or not str(version).strip():
+        return "'version' is required"
+    filename = item.get('filename')
+    if not isinstance(filename, str) or not filename:
+        return "'filename' is required"
+    if os.path.basename(filename) != filename or filename in ('.', '..'):
+        return f"'filename' must be a file in downloads/, not {filename!r}"
+    for name in ('description', 'platform', 'date'):
+        if item.get(name) is not None and not isinstance(item[name], str):
+            return f"'{name}' must be a string"
+    for name in ('changelog', 'mirrors'):
+        value = item.get(name)
+        if value is not None and (not isinstance(value, list)
+                                  or not all(isinstance(v, str) for v in value)):
+            return f"'{name}' must be a list of strings"
+    return None
+
+def add_versions_from_manifest(manifest_path, workers=None, replace=False):
+    """Publish every build in a manifest with one atomic versions.json write.
+
+    All files are inspected in parallel first; if any is missing, invalid or
+    already published (without replace), nothing is written.
+    """
+    try:
+        items = load_manifest(manifest_path)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {manifest_path}: {e}")
+        return False
+    
+    errors = []
+    seen = set()
+    for index, item in enumerate(items, 1):
+        problem = check_manifest_item(item)
+        if problem:
+            errors.append(f"Build #{index}: {problem}")
+            continue
+        version = str(item['version']).strip()
+        if version in seen:
+            errors.append(f"Version {version} is listed twice")
+        seen.add(version)
+    if errors:
+        for error in errors:
+            print(f"  ✗ {error}")
+        return False
+    
+    print(f"Inspecting {len(items)} builds...")
+    
+    def inspect(item):
+        filepath = os.path.join('downloads', item['filename'])
+        if not os.path.exists(filepath):
+            return item, None, f"File {filepath} does not exist"
+        try:
+            return item, inspect_release(filepath), None
+        except (OSError, ValueError) as e:
+            return item, None, f"{filepath}: {e}"
+    
+    # Hashing and zip checks release the GIL, so the files are read in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(inspect, items))
+    
+    entries = []
+    for item, file_info, error in results:
+        if error:
+            errors.append(error)
+            continue
+        entries.append(make_entry(
+            str(item['version']).strip(), item['filename'], item.get('description'),
+            item.get('platform'), item.get('changelog'), item.get('date'),
+            size=get_file_size(os.path.join('downloads', item['filename'])),
+            file_info=file_info, legacy=bool(item.get('legacy')),
+            mirrors=item.get('mirrors')))
+        print(f"  ✓ {item['version']}: {item['filename']} ({entries[-1]['size']})")
+    
+    with versions_lock(VERSIONS_FILE):
+        versions = read_versions(VERSIONS_FILE)
+        if not replace:
+            existing = {v['version'] for v in versions}
+            errors.extend(f"Version {e['version']} already exists (use --replace)"
+                          for e in entries if e['version'] in existing)
+        if errors:
+            for error in errors:
+                print(f"  ✗ {error}")
+            print("\nNothing was published.")
+            return False
+        published = {e['version'] for e in entries}
+        versions = [v for v in versions if v['version'] not in published] + entries
+        write_versions(VERSIONS_FILE, versions)
+    
+    print(f"\n✓ {len(entries)} versions published successfully!")
+    return True
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add versions to the download site")
+    parser.add_argument('--manifest', metavar='FILE',
+                        help="publish every build listed in a JSON or CSV manifest")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="files inspected in parallel (default: CPU count + 4)")
+    parser.add_argument('--replace', action='store_true',
+                        help="overwrite versions that are already published")
+    args = parser.parse_args()
+    
     try:
-        add_version()
+        if args.manifest:
+            if not add_versions_from_manifest(args.manifest, args.workers, args.replace):
+                sys.exit(1)
+        else:
+            add_version()
     except KeyboardInterrupt:
         print("\n\nCancelled.")
         sys.exit(1)
+    except (OSError, ValueError, RuntimeError) as e:
+        # e.g. versions.json unreadable, or a worker failing unexpectedly
+        print(f"Error: {e}")
+        sys.exit(1)
 
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Download admission control shared across gunicorn workers.
+
+Three limits protect the workers that serve pages and the API from heavy
+downloads:
+
+- a token bucket per client IP: each download request takes a token, and
+  tokens refill at DOWNLOAD_RATE per second up to DOWNLOAD_BURST, which reins
+  in download managers that open many parallel range requests (429);
+- a byte bucket per client IP: the bodies of all of a client's downloads
+  together are paced to DOWNLOAD_BANDWIDTH bytes per second, so one admitted
+  client can't take the whole link. Offloaded transfers get nginx's
+  X-Accel-Limit-Rate instead (per connection, as nginx can't see the others);
+- a global cap of MAX_TRANSFERS downloads being streamed by Python at once;
+  beyond it new downloads are turned away with 503 and Retry-After instead of
+  queueing behind busy workers. Transfers offloaded to the proxy
+  (SENDFILE_MODE) don't count.
+
+State lives in a memory-mapped file, like metrics.py. Updates take an flock
+on it, so every worker sees the same buckets and transfer count. Each worker
+counts its own transfers in its own row, so a crashed worker's transfers are
+dropped instead of leaking.
+
+File layout: magic | (pid, transfers) per worker | bucket table.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+from metrics import MAX_PROCS, pid_alive
+from responses import call_on_close
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; fine for a single dev server
+    fcntl = None
+
+MAGIC = b'SIADMIT1'
+# Client IPs tracked at once; idle buckets (already full again) are reused
+TABLE_SIZE = 4096
+# Slots tried for one IP before the least recently used of them is taken over
+PROBES = 8
+
+_WORKER = struct.Struct('<qq')
+_BUCKET = struct.Struct('<Qdd')
+_WORKERS_OFFSET = len(MAGIC)
+_BUCKETS_OFFSET = _WORKERS_OFFSET + MAX_PROCS * _WORKER.size
+FILE_SIZE = _BUCKETS_OFFSET + TABLE_SIZE * _BUCKET.size
+
+# Endpoints the limits apply to
+LIMITED_ENDPOINTS = ('download', 'delta')
+
+# Bytes sent between two takes from a client's byte bucket
+PACE_BYTES = 64 * 1024
+
+
+def _client_key(client):
+    """Non-zero 64-bit hash of a client address (0 marks a free slot)"""
+    digest = hashlib.blake2b(client.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class Admission:
+    """Per-client request and byte buckets and a global transfer count in a shared file"""
+
+    def __init__(self, path, rate=0.0, burst=1, max_transfers=0, bandwidth=0):
+        self.path = os.path.abspath(path)
+        self.rate = rate
+        self.burst = burst
+        self.max_transfers = max_transfers
+        self.bandwidth = bandwidth
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Map the file once per process, since flocks on a descriptor
+        inherited over fork don't exclude the parent or sibling workers"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = pid
+        self._row = None
+        with self._file_lock():
+            if os.fstat(self._fd).st_size != FILE_SIZE:
+                os.ftruncate(self._fd, FILE_SIZE)
+            self._mm = mmap.mmap(self._fd, FILE_SIZE)
+            if self._mm[:len(MAGIC)] != MAGIC:
+                self._mm[:] = bytes(FILE_SIZE)
+                self._mm[:len(MAGIC)] = MAGIC
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access across threads and processes"""
+        self._open()
+        with self._lock, self._file_lock():
+            yield
+
+    def _bucket(self, key, rate, burst, now):
+        """(slot, tokens) of key's bucket, refilled up to now (lock held)"""
+        # A bucket idle this long is full again, so its slot can be reused
+        refill_time = burst / rate
+        start = key % TABLE_SIZE
+        free = None
+        oldest = None
+        for i in range(PROBES):
+            index = (start + i) % TABLE_SIZE
+            slot_key, tokens, updated = _BUCKET.unpack_from(
+                self._mm, _BUCKETS_OFFSET + index * _BUCKET.size)
+            if slot_key == key:
+                return index, min(burst, tokens + (now - updated) * rate)
+            # The client's own bucket may sit further along, so keep probing
+            if free is None and (slot_key == 0 or now - updated >= refill_time):
+                free = index
+            if oldest is None or updated < oldest[1]:
+                oldest = (index, updated)
+        if free is not None:
+            return free, burst
+        # Every probed slot is busy: evict the least recently used
+        return oldest[0], burst
+
+    def _store(self, slot, key, tokens, now):
+        _BUCKET.pack_into(self._mm, _BUCKETS_OFFSET + slot * _BUCKET.size, key, tokens, now)
+
+    def take_token(self, client, now=None):
+        """Spend one of client's tokens: 0 if allowed, else seconds until one refills"""
+        if self.rate <= 0:
+            return 0
+        now = time.time() if now is None else now
+        key = _client_key(client)
+        with self._locked():
+            slot, tokens = self._bucket(key, self.rate, self.burst, now)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._store(slot, key, tokens, now)
+        return wait
+
+    def take_bytes(self, client, nbytes, now=None):
+        """Charge bytes already sent to client: seconds to pause before sending more.
+
+        The bucket holds one second of DOWNLOAD_BANDWIDTH and may go into
+        debt, which the sender then sleeps off.
+        """
+        if self.bandwidth <= 0:
+            return 0
+        now = time.time() if now is None else now
+        # Its own bucket, apart from the request bucket of the same client
+        key = _client_key('bytes:' + client)
+        with self._locked():
+            slot, tokens = self._bucket(key, self.bandwidth, self.bandwidth, now)
+            tokens -= nbytes
+            self._store(slot, key, tokens, now)
+        return max(0.0, -tokens) / self.bandwidth
+
+    def _worker_row(self):
+        """This process's (pid, transfers) row, claiming one if needed (lock held)"""
+        if self._row is not None:
+            return self._row
+        pid = os.getpid()
+        for row in range(MAX_PROCS):
+            offset = _WORKERS_OFFSET + row * _WORKER.size
+            owner, _ = _WORKER.unpack_from(self._mm, offset)
+            if owner == pid or owner == 0 or not pid_alive(owner):
+                _WORKER.pack_into(self._mm, offset, pid, 0)
+                self._row = offset
+                return offset
+        return None
+
+    def _transfers(self):
+        """Transfers in flight in all live workers (lock held)"""
+        total = 0
+        for row in range(MAX_PROCS):
+            owner, count = _WORKER.unpack_from(self._mm, _WORKERS_OFFSET + row * _WORKER.size)
+            if owner and count and pid_alive(owner):
+                total += count
+        return total
+
+    def acquire_transfer(self):
+        """Reserve a transfer slot; False if MAX_TRANSFERS are already running"""
+        if self.max_transfers <= 0:
+            return True
+        with self._locked():
+            row = self._worker_row()
+            if row is None:
+                # More workers than rows; don't block them over bookkeeping
+                return True
+            if self._transfers() >= self.max_transfers:
+                return False
+            pid, count = _WORKER.unpack_from(self._mm, row)
+            _WORKER.pack_into(self._mm, row, pid, count + 1)
+        return True
+
+    def release_transfer(self):
+        if self.max_transfers <= 0:
+            return
+        with self._locked():
+            if self._row is None:
+                return
+            pid, count = _WORKER.unpack_from(self._mm, self._row)
+            _WORKER.pack_into(self._mm, self._row, pid, max(0, count - 1))
+
+    def in_flight(self):
+        with self._locked():
+            return self._transfers()
+
+
+def client_address(app):
+    """The client's IP, from CLIENT_IP_HEADER when a trusted proxy sets it"""
+    header = app.config.get('CLIENT_IP_HEADER')
+    if header and request.headers.get(header):
+        # X-Forwarded-For may be a list; the proxy appends the client it saw last
+        return request.headers[header].split(',')[-1].strip()
+    return request.remote_addr or ''
+
+
+class PacedBody:
+    """Response body that sleeps between chunks to keep a client under its bandwidth.
+
+    A class rather than a generator so call_on_close() can still hook close().
+    """
+
+    def __init__(self, body, admission, client):
+        self.body = body
+        self.admission = admission
+        self.client = client
+
+    def __iter__(self):
+        pending = 0
+        for chunk in self.body:
+            yield chunk
+            pending += len(chunk)
+            if pending >= PACE_BYTES:
+                wait = self.admission.take_bytes(self.client, pending)
+                pending = 0
+                if wait:
+                    time.sleep(wait)
+        if pending:
+            self.admission.take_bytes(self.client, pending)
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+def _pace(response, admission, client):
+    """Pace a response body, or ask nginx to when the transfer is offloaded"""
+    if 'X-Accel-Redirect' in response.headers:
+        response.headers['X-Accel-Limit-Rate'] = str(int(admission.bandwidth))
+    elif 'X-Sendfile' not in response.headers:
+        # Iterating the body gives up wsgi.file_wrapper's sendfile(); pacing needs it
+        response.response = PacedBody(response.response, admission, client)
+
+
+def _refuse(status, retry_after, message):
+    return message, status, {'Retry-After': str(max(1, math.ceil(retry_after))),
+                             'Cache-Control': 'no-store'}
+
+
+def init_app(app):
+    """Apply the download limits configured on app to its download routes"""
+    admission = Admission(app.config['ADMISSION_FILE'], app.config['DOWNLOAD_RATE'],
+                          app.config['DOWNLOAD_BURST'], app.config['MAX_TRANSFERS'],
+                          app.config['DOWNLOAD_BANDWIDTH'])
+
+    @app.before_request
+    def _admit():
+        if request.endpoint not in LIMITED_ENDPOINTS:
+            return None
+        wait = admission.take_token(client_address(app))
+        if wait:
+            return _refuse(429, wait, "Too many downloads, slow down")
+        if not admission.acquire_transfer():
+            return _refuse(503, app.config['TRANSFER_RETRY_AFTER'],
+                           "Download capacity is full, try again shortly")
+        g.admission_transfer = True
+        return None
+
+    @app.after_request
+    def _hand_over(response):
+        if not g.pop('admission_transfer', False):
+            return response
+        if admission.bandwidth > 0 and response.status_code in (200, 206):
+            _pace(response, admission, client_address(app))
+        offloaded = 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers
+        if response.status_code in (200, 206) and not offloaded:
+            # The slot is held until the body has been sent
+            call_on_close(response, admission.release_transfer)
+        else:
+            admission.release_transfer()
+        return response
+
+    @app.teardown_request
+    def _release_on_error(exc):
+        # after_request doesn't run when the view raised
+        if g.pop('admission_transfer', False):
+            admission.release_transfer()
+
+    return admission
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+Asyncio/ASGI edition of the Snake Idle download site.
+
+Serves the same routes and JSON as app.py, but file transfers are streamed
+from an event loop instead of holding a worker thread each, so one process
+can keep thousands of slow downloads open. Run it with any ASGI server:
+
+    uvicorn app_asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+from jinja2 import Environment, FileSystemLoader
+from werkzeug.datastructures import Accept
+from werkzeug.http import http_date, parse_accept_header
+from werkzeug.sansio.http import is_resource_modified
+from werkzeug.security import safe_join
+
+from blob_store import BlobStore
+from bundles import StoreBundle, ZipBundle, bundle_filename
+from catalog import Catalog, parse_version_query
+from disk_cache import DiskCache
+from mirrors import MirrorPool
+from responses import (choose_encoding, content_disposition, content_validators,
+                       digest_headers, download_validators, multipart_byteranges,
+                       precompress_body, resolve_ranges, static_variants)
+
+UPLOAD_FOLDER = 'downloads'
+VERSIONS_FILE = 'versions.json'
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# How long clients may reuse an /api/latest answer without asking again
+LATEST_MAX_AGE = int(os.environ.get('LATEST_MAX_AGE', 3600))
+
+# Content-addressed store for releases published with package_game.py --store
+STORE_FOLDER = os.path.join(UPLOAD_FOLDER, '.store')
+# Disk space for zips assembled from the store (least recently used are dropped)
+STORE_CACHE_BYTES = int(os.environ.get('STORE_CACHE_BYTES', 2 * 1024 ** 3))
+# Disk space for built ?bundle= zips (least recently used are dropped)
+BUNDLE_CACHE_BYTES = int(os.environ.get('BUNDLE_CACHE_BYTES', 1024 ** 3))
+# Base URLs of mirrors serving every release's file (comma-separated); versions
+# can add their own with "mirrors" in versions.json
+MIRRORS = [url for url in os.environ.get('MIRRORS', '').split(',') if url]
+# Seconds between checks of mirror files, and how long a check may take
+MIRROR_CHECK_INTERVAL = float(os.environ.get('MIRROR_CHECK_INTERVAL', 10))
+MIRROR_TIMEOUT = float(os.environ.get('MIRROR_TIMEOUT', 2))
+
+# Read size per await; bounds the memory each open download can hold
+CHUNK_SIZE = 256 * 1024
+
+# Ensure downloads directory exists
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+# Cached view of versions.json, swapped in the background when the file changes
+catalog = Catalog(VERSIONS_FILE, watch=True)
+
+store = BlobStore(STORE_FOLDER, cache_bytes=STORE_CACHE_BYTES)
+bundle_cache = DiskCache(os.path.join(UPLOAD_FOLDER, '.bundle_cache'), BUNDLE_CACHE_BYTES)
+mirrors = MirrorPool(MIRRORS, interval=MIRROR_CHECK_INTERVAL, timeout=MIRROR_TIMEOUT)
+
+
+def _url_for(endpoint, **values):
+    """Enough of Flask's url_for for templates/index.html"""
+    if endpoint == 'static':
+        return '/static/' + values['filename']
+    if endpoint == 'download':
+        return '/download/' + values['version']
+    raise ValueError(f"Unknown endpoint {endpoint!r}")
+
+
+_templates = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True)
+_templates.globals['url_for'] = _url_for
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the routes need"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {}
+        for name, value in scope['headers']:
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+    def header(self, name):
+        return self.headers.get(name.lower())
+
+
+async def send_response(send, status, headers=None, body=b'', head=False):
+    """Send a complete response in one body message"""
+    headers = dict(headers or {})
+    if status == 304:
+        # A 304 has no body; a Content-Length would describe the full one
+        headers.pop('Content-Length', None)
+    else:
+        headers.setdefault('Content-Length', str(len(body)))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def send_text(send, request, status, text):
+    await send_response(send, status, {'Content-Type': 'text/html; charset=utf-8'},
+                        text.encode('utf-8'), head=request.method == 'HEAD')
+
+
+async def send_json(send, request, status, data):
+    body = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8') + b'\n'
+    await send_response(send, status, {'Content-Type': 'application/json'}, body,
+                        head=request.method == 'HEAD')
+
+
+def _not_modified(request, etag, last_modified):
+    return not is_resource_modified(
+        http_if_none_match=request.header('If-None-Match'),
+        http_if_modified_since=request.header('If-Modified-Since'),
+        etag=etag, last_modified=last_modified)
+
+
+async def send_variants(send, request, variants, etag, mimetype, last_modified=None,
+                        cache_control=None):
+    """Negotiate a precompressed variant, with Vary and 304 support"""
+    accept = parse_accept_header(request.header('Accept-Encoding'), Accept)
+    encoding = choose_encoding(variants, accept)
+    headers = {'Content-Type': mimetype, 'Vary': 'Accept-Encoding'}
+    if mimetype.startswith('text/'):
+        headers['Content-Type'] += '; charset=utf-8'
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+        etag = f'{etag}-{encoding}'
+    headers['ETag'] = f'"{etag}"'
+    if last_modified is not None:
+        last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+        headers['Last-Modified'] = http_date(last_modified)
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+    if _not_modified(request, etag, last_modified):
+        await send_response(send, 304, headers, head=True)
+        return
+    await send_response(send, 200, headers, variants[encoding], head=request.method == 'HEAD')
+
+
+async def _watch_disconnect(receive, disconnected):
+    """Set disconnected once the client goes away"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def run_blocking(func, *args):
+    """Run disk work on the default executor so the event loop never waits on it"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+async def stream_file(send, receive, scope, file_path, spans, parts=None):
+    """Stream byte spans of a file with backpressure.
+
+    Each send() waits until the server has flushed enough of the previous
+    chunk, so a slow client only ever holds one chunk in memory. Reads run on
+    the default executor so the event loop never blocks on disk. Uses the
+    zero-copy sendfile extension when the server offers it.
+    """
+    loop = asyncio.get_running_loop()
+    zerocopy = 'http.response.zerocopysend' in scope.get('extensions', {})
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    try:
+        with open(file_path, 'rb') as f:
+            for index, (start, stop) in enumerate(spans):
+                if parts:
+                    await send({'type': 'http.response.body', 'body': parts[index], 'more_body': True})
+                if zerocopy:
+                    await send({'type': 'http.response.zerocopysend', 'file': f.fileno(),
+                                'offset': start, 'count': stop - start, 'more_body': True})
+                    continue
+                position = start
+                while position < stop and not disconnected.is_set():
+                    chunk = await loop.run_in_executor(
+                        None, _read_at, f, position, min(CHUNK_SIZE, stop - position))
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if disconnected.is_set():
+                    return
+        await send({'type': 'http.response.body', 'body': parts[-1] if parts else b''})
+    finally:
+        watcher.cancel()
+
+
+async def send_download(send, receive, scope, request, file_path, download_name,
+                        validators=None):
+    """Async counterpart of responses.send_download (Range, If-Range, 304, 416)"""
+    st = await run_blocking(os.stat, file_path)
+    size = st.st_size
+    etag, digest, last_modified = download_validators(st, validators)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+    }
+    head = request.method == 'HEAD'
+
+    if _not_modified(request, etag, last_modified):
+        await send_response(send, 304, headers, head=True)
+        return
+
+    spans = resolve_ranges(size, etag, last_modified, request.header('Range'),
+                           request.header('If-Range'))
+    if spans == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        await send_response(send, 416, headers, head=head)
+        return
+
+    headers['Content-Disposition'] = content_disposition(download_name)
+    headers.update(digest_headers(digest))
+    parts = None
+    if spans is None:
+        status = 200
+        spans = [(0, size)]
+        headers['Content-Type'] = mimetype
+        headers['Content-Length'] = str(size)
+    elif len(spans) == 1:
+        status = 206
+        start, stop = spans[0]
+        headers['Content-Type'] = mimetype
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+    else:
+        status = 206
+        content_type, parts, content_length = multipart_byteranges(spans, size, mimetype)
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(content_length)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+    })
+    if head:
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await stream_file(send, receive, scope, file_path, spans, parts)
+
+
+async def send_stream(send, receive, request, chunks, size, mtime, download_name,
+                      validators=None):
+    """Async counterpart of responses.send_stream: a generated file of known size.
+
+    chunks is a plain iterator; it is advanced on the default executor and
+    closed early if the client goes away.
+    """
+    etag, digest, last_modified = content_validators(size, int(mtime) * 1000000000, validators)
+    headers = {'ETag': f'"{etag}"', 'Last-Modified': http_date(last_modified)}
+    if _not_modified(request, etag, last_modified):
+        await send_response(send, 304, headers, head=True)
+        return
+    headers['Content-Type'] = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    headers['Content-Length'] = str(size)
+    headers['Content-Disposition'] = content_disposition(download_name)
+    headers.update(digest_headers(digest))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+    })
+    if request.method == 'HEAD':
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    loop = asyncio.get_running_loop()
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(_watch_disconnect(receive, disconnected))
+    try:
+        while not disconnected.is_set():
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        watcher.cancel()
+        chunks.close()
+
+
+async def index(send, request):
+    """Main download page"""
+    generation = catalog.get()
+    variants, etag = generation.cached('asgi_index', lambda: precompress_body(
+        lambda: _templates.get_template('index.html').render(versions=generation.versions)))
+    await send_variants(send, request, variants, etag, 'text/html', generation.mtime,
+                        cache_control='no-cache')
+
+
+async def api_versions(send, request):
+    """API endpoint to get all versions, optionally filtered and paginated"""
+    generation = catalog.get()
+    try:
+        query = parse_version_query(request.args)
+        payload = generation.query_payload(query) if query is not None else None
+    except ValueError as e:
+        await send_json(send, request, 400, {"error": str(e)})
+        return
+    if payload is not None:
+        body = payload.encode('utf-8')
+        await send_variants(send, request, {'identity': body},
+                            hashlib.sha256(body).hexdigest()[:32], 'application/json',
+                            cache_control='no-cache')
+        return
+    variants, etag = generation.cached('api_versions', lambda: precompress_body(
+        lambda: generation.api_payload))
+    await send_variants(send, request, variants, etag, 'application/json', generation.mtime,
+                        cache_control='no-cache')
+
+
+async def api_latest(send, request):
+    """Update check: the newest release for ?platform= and whether ?current= is behind"""
+    generation = catalog.get()
+    payload = generation.latest_for(request.args.get('current') or None,
+                                    request.args.get('platform') or None)
+    if payload is None:
+        await send_json(send, request, 404, {"error": "No releases available"})
+        return
+    variants, etag = generation.cached(('api_latest', payload), lambda: precompress_body(
+        lambda: payload))
+    await send_variants(send, request, variants, etag, 'application/json', generation.mtime,
+                        cache_control=f'public, max-age={LATEST_MAX_AGE}')
+
+
+async def api_mirrors(send, request):
+    """Health, latency, files found and recent redirects of this worker's mirrors"""
+    await send_json(send, request, 200, mirrors.stats())
+
+
+async def api_update(send, request):
+    """Smallest download path from ?from=<version> to the latest release"""
+    from_version = request.args.get('from')
+    if not from_version:
+        await send_json(send, request, 400, {"error": "Missing 'from' parameter"})
+        return
+    plan = catalog.get().update_plan(from_version)
+    if plan is None:
+        await send_json(send, request, 404, {"error": f"Unknown version {from_version}"})
+        return
+    await send_json(send, request, 200, plan)
+
+
+async def download(send, receive, scope, request, version):
+    """Download a specific version (or a smaller ?bundle= of it)"""
+    generation = catalog.get()
+    version_info = generation.find(version)
+    if not version_info:
+        await send_text(send, request, 404, "Version not found")
+        return
+    if request.args.get('bundle'):
+        await download_bundle(send, receive, scope, request, version,
+                              version_info['filename'], request.args['bundle'])
+        return
+    # Send the client to a healthy mirror that has the file; serve locally without one
+    mirror = mirrors.choose(generation.mirrors.get(version, []) + MIRRORS,
+                            version_info['filename'], version_info.get('bytes'))
+    if mirror is not None:
+        await send_response(send, 302, {'Location': mirror.url_for(version_info['filename'])},
+                            head=request.method == 'HEAD')
+        return
+    validators = generation.validators.get(version)
+    file_path, manifest, size = await run_blocking(_locate_release, version,
+                                                   version_info['filename'])
+    if file_path is None and manifest is None:
+        await send_text(send, request, 404, "File not found")
+        return
+    if file_path is None:
+        await send_stream(send, receive, request, store.stream(manifest),
+                          size, manifest['created'],
+                          version_info['filename'], validators=validators)
+        return
+    await send_download(send, receive, scope, request, file_path, version_info['filename'],
+                        validators=validators)
+
+
+def _locate_release(version, filename):
+    """(file to send or None, store manifest to stream it from or None, its zip size).
+
+    Releases in the blob store are assembled on first request, then cached.
+    Blocking, so download() runs it on the executor.
+    """
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    if os.path.exists(file_path):
+        return file_path, None, None
+    manifest = store.manifest(version)
+    if manifest is None:
+        return None, None, None
+    cached_path = store.cached_zip(manifest)
+    if cached_path is not None:
+        return cached_path, None, None
+    return None, manifest, store.zip_size(manifest)
+
+
+async def download_bundle(send, receive, scope, request, version, filename, bundle):
+    """Send a reduced bundle of a release, built while it is sent the first time"""
+    try:
+        source, cached_path, size = await run_blocking(_open_bundle, version, filename, bundle)
+    except KeyError:
+        await send_text(send, request, 404, "Bundle not found")
+        return
+    except ValueError as e:
+        # The release zip is damaged or uses a compression we can't copy
+        print(f"Warning: can't build bundle {bundle!r} of {version}: {e}", file=sys.stderr)
+        await send_text(send, request, 404, "Bundle not available for this version")
+        return
+    if source is None:
+        await send_text(send, request, 404, "File not found")
+        return
+    download_name = bundle_filename(filename, bundle)
+    if cached_path is None:
+        await send_stream(send, receive, request,
+                          bundle_cache.put_stream(source.name, source.iter_zip(), source.mtime),
+                          size, source.mtime, download_name)
+        return
+    await send_download(send, receive, scope, request, cached_path, download_name)
+
+
+def _open_bundle(version, filename, bundle):
+    """(bundle source or None, its cached zip or None, its size if not cached).
+
+    Parses the release zip or manifest, so download_bundle() runs it on the
+    executor. KeyError for an undeclared bundle, ValueError for a release
+    zip it can't be cut from.
+    """
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    if os.path.exists(file_path):
+        source = ZipBundle(file_path, bundle)
+    else:
+        manifest = store.manifest(version)
+        if manifest is None:
+            return None, None, None
+        source = StoreBundle(store, manifest, bundle)
+    cached_path = bundle_cache.get(source.name)
+    if cached_path is not None:
+        return source, cached_path, None
+    return source, None, source.size()
+
+
+async def delta(send, receive, scope, request, from_version, to_version):
+    """Download a delta update package between two versions"""
+    generation = catalog.get()
+    delta_info = generation.find_delta(from_version, to_version)
+    if not delta_info:
+        await send_text(send, request, 404, "Delta not found")
+        return
+    file_path = os.path.join(UPLOAD_FOLDER, delta_info['filename'])
+    if not await run_blocking(os.path.exists, file_path):
+        await send_text(send, request, 404, "File not found")
+        return
+    await send_download(send, receive, scope, request, file_path, delta_info['filename'],
+                        validators=generation.delta_validators.get((from_version, to_version)))
+
+
+async def static_files(send, receive, scope, request, filename):
+    """Serve static files (like coder photo)"""
+    found = await run_blocking(_static_lookup, filename)
+    if found is None:
+        await send_text(send, request, 404, "Not Found")
+        return
+    file_path, variants, st = found
+    if variants:
+        await send_variants(send, request, *variants, cache_control='no-cache')
+        return
+    etag, _, last_modified = download_validators(st)
+    mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    headers = {
+        'Content-Type': mimetype,
+        'Content-Length': str(st.st_size),
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'no-cache',
+    }
+    if _not_modified(request, etag, last_modified):
+        await send_response(send, 304, headers, head=True)
+        return
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+    })
+    if request.method == 'HEAD':
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await stream_file(send, receive, scope, file_path, [(0, st.st_size)])
+
+
+def _static_lookup(filename):
+    """(path, precompressed variants or None, stat) of a static file, or None"""
+    file_path = safe_join(STATIC_DIR, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+    variants = static_variants(file_path)
+    if variants:
+        return file_path, variants, None
+    return file_path, None, os.stat(file_path)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Load the catalog before the first request arrives
+            catalog.get()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope)
+    if request.method not in ('GET', 'HEAD'):
+        await send_response(send, 405, {'Allow': 'GET, HEAD'})
+        return
+
+    path = request.path
+    segments = path.split('/')[1:]
+    if path == '/':
+        await index(send, request)
+    elif path == '/api/versions':
+        await api_versions(send, request)
+    elif path == '/api/latest':
+        await api_latest(send, request)
+    elif path == '/api/update':
+        await api_update(send, request)
+    elif path == '/api/mirrors':
+        await api_mirrors(send, request)
+    elif len(segments) == 2 and segments[0] == 'download' and segments[1]:
+        await download(send, receive, scope, request, segments[1])
+    elif len(segments) == 3 and segments[0] == 'delta' and all(segments[1:]):
+        await delta(send, receive, scope, request, segments[1], segments[2])
+    elif len(segments) >= 2 and segments[0] == 'static':
+        await static_files(send, receive, scope, request, '/'.join(segments[1:]))
+    else:
+        await send_text(send, request, 404, "Not Found")
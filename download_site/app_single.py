@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 """
-Single-file Flask application for Snake Idle download site.
-Contains all HTML, CSS, and JavaScript inline.
+Flask application for Snake Idle download site with the page inline.
+Contains all HTML, CSS, and JavaScript inline, so it needs no templates/ or
+static/style.css. Config, downloads, deltas and the API come from
+download_routes, shared with app.py.
 """
-from flask import Flask, send_file, jsonify
-from flask import render_template_string, send_from_directory
+from flask import Flask
+from flask import render_template_string, send_from_directory, abort
+from werkzeug.security import safe_join
 import os
-import json
-from datetime import datetime
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'downloads'
-app.config['VERSIONS_FILE'] = 'versions.json'
+import download_routes
+from responses import (IMMUTABLE_CACHE_CONTROL, cached_response, fingerprinted_path,
+                       offload_file, send_variants, static_fingerprint, static_variants)
 
-# Ensure downloads directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# static_files() below serves /static/, so skip Flask's built-in static route
+app = Flask(__name__, static_folder=None)
+app.config['ACCEL_STATIC_PREFIX'] = '/_protected/static/'
+catalog = download_routes.init_app(app)
+
+# Served by static_files() below
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
 
 # Embedded HTML template
 HTML_TEMPLATE = """<!DOCTYPE html>
@@ -39,7 +45,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
                 <h2>About the Coder</h2>
                 <div class="coder-content">
                     <div class="coder-photo">
-                        <img src="/static/coder_photo.jpeg" alt="HiddenHognose">
+                        <img src="{{ static_url('coder_photo.jpeg') }}" alt="HiddenHognose">
                     </div>
                     <div class="coder-text">
                         <p class="coder-greeting">Hey! My name's <strong>HiddenHognose</strong>, and I'm a small single-person game dev!</p>
@@ -440,57 +446,49 @@ footer {
     }
 }"""
 
-def load_versions():
-    """Load version information from JSON file"""
-    if os.path.exists(app.config['VERSIONS_FILE']):
-        with open(app.config['VERSIONS_FILE'], 'r') as f:
-            return json.load(f)
-    return []
+# The CSS never changes at runtime, so inline it once
+PAGE_TEMPLATE = HTML_TEMPLATE.replace('{{ css }}', CSS_STYLES)
 
 @app.route('/')
 def index():
     """Main download page"""
-    versions = load_versions()
-    # Sort: non-legacy first (newest first), then legacy
-    non_legacy = [v for v in versions if not v.get('legacy', False)]
-    legacy = [v for v in versions if v.get('legacy', False)]
-    non_legacy.sort(key=lambda x: x.get('version', '0'), reverse=True)
-    versions = non_legacy + legacy
-    
-    # Render template with embedded CSS
-    return render_template_string(HTML_TEMPLATE.replace('{{ css }}', CSS_STYLES), versions=versions)
-
-@app.route('/download/<version>')
-def download(version):
-    """Download a specific version"""
-    versions = load_versions()
-    version_info = next((v for v in versions if v['version'] == version), None)
-    
-    if not version_info:
-        return "Version not found", 404
-    
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], version_info['filename'])
-    
-    if not os.path.exists(file_path):
-        return "File not found", 404
+    # Versions come presorted from the catalog
+    generation = catalog.get()
     
-    return send_file(file_path, as_attachment=True, download_name=version_info['filename'])
+    # Render template with embedded CSS, only when versions.json or the photo changes
+    photo_url = static_url('coder_photo.jpeg')
+    return cached_response(generation, ('index', photo_url),
+                           lambda: render_template_string(PAGE_TEMPLATE,
+                                                          versions=generation.versions,
+                                                          static_url=static_url))
+
+def static_url(filename):
+    """URL of a static file, fingerprinted (coder_photo.<hash>.jpeg) when it is cached"""
+    fingerprint = static_fingerprint(os.path.join(STATIC_DIR, filename))
+    if fingerprint is None:
+        return '/static/' + filename
+    stem, ext = os.path.splitext(filename)
+    return f'/static/{stem}.{fingerprint}{ext}'
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
-    """Serve static files (like coder photo)"""
-    static_dir = os.path.join(os.path.dirname(__file__), 'static')
-    return send_from_directory(static_dir, filename)
-
-@app.route('/api/versions')
-def api_versions():
-    """API endpoint to get all versions"""
-    versions = load_versions()
-    non_legacy = [v for v in versions if not v.get('legacy', False)]
-    legacy = [v for v in versions if v.get('legacy', False)]
-    non_legacy.sort(key=lambda x: x.get('version', '0'), reverse=True)
-    versions = non_legacy + legacy
-    return jsonify(versions)
+    """Serve static files (like coder photo), small ones from memory"""
+    file_path = safe_join(STATIC_DIR, filename)
+    cache_control = None
+    if file_path is not None and not os.path.isfile(file_path):
+        # Fingerprinted names from static_url(): the content behind them never changes
+        file_path = fingerprinted_path(STATIC_DIR, filename)
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    if file_path is None or not os.path.isfile(file_path):
+        abort(404)
+    variants = static_variants(file_path)
+    if variants:
+        return send_variants(*variants, cache_control=cache_control)
+    # Too big for the memory cache
+    if app.config['SENDFILE_MODE']:
+        return offload_file(app.config['SENDFILE_MODE'], file_path,
+                            app.config['ACCEL_STATIC_PREFIX'] + filename)
+    return send_from_directory(STATIC_DIR, filename)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+HTTP benchmark for the download site.
+
+Builds a synthetic versions.json (from a couple of entries up to tens of
+thousands) and a generated release zip in a scratch directory, starts each
+app on a local port and drives it with keep-alive clients. Reports
+requests/sec, p50/p99 latency, bytes/sec and the server's peak RSS for every
+app, catalog size and scenario, and writes the results to a JSON file so
+runs can be compared.
+
+Example: python bench_http.py --catalog-sizes 2,1000,20000 --zip-size 16
+"""
+import argparse
+import http.client
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_APPS = 'app,app_single'
+DEFAULT_CATALOG_SIZES = '2,1000,20000'
+SCENARIOS = ['index', 'api_versions', 'download_full', 'download_range',
+             'conditional_index', 'conditional_download']
+
+# What a current browser sends; the pages and API are served precompressed
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate, br'
+
+# Per-request read size while draining response bodies
+READ_SIZE = 256 * 1024
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(app_name, port):
+    """Run one app in this process (used by the benchmark's child servers)"""
+    sys.path.insert(0, SCRIPT_DIR)
+    module = importlib.import_module(app_name)
+    if app_name == 'app_asgi':
+        import uvicorn
+        uvicorn.run(module.app, host='127.0.0.1', port=port, log_level='warning')
+        return
+    import logging
+    from werkzeug.serving import WSGIRequestHandler, run_simple
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Keep connections alive between requests like a production server would
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    run_simple('127.0.0.1', port, module.app, threaded=True)
+
+
+def write_release_zip(path, size):
+    """A valid zip of about size bytes with incompressible (stored) members"""
+    from zipwriter import ZipWriter, compress_bytes
+    member_size = 4 * 1024 * 1024
+    rng = random.Random(size)
+    with open(path, 'wb') as f:
+        writer = ZipWriter(f)
+        index = 0
+        remaining = size
+        while remaining > 0:
+            data = rng.randbytes(min(member_size, remaining))
+            writer.add(compress_bytes(f'images/asset_{index:04d}.png', data))
+            remaining -= len(data)
+            index += 1
+        writer.close()
+
+
+def build_catalog(workdir, count, zip_path):
+    """Write a versions.json with count entries; the newest points at zip_path"""
+    from catalog import sort_versions
+    from file_info import inspect_file
+
+    versions = []
+    for i in range(count):
+        legacy = i % 10 == 9
+        version = f'Beta_{i}' if legacy else f'1.{i // 100}.{i % 100}'
+        versions.append({
+            "version": version,
+            "date": f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+            "description": f"Synthetic release {version}",
+            "filename": f'snake_idle_{version}.zip',
+            "size": "0.00 MB",
+            "platform": "All Platforms",
+            "legacy": legacy,
+            "changelog": [f"Change {n} in {version}" for n in range(5)],
+        })
+    latest = sort_versions(versions)[0]
+
+    downloads = os.path.join(workdir, 'downloads')
+    os.makedirs(downloads, exist_ok=True)
+    target = os.path.join(downloads, latest['filename'])
+    shutil.copyfile(zip_path, target)
+    info = inspect_file(target)
+    latest.update(info)
+    latest['size'] = f"{info['bytes'] / (1024 * 1024):.2f} MB"
+
+    with open(os.path.join(workdir, 'versions.json'), 'w') as f:
+        json.dump(versions, f, indent=2)
+    return latest
+
+
+def _peak_rss_kb(pid):
+    """Current resident set size of a process in KiB (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    """Track the highest RSS of the server process while a scenario runs"""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = _peak_rss_kb(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+class Server:
+    """One app running in a child process on a free local port"""
+
+    def __init__(self, app_name, workdir):
+        self.app_name = app_name
+        self.port = _free_port()
+        env = dict(os.environ, METRICS_FILE=os.path.join(workdir, 'metrics.mmap'))
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', app_name,
+             '--port', str(self.port)],
+            cwd=workdir, env=env)
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.app_name} exited during startup")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.app_name} did not start within {timeout}s")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _request(conn, path, headers):
+    """One request on a keep-alive connection: (status, body bytes, etag)"""
+    conn.request('GET', path, headers=headers)
+    response = conn.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(READ_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+    if response.will_close:
+        conn.close()
+    return response.status, received, response.getheader('ETag')
+
+
+def scenario_requests(name, latest, etags, range_size, accept_encoding):
+    """Return a function (rng) -> (path, headers) for a scenario"""
+    download = f"/download/{latest['version']}"
+    size = latest['bytes']
+
+    def build(rng):
+        path, headers = _build(rng)
+        if accept_encoding:
+            headers['Accept-Encoding'] = accept_encoding
+        return path, headers
+
+    def _build(rng):
+        if name == 'index':
+            return '/', {}
+        if name == 'api_versions':
+            return '/api/versions', {}
+        if name == 'download_full':
+            return download, {}
+        if name == 'download_range':
+            start = rng.randrange(0, max(size - range_size, 1))
+            return download, {'Range': f'bytes={start}-{start + range_size - 1}'}
+        if name == 'conditional_index':
+            return '/', {'If-None-Match': etags['/']}
+        if name == 'conditional_download':
+            return download, {'If-None-Match': etags[download]}
+        raise ValueError(f"Unknown scenario {name!r}")
+    return build
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(server, build, concurrency, duration, max_requests=None):
+    """Drive the server from concurrency keep-alive clients for duration seconds"""
+    latencies = []
+    statuses = {}
+    totals = {'bytes': 0, 'errors': 0, 'requests': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+        local_latencies = []
+        local_statuses = {}
+        local_bytes = local_errors = 0
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and totals['requests'] >= max_requests:
+                    break
+                totals['requests'] += 1
+            path, headers = build(rng)
+            start = time.perf_counter()
+            try:
+                status, received, _ = _request(conn, path, headers)
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                continue
+            local_latencies.append(time.perf_counter() - start)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+            local_bytes += received
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            totals['bytes'] += local_bytes
+            totals['errors'] += local_errors
+
+    sampler = RssSampler(server.process.pid)
+    sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    peak_rss = sampler.stop()
+
+    latencies.sort()
+    p50 = _percentile(latencies, 0.50)
+    p99 = _percentile(latencies, 0.99)
+    return {
+        "requests": len(latencies),
+        "errors": totals['errors'],
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+        "bytes_per_sec": round(totals['bytes'] / elapsed),
+        "peak_rss_kb": peak_rss,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_http(apps, catalog_sizes, scenarios, zip_size, concurrency, duration,
+               range_size, accept_encoding, output):
+    """Run every app x catalog size x scenario and write the results"""
+    sys.path.insert(0, SCRIPT_DIR)
+    results = []
+    workdir = tempfile.mkdtemp(prefix='snake_idle_bench_')
+    try:
+        zip_path = os.path.join(workdir, 'release.zip')
+        print(f"Generating {zip_size / (1024 * 1024):.1f} MB release zip...")
+        write_release_zip(zip_path, zip_size)
+
+        for catalog_size in catalog_sizes:
+            site_dir = os.path.join(workdir, f'site_{catalog_size}')
+            os.makedirs(site_dir)
+            latest = build_catalog(site_dir, catalog_size, zip_path)
+
+            for app_name in apps:
+                print(f"\n{app_name}: {catalog_size} versions")
+                server = Server(app_name, site_dir)
+                try:
+                    # Warm the caches and collect validators for the conditional scenarios
+                    etags = {}
+                    conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=60)
+                    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+                    for path in ('/', '/api/versions', f"/download/{latest['version']}"):
+                        etags[path] = _request(conn, path, headers)[2]
+                    conn.close()
+
+                    for name in scenarios:
+                        build = scenario_requests(name, latest, etags, range_size, accept_encoding)
+                        result = run_scenario(server, build, concurrency, duration)
+                        result.update(app=app_name, catalog_size=catalog_size, scenario=name)
+                        results.append(result)
+                        print(f"  {name:<22} {result['requests_per_sec']:>9.1f} req/s  "
+                              f"p50 {result['p50_ms'] or 0:>8.2f} ms  "
+                              f"p99 {result['p99_ms'] or 0:>8.2f} ms  "
+                              f"{result['bytes_per_sec'] / (1024 * 1024):>8.1f} MB/s  "
+                              f"rss {result['peak_rss_kb'] or 0:>7} KB"
+                              + (f"  errors {result['errors']}" if result['errors'] else ''))
+                finally:
+                    server.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "zip_bytes": zip_size,
+            "concurrency": concurrency,
+            "duration": duration,
+            "range_bytes": range_size,
+            "accept_encoding": accept_encoding,
+        },
+        "results": results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Benchmark complete! Results written to {output}")
+    return report
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the download site over HTTP")
+    parser.add_argument('--apps', default=DEFAULT_APPS,
+                        help=f"comma-separated apps to run (app, app_single, app_asgi; "
+                             f"default: {DEFAULT_APPS})")
+    parser.add_argument('--catalog-sizes', default=DEFAULT_CATALOG_SIZES,
+                        help=f"comma-separated versions.json sizes (default: {DEFAULT_CATALOG_SIZES})")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help="comma-separated scenarios (default: all)")
+    parser.add_argument('--zip-size', type=float, default=16,
+                        help="size of the generated release zip in MB (default: 16)")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="parallel keep-alive clients (default: 8)")
+    parser.add_argument('--duration', type=float, default=5,
+                        help="seconds per scenario (default: 5)")
+    parser.add_argument('--range-size', type=int, default=64 * 1024,
+                        help="bytes per range request (default: 65536)")
+    parser.add_argument('--accept-encoding', default=DEFAULT_ACCEPT_ENCODING,
+                        help="Accept-Encoding sent with every request ('' for none)")
+    parser.add_argument('--output', default='bench_http_results.json',
+                        help="where to write the JSON results")
+    parser.add_argument('--serve', metavar='APP', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        sys.exit(0)
+
+    unknown = [name for name in _csv(args.scenarios) if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    bench_http(
+        apps=_csv(args.apps),
+        catalog_sizes=[int(n) for n in _csv(args.catalog_sizes)],
+        scenarios=_csv(args.scenarios),
+        zip_size=int(args.zip_size * 1024 * 1024),
+        concurrency=args.concurrency,
+        duration=args.duration,
+        range_size=args.range_size,
+        accept_encoding=args.accept_encoding,
+        output=args.output,
+    )
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Packaging benchmark for package_game.py and package_beta.py.
+
+Generates a synthetic game tree shaped like the real one (snake_idle_pygame.py,
+images/, memes/ and the top-level PNGs), commits it to a scratch git repo and
+runs package_game() and package_beta_version() themselves on it, across
+deflate levels, worker counts and cache states (store mode included, and the
+image stage with --optimize-images). Every run reports wall time, CPU time,
+input throughput, output size and the time spent in each packaging stage;
+results are written to a JSON file so packaging changes can be compared.
+
+Example: python bench_package.py --levels 1,6,9 --workers 1,4
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+
+from optimize_images import ImageSettings
+from package_beta import package_beta_version
+from package_game import IMAGE_MAX_SIZES, package_game
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCH_VERSION = 'bench'
+BENCH_ZIP = f'snake_idle_v{BENCH_VERSION}.zip'
+BETA_ZIP = 'snake_idle_beta1.zip'
+
+# none: plain build; cold: --incremental with empty caches; warm: every member
+# cached; previous: --previous with the last release zip; store: --store into
+# an empty blob store
+CACHE_STATES = ['none', 'cold', 'warm', 'previous', 'store']
+
+# Files in the synthetic tree: (path pattern, count, min KB, max KB)
+TREE_SHAPE = [
+    ('images/sprite_{:03d}.png', 40, 8, 200),
+    ('memes/meme_{:03d}.jpg', 45, 60, 250),
+    ('memes/meme_{:03d}.png', 15, 100, 400),
+]
+TOP_LEVEL_IMAGES = ['background.png', 'snaketummy.png', 'education.png', 'locked.png']
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SIGNATURE = b'\xff\xd8\xff\xe0'
+
+
+def _source_code(rng, size):
+    """Python-looking text that deflates about as well as the real game script"""
+    names = ['snake', 'score', 'upgrade', 'generator', 'meme', 'tummy', 'screen',
+             'achievement', 'tutorial', 'save', 'load', 'cost', 'rate', 'level']
+    lines = []
+    total = 0
+    while total < size:
+        a, b, c = rng.choice(names), rng.choice(names), rng.choice(names)
+        line = rng.choice([
+            f'def update_{a}_{b}(self, {c}):',
+            f'    self.{a}_{b} += {c} * {rng.randint(1, 999)}',
+            f'    if self.{a} > self.{b}_{c}:',
+            f'        return self.{c}_{a}',
+            f'    # Recalculate the {a} {b} after each {c}',
+            f'        pygame.draw.rect(self.screen, COLORS["{a}"], self.{b}_rect)',
+            '',
+        ])
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _image(rng, path, size):
+    """Incompressible bytes behind the right signature, like an optimized image"""
+    signature = _JPEG_SIGNATURE if path.endswith('.jpg') else _PNG_SIGNATURE
+    return signature + rng.randbytes(max(size - len(signature), 0))
+
+
+def _encoded_image(rng, path, size):
+    """A real PNG/JPEG of noise of roughly size bytes, for the image stage to decode"""
+    side = max(int((size / 3) ** 0.5), 8)
+    img = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+    out = io.BytesIO()
+    img.save(out, format='JPEG' if path.endswith('.jpg') else 'PNG', quality=95)
+    return out.getvalue()
+
+
+def build_tree(root_dir, scale=1.0, seed=0, real_images=False):
+    """Write the synthetic game tree; returns its total size in bytes"""
+    rng = random.Random(seed)
+    image = _encoded_image if real_images else _image
+    files = {
+        'snake_idle_pygame.py': _source_code(rng, int(400 * 1024 * scale)),
+        'requirements.txt': b'pygame>=2.5.0\n',
+        'README.md': _source_code(rng, 8 * 1024).replace(b'def ', b'## '),
+    }
+    for name in TOP_LEVEL_IMAGES:
+        files[name] = image(rng, name, rng.randint(300, 1000) * 1024)
+    for pattern, count, min_kb, max_kb in TREE_SHAPE:
+        for index in range(max(int(count * scale), 1)):
+            path = pattern.format(index)
+            files[path] = image(rng, path, rng.randint(min_kb, max_kb) * 1024)
+
+    for path, data in files.items():
+        full_path = os.path.join(root_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.write(data)
+    return sum(len(data) for data in files.values())
+
+
+def commit_tree(root_dir):
+    """Make root_dir a git repo with one commit; returns its hash or None"""
+    env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+    try:
+        for command in (['git', 'init', '-q'], ['git', 'add', '-A'],
+                        ['git', 'commit', '-q', '-m', 'Synthetic game tree']):
+            subprocess.run(command, cwd=root_dir, env=env, check=True, capture_output=True)
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root_dir, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class PhaseTimer:
+    """Accumulate seconds per phase; safe to use from pool threads"""
+
+    def __init__(self):
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def __call__(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[phase] = self.seconds.get(phase, 0.0) + elapsed
+
+
+def run_game(root_dir, out_dir, level, workers, state='none', previous_zip=None,
+               image_settings=None):
+    """Run package_game() into out_dir for one cache state, timing each stage.
+
+    Stages are walk, images, compress, hash (store only), write and
+    fingerprint. Returns (phases, sources, output bytes).
+    """
+    timer = PhaseTimer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        file_info, sources = package_game(
+            BENCH_VERSION, out_dir, workers=workers, level=level,
+            incremental=state in ('cold', 'warm', 'previous'),
+            previous_zip=previous_zip if state == 'previous' else None,
+            store_dir=os.path.join(out_dir, '.store') if state == 'store' else None,
+            image_settings=image_settings, root_dir=root_dir,
+            versions_file=os.path.join(out_dir, 'versions.json'), timer=timer)
+    counts = {}
+    for source in sources:
+        counts[source] = counts.get(source, 0) + 1
+    return timer.seconds, counts, file_info['bytes']
+
+
+def run_beta(repo_dir, commit_hash, out_dir, level, workers):
+    """Run package_beta_version() into out_dir, timing each stage (ls_tree, compress, write)"""
+    timer = PhaseTimer()
+    with contextlib.redirect_stdout(io.StringIO()):
+        packaged = package_beta_version(commit_hash, out_dir, repo_dir=repo_dir,
+                                        workers=workers, level=level, timer=timer)
+    if not packaged:
+        raise RuntimeError(f"package_beta could not read commit {commit_hash}")
+    zip_path = os.path.join(out_dir, BETA_ZIP)
+    with zipfile.ZipFile(zip_path) as zf:
+        count = len(zf.infolist())
+    return timer.seconds, {'compressed': count}, os.path.getsize(zip_path)
+
+
+def measure(run, repeat, input_bytes, prepare=None):
+    """Run a pipeline repeat times and keep the median wall-time run"""
+    runs = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        phases, sources, output_bytes = run()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        runs.append((wall, cpu, phases, sources, output_bytes))
+    runs.sort(key=lambda r: r[0])
+    wall, cpu, phases, sources, output_bytes = runs[len(runs) // 2]
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "wall_s_all": [round(r[0], 4) for r in runs],
+        "wall_s_stdev": round(statistics.pstdev([r[0] for r in runs]), 4),
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "ratio": round(output_bytes / input_bytes, 4),
+        "throughput_mb_s": round(input_bytes / (1024 * 1024) / wall, 2),
+        "phases_s": {phase: round(seconds, 4) for phase, seconds in sorted(phases.items())},
+        "sources": sources,
+    }
+
+
+def _print_result(label, result):
+    phases = '  '.join(f'{phase} {seconds:.3f}' for phase, seconds in result['phases_s'].items())
+    print(f"  {label:<34} wall {result['wall_s']:>7.3f}s  cpu {result['cpu_s']:>7.3f}s  "
+          f"{result['throughput_mb_s']:>7.1f} MB/s  "
+          f"{result['output_bytes'] / (1024 * 1024):>6.2f} MB  [{phases}]")
+
+
+def profile(run, path):
+    """Profile one serial run, save it for snakeviz/pstats and print the top"""
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    profiler.dump_stats(path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+    print(out.getvalue())
+    print(f"  Profile written to {path}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_package(tools, levels, workers_list, cache_states, scale, repeat,
+                  profile_dir, output, image_settings=None):
+    """Run every tool x level x workers x cache state and write the results"""
+    results = []
+    workdir = tempfile.mkdtemp(prefix='snake_idle_bench_pkg_')
+    try:
+        root_dir = os.path.join(workdir, 'game')
+        out_dir = os.path.join(workdir, 'out')
+        input_bytes = build_tree(root_dir, scale, real_images=image_settings is not None)
+        print(f"Synthetic game tree: {input_bytes / (1024 * 1024):.2f} MB in {root_dir}")
+
+        commit_hash = None
+        if 'beta' in tools:
+            commit_hash = commit_tree(root_dir)
+            if commit_hash is None:
+                print("  Warning: git not available, skipping package_beta")
+
+        def fresh():
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+        if 'game' in tools:
+            print("\npackage_game" + (" with --optimize-images" if image_settings else ""))
+            for level in levels:
+                for workers in workers_list:
+                    for state in cache_states:
+                        previous_zip = None
+                        prepare = fresh
+                        if state == 'warm':
+                            # One untimed build fills the member and image caches
+                            fresh()
+                            run_game(root_dir, out_dir, level, workers, state,
+                                     image_settings=image_settings)
+                            prepare = None
+                        elif state == 'previous':
+                            previous_dir = os.path.join(workdir, 'previous')
+                            shutil.rmtree(previous_dir, ignore_errors=True)
+                            run_game(root_dir, previous_dir, level, workers)
+                            previous_zip = os.path.join(previous_dir, BENCH_ZIP)
+
+                        def run():
+                            return run_game(root_dir, out_dir, level, workers, state,
+                                            previous_zip, image_settings)
+
+                        result = measure(run, repeat, input_bytes, prepare)
+                        result.update(tool='game', level=level, workers=workers, cache=state,
+                                      optimize_images=image_settings is not None)
+                        results.append(result)
+                        _print_result(f'level {level}, {workers} workers, cache {state}', result)
+
+        if 'beta' in tools and commit_hash:
+            print("\npackage_beta")
+            for level in levels:
+                for workers in workers_list:
+                    result = measure(
+                        lambda: run_beta(root_dir, commit_hash, out_dir, level, workers),
+                        repeat, input_bytes, fresh)
+                    result.update(tool='beta', level=level, workers=workers, cache='none')
+                    results.append(result)
+                    _print_result(f'level {level}, {workers} workers', result)
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            if 'game' in tools:
+                print("\nProfile: package_game, level 6, serial")
+                fresh()
+                profile(lambda: run_game(root_dir, out_dir, 6, 1,
+                                         image_settings=image_settings),
+                        os.path.join(profile_dir, 'package_game.prof'))
+            if 'beta' in tools and commit_hash:
+                print("\nProfile: package_beta, level 6, 1 worker")
+                fresh()
+                profile(lambda: run_beta(root_dir, commit_hash, out_dir, 6, 1),
+                        os.path.join(profile_dir, 'package_beta.prof'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": scale,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Benchmark complete! Results written to {output}")
+    return report
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark game packaging")
+    parser.add_argument('--tools', default='game,beta',
+                        help="comma-separated packagers: game, beta (default: both)")
+    parser.add_argument('--levels', default='1,6,9',
+                        help="comma-separated deflate levels (default: 1,6,9)")
+    parser.add_argument('--workers', default=f'1,{os.cpu_count() or 1}',
+                        help="comma-separated worker counts (default: 1 and CPU count)")
+    parser.add_argument('--cache', default=','.join(CACHE_STATES),
+                        help=f"comma-separated cache states for package_game "
+                             f"({', '.join(CACHE_STATES)}; default: all)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiply the number of files in the synthetic tree")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per configuration; the median is reported (default: 3)")
+    parser.add_argument('--optimize-images', action='store_true',
+                        help="build real images and include the image stage (needs Pillow)")
+    parser.add_argument('--profile', metavar='DIR', default=None,
+                        help="also profile one serial run of each tool into DIR")
+    parser.add_argument('--output', default='bench_package_results.json',
+                        help="where to write the JSON results")
+    args = parser.parse_args()
+
+    cache_states = _csv(args.cache)
+    unknown = [state for state in cache_states if state not in CACHE_STATES]
+    if unknown:
+        parser.error(f"unknown cache states: {', '.join(unknown)}")
+    image_settings = None
+    if args.optimize_images:
+        if Image is None:
+            parser.error("--optimize-images needs Pillow (pip install Pillow)")
+        image_settings = ImageSettings(IMAGE_MAX_SIZES, 85)
+
+    bench_package(
+        tools=_csv(args.tools),
+        levels=[int(level) for level in _csv(args.levels)],
+        workers_list=sorted(set(int(n) for n in _csv(args.workers))),
+        cache_states=cache_states,
+        scale=args.scale,
+        repeat=max(args.repeat, 1),
+        profile_dir=args.profile,
+        output=args.output,
+        image_settings=image_settings,
+    )
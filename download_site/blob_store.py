@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Content-addressed store of release files, shared by every version.
+
+Each unique file is kept once under blobs/, already compressed the way it
+goes into a zip, and named by the SHA-256 of its content. A version is a
+small manifest listing its members and their blobs, so keeping every
+historical release costs about the size of the unique content. Release
+zips are assembled from the store by copying blobs, never recompressing,
+and always come out byte-for-byte identical.
+
+Usage:
+    python blob_store.py import <version> <zip>   # move an existing zip in
+    python blob_store.py stats
+    python blob_store.py gc                       # drop unreferenced blobs
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+from urllib.parse import quote, unquote
+
+from disk_cache import DiskCache
+from member_cache import PreviousRelease
+from zipwriter import (ZIP_DEFLATED, ZIP_STORED, Member, archive_size, compress_bytes,
+                       should_store, stream_zip)
+
+# Read size when streaming blobs into an archive
+CHUNK_SIZE = 256 * 1024
+
+
+def file_digest(path):
+    """SHA-256 of a file's content, the key its blob is stored under"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class BlobStore:
+    """blobs/<xx>/<sha256>.<compress type>, manifests/<version>.json and a zip cache
+
+    With cache_bytes, assembled zips are kept in cache/ (least recently
+    used first out) so popular versions are served as plain files.
+    """
+
+    def __init__(self, root, cache_bytes=None):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.manifest_dir = os.path.join(root, 'manifests')
+        self.cache = DiskCache(os.path.join(root, 'cache'), cache_bytes) if cache_bytes else None
+
+    def blob_path(self, blob):
+        return os.path.join(self.blob_dir, blob[:2], blob)
+
+    def manifest_path(self, version):
+        return os.path.join(self.manifest_dir, quote(version, safe='') + '.json')
+
+    def _find_blob(self, digest, arcname):
+        """Existing blob for this content that may be used under arcname"""
+        # Content that didn't deflate well is stored; that blob serves either way
+        candidates = [f'{digest}.{ZIP_STORED}']
+        if not should_store(arcname):
+            candidates.insert(0, f'{digest}.{ZIP_DEFLATED}')
+        for blob in candidates:
+            if os.path.exists(self.blob_path(blob)):
+                return blob
+        return None
+
+    def add(self, member, digest):
+        """Store a compressed member under the SHA-256 of its content.
+
+        Returns its manifest record. If the content is already stored, the
+        existing blob is used and the member's payload is not written again.
+        """
+        blob = self._find_blob(digest, member.arcname)
+        if blob is None:
+            blob = f'{digest}.{member.compress_type}'
+            _atomic_write(self.blob_path(blob), member.data)
+        return {
+            "arcname": member.arcname.replace(os.sep, '/'),
+            "blob": blob,
+            "compress_type": int(blob.rsplit('.', 1)[1]),
+            "crc": member.crc,
+            "compress_size": os.path.getsize(self.blob_path(blob)),
+            "file_size": member.file_size,
+            "date_time": list(member.date_time),
+            "external_attr": member.external_attr,
+        }
+
+    def publish(self, version, records):
+        """Write a version's manifest (atomically); returns the manifest"""
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        manifest = {"version": version, "created": int(time.time()), "members": records}
+        _atomic_write(self.manifest_path(version),
+                      json.dumps(manifest, indent=2).encode('utf-8'))
+        return manifest
+
+    def manifest(self, version):
+        """A version's manifest, or None if the store doesn't have it"""
+        try:
+            with open(self.manifest_path(version), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def versions(self):
+        """Versions with a manifest in the store"""
+        if not os.path.isdir(self.manifest_dir):
+            return []
+        return [unquote(name[:-len('.json')])
+                for name in sorted(os.listdir(self.manifest_dir)) if name.endswith('.json')]
+
+    @staticmethod
+    def _records(manifest, include=None):
+        return [r for r in manifest['members'] if include is None or include(r['arcname'])]
+
+    @classmethod
+    def members(cls, manifest, include=None):
+        """zipwriter Members (without data) for a manifest.
+
+        include, if given, is a predicate on arcnames picking the members.
+        """
+        return [Member(r['arcname'], r['compress_type'], r['crc'], r['compress_size'],
+                       r['file_size'], tuple(r['date_time']), r['external_attr'], None)
+                for r in cls._records(manifest, include)]
+
+    @staticmethod
+    def fingerprint(manifest):
+        """Short hash that changes whenever the assembled zip or its mtime would"""
+        key = json.dumps([manifest['created'], manifest['members']], sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+
+    def zip_size(self, manifest, include=None):
+        """Exact size of the assembled zip, known before building it"""
+        return archive_size(self.members(manifest, include))
+
+    def _blob_chunks(self, blob):
+        with open(self.blob_path(blob), 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_zip(self, manifest, include=None):
+        """Assemble the release zip as a stream of chunks, copying blobs raw"""
+        records = self._records(manifest, include)
+        return stream_zip((member, self._blob_chunks(record['blob']))
+                          for member, record in zip(self.members(manifest, include), records))
+
+    def zip_info(self, manifest):
+        """sha256/bytes/mtime of the assembled zip, as file_info.inspect_file reports"""
+        sha256 = hashlib.sha256()
+        size = 0
+        for chunk in self.iter_zip(manifest):
+            sha256.update(chunk)
+            size += len(chunk)
+        return {"sha256": sha256.hexdigest(), "bytes": size, "mtime": manifest['created']}
+
+    def _cache_name(self, manifest):
+        return self.fingerprint(manifest) + '.zip'
+
+    def cached_zip(self, manifest):
+        """Path of the assembled zip if it is in the cache, or None"""
+        if self.cache is None:
+            return None
+        return self.cache.get(self._cache_name(manifest))
+
+    def stream(self, manifest):
+        """iter_zip, also saving the zip to the cache once it has been sent in full.
+
+        The cached file's mtime is the manifest's creation time, so it gets
+        the same validators as the streamed response.
+        """
+        chunks = self.iter_zip(manifest)
+        if self.cache is None:
+            return chunks
+        return self.cache.put_stream(self._cache_name(manifest), chunks,
+                                     mtime=manifest['created'])
+
+    def import_zip(self, version, zip_path):
+        """Move a release zip into the store, reusing its compressed members"""
+        previous = PreviousRelease(zip_path)
+        records = []
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    data = zf.read(info)
+                    digest = hashlib.sha256(data).hexdigest()
+                    member_args = (info.filename, info.date_time, info.external_attr)
+                    member = previous.get(digest, info.CRC, info.file_size, member_args)
+                    if member is None:
+                        member = compress_bytes(info.filename, data, 6, *member_args[1:])
+                    records.append(self.add(member, digest))
+        finally:
+            previous.close()
+        return self.publish(version, records)
+
+    def stats(self):
+        """(versions, unique blob bytes, bytes the zips would take)"""
+        blob_bytes = 0
+        if os.path.isdir(self.blob_dir):
+            for root, _, files in os.walk(self.blob_dir):
+                blob_bytes += sum(os.path.getsize(os.path.join(root, f))
+                                  for f in files if not f.startswith('.'))
+        versions = self.versions()
+        zip_bytes = sum(self.zip_size(self.manifest(v)) for v in versions)
+        return len(versions), blob_bytes, zip_bytes
+
+    def gc(self):
+        """Delete blobs no manifest refers to; returns (count, bytes).
+
+        Don't run it while a release is being published into the store.
+        """
+        referenced = set()
+        for version in self.versions():
+            referenced.update(r['blob'] for r in self.manifest(version)['members'])
+        removed = freed = 0
+        if not os.path.isdir(self.blob_dir):
+            return removed, freed
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                if name not in referenced and not name.startswith('.'):
+                    path = os.path.join(root, name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                    removed += 1
+        return removed, freed
+
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.2f} MB"
+
+
+if __name__ == '__main__':
+    from file_info import record_file_info
+
+    parser = argparse.ArgumentParser(description="Manage the release blob store")
+    parser.add_argument('--store', default=os.path.join('downloads', '.store'),
+                        help="store directory (default: downloads/.store)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help="move an existing release zip into the store")
+    import_parser.add_argument('version')
+    import_parser.add_argument('zip')
+    import_parser.add_argument('--remove', action='store_true',
+                               help="delete the zip once it is in the store")
+    commands.add_parser('stats', help="show how much space the store saves")
+    commands.add_parser('gc', help="delete blobs no version uses")
+    args = parser.parse_args()
+
+    store = BlobStore(args.store)
+    if args.command == 'import':
+        manifest = store.import_zip(args.version, args.zip)
+        file_info = store.zip_info(manifest)
+        # The assembled zip isn't byte-identical to the imported one; publish its hash
+        updated = record_file_info('versions.json', os.path.basename(args.zip), file_info)
+        if args.remove:
+            os.remove(args.zip)
+        print(f"\n✓ Imported {args.version}: {len(manifest['members'])} members")
+        print(f"  Zip size: {_mb(file_info['bytes'])}")
+        print(f"  SHA-256: {file_info['sha256']}")
+        if updated:
+            print(f"  Updated {updated} entry in versions.json")
+    elif args.command == 'stats':
+        count, blob_bytes, zip_bytes = store.stats()
+        print(f"Versions: {count}")
+        print(f"Unique content: {_mb(blob_bytes)}")
+        print(f"As separate zips: {_mb(zip_bytes)}")
+        if zip_bytes:
+            print(f"Saved: {1 - blob_bytes / zip_bytes:.1%}")
+    elif args.command == 'gc':
+        removed, freed = store.gc()
+        print(f"✓ Removed {removed} unused blobs ({_mb(freed)})")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Script to build the static gh-pages site from versions.json
+
+Renders templates/index.html and a static api/versions.json into gh-pages/.
+Static assets get content-hashed names (style.<hash>.css) so they can be
+cached forever, and outputs are only rewritten when their inputs changed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+from jinja2 import Environment, FileSystemLoader
+
+from catalog import CatalogGeneration, valid_entries
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Assets referenced by the template, fingerprinted on the way out
+STATIC_ASSETS = [
+    'style.css',
+    'coder_photo.jpeg',
+]
+
+# Remembers the input hash of every output between runs
+STATE_FILE = '.build_state.json'
+
+# For hosts that read a _headers file (Netlify, Cloudflare Pages)
+HEADERS_TEMPLATE = """/*
+  X-Content-Type-Options: nosniff
+
+/index.html
+  Cache-Control: public, max-age=0, must-revalidate
+
+/api/*
+  Cache-Control: public, max-age=300
+
+{immutable}"""
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprinted_name(filename, data):
+    """style.css -> style.<hash>.css"""
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{_sha256(data)[:12]}{ext}'
+
+
+def _write_if_changed(output_dir, name, data, key, state):
+    """Write an output unless its inputs are unchanged since the last build"""
+    path = os.path.join(output_dir, name)
+    if state.get(name) == key and os.path.exists(path):
+        print(f"  Unchanged: {name}")
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    state[name] = key
+    print(f"  Wrote: {name}")
+    return True
+
+
+def build_pages(output_dir=None, versions_file=None):
+    """Render the download page, API file and fingerprinted assets"""
+    output_dir = output_dir or os.path.join(SCRIPT_DIR, 'gh-pages')
+    versions_file = versions_file or os.path.join(SCRIPT_DIR, 'versions.json')
+    os.makedirs(output_dir, exist_ok=True)
+
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+
+    print(f"Building static site in {output_dir}...")
+
+    # Fingerprinted assets: the name is the content hash, so existing = current
+    asset_urls = {}
+    for filename in STATIC_ASSETS:
+        with open(os.path.join(SCRIPT_DIR, 'static', filename), 'rb') as f:
+            data = f.read()
+        hashed = fingerprinted_name(filename, data)
+        asset_urls[filename] = hashed
+        target = os.path.join(output_dir, hashed)
+        if os.path.exists(target):
+            print(f"  Unchanged: {hashed}")
+        else:
+            shutil.copyfile(os.path.join(SCRIPT_DIR, 'static', filename), target)
+            print(f"  Wrote: {hashed}")
+        # Drop older fingerprints of the same asset, and the unhashed copy
+        # from before the site was generated
+        stem, ext = os.path.splitext(filename)
+        for existing in os.listdir(output_dir):
+            if existing == filename or (
+                    existing != hashed and existing.startswith(stem + '.')
+                    and existing.endswith(ext) and existing.count('.') == 2):
+                os.remove(os.path.join(output_dir, existing))
+                print(f"  Removed: {existing}")
+
+    with open(versions_file, 'rb') as f:
+        versions_bytes = f.read()
+    try:
+        loaded = json.loads(versions_bytes)
+    except ValueError as e:
+        print(f"Error: {versions_file} is not valid JSON ({e})")
+        return False
+    if not isinstance(loaded, list):
+        print(f"Error: {versions_file} must hold a list of versions")
+        return False
+    # The same checks, order and de-duplication as the Flask apps' catalog
+    generation = CatalogGeneration(valid_entries(loaded, versions_file), None, 0)
+    versions = generation.versions
+
+    # Static copy of /api/versions
+    api_payload = generation.api_payload.encode('utf-8')
+    _write_if_changed(output_dir, 'api/versions.json', api_payload,
+                      _sha256(versions_bytes), state)
+
+    # The page depends on the template, the catalog and the asset names
+    template_path = os.path.join(SCRIPT_DIR, 'templates', 'index.html')
+    with open(template_path, 'rb') as f:
+        template_bytes = f.read()
+    page_key = _sha256(template_bytes + versions_bytes
+                       + json.dumps(asset_urls, sort_keys=True).encode('utf-8'))
+    if state.get('index.html') != page_key or not os.path.exists(
+            os.path.join(output_dir, 'index.html')):
+        entries = generation.by_version
+
+        def url_for(endpoint, **values):
+            """Stand-in for Flask's url_for with relative static-host URLs"""
+            if endpoint == 'static':
+                return asset_urls.get(values['filename'], values['filename'])
+            if endpoint == 'download':
+                return 'downloads/' + entries[values['version']]['filename']
+            raise ValueError(f"No static URL for endpoint {endpoint!r}")
+
+        env = Environment(loader=FileSystemLoader(os.path.dirname(template_path)),
+                          autoescape=True)
+        env.globals['url_for'] = url_for
+        html = env.get_template('index.html').render(versions=versions)
+        _write_if_changed(output_dir, 'index.html', html.encode('utf-8'), page_key, state)
+    else:
+        print("  Unchanged: index.html")
+
+    immutable = ''.join(f'/{name}\n  Cache-Control: public, max-age=31536000, immutable\n\n'
+                        for name in asset_urls.values())
+    headers = HEADERS_TEMPLATE.format(immutable=immutable).encode('utf-8')
+    _write_if_changed(output_dir, '_headers', headers, _sha256(headers), state)
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    print("\n✓ Static site built!")
+    return True
+
+
+if __name__ == '__main__':
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    if not build_pages(output_dir):
+        sys.exit(1)
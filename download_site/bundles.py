@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Reduced asset bundles of a release, built on demand.
+
+A bundle keeps a declared subset of a release's members (BUNDLES in
+release_layout.py). Its zip is streamed straight from the full release, either
+the zip in downloads/ or the blob store, with every member copied raw, never
+recompressed. The exact size is known before the first byte is sent, and
+nothing is buffered or written to a temp file first.
+"""
+import hashlib
+import os
+import zipfile
+
+from member_cache import can_copy_raw, payload_offset
+from release_layout import BUNDLES
+from zipwriter import Member, archive_size, stream_zip
+
+# Read size when copying members into a bundle
+CHUNK_SIZE = 256 * 1024
+
+
+def bundle_includes(bundle):
+    """Predicate on arcnames for a declared bundle; KeyError if there is none"""
+    items = BUNDLES[bundle]
+
+    def include(arcname):
+        return any(arcname == item or arcname.startswith(item + '/') for item in items)
+    return include
+
+
+def bundle_filename(filename, bundle):
+    """Download name for a bundle: snake_idle_v1.0.0.zip -> snake_idle_v1.0.0_lite.zip"""
+    base, ext = os.path.splitext(filename)
+    return f'{base}_{bundle}{ext}'
+
+
+class ZipBundle:
+    """A bundle cut from a release zip on disk"""
+
+    def __init__(self, zip_path, bundle):
+        self.include = bundle_includes(bundle)
+        self.zip_path = zip_path
+        st = os.stat(zip_path)
+        self.mtime = int(st.st_mtime)
+        key = f'{bundle}:{os.path.basename(zip_path)}:{st.st_mtime_ns}:{st.st_size}'
+        # Cache file name; changes whenever the release zip does
+        self.name = f'{bundle}-{hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]}.zip'
+        self._infos = None
+
+    def infos(self):
+        """Members the bundle keeps; ValueError if they can't be copied out of the zip"""
+        if self._infos is None:
+            try:
+                with zipfile.ZipFile(self.zip_path) as zf:
+                    infos = [info for info in zf.infolist()
+                             if not info.is_dir() and self.include(info.filename)]
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"{self.zip_path}: {e}")
+            for info in infos:
+                if not can_copy_raw(info):
+                    raise ValueError(f"{info.filename}: can't copy compress type {info.compress_type}")
+            self._infos = infos
+        return self._infos
+
+    def members(self):
+        return [Member(info.filename, info.compress_type, info.CRC, info.compress_size,
+                       info.file_size, info.date_time, info.external_attr, None)
+                for info in self.infos()]
+
+    def size(self):
+        return archive_size(self.members())
+
+    def _payload(self, f, info):
+        f.seek(payload_offset(f, info))
+        remaining = info.compress_size
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"{self.zip_path}: {info.filename} is truncated")
+            remaining -= len(chunk)
+            yield chunk
+
+    def _entries(self):
+        with open(self.zip_path, 'rb') as f:
+            for member, info in zip(self.members(), self.infos()):
+                yield member, self._payload(f, info)
+
+    def iter_zip(self):
+        """The bundle's zip as a stream of chunks"""
+        return stream_zip(self._entries())
+
+
+class StoreBundle:
+    """A bundle assembled from a version's manifest in the blob store"""
+
+    def __init__(self, store, manifest, bundle):
+        self.include = bundle_includes(bundle)
+        self.store = store
+        self.manifest = manifest
+        self.mtime = manifest['created']
+        self.name = f'{bundle}-{store.fingerprint(manifest)}.zip'
+
+    def size(self):
+        return self.store.zip_size(self.manifest, self.include)
+
+    def iter_zip(self):
+        return self.store.iter_zip(self.manifest, self.include)
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Shared in-process cache of versions.json for the download site apps.
+
+The catalog is only re-read when the file's mtime or size changes. Each load
+builds a generation holding the sorted version list, a version -> entry index
+and the serialized /api/versions payload, so normal requests never parse JSON
+or sort anything. Filtered /api/versions queries are answered from indexes
+built at load time (platform, legacy flag, release date).
+"""
+import base64
+import binascii
+import bisect
+import heapq
+import json
+import os
+import re
+import sys
+import threading
+from datetime import datetime
+
+from file_info import entry_validators
+from file_watch import FileWatcher
+
+# Entries with this platform are offered to every platform filter
+ALL_PLATFORMS = 'all platforms'
+
+# 1.2.3, v1.2, 1.2.3-beta.1, 1.2.3+build (build metadata is ignored)
+_SEMVER = re.compile(r'^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+
+# Page sizes for cursor pagination of /api/versions
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def version_key(version):
+    """Sort key ordering versions by semantic version (10.0.0 > 9.0.0).
+
+    Pre-releases sort before their release, and strings that aren't
+    versions at all sort before every real version, by their text.
+    """
+    match = _SEMVER.match(str(version).strip())
+    if not match:
+        return (0, (), (), str(version))
+    release = tuple(int(part or 0) for part in match.group(1, 2, 3))
+    if match.group(4) is None:
+        return (1, release, (1,), '')
+    # Numeric identifiers sort below alphanumeric ones, as in semver
+    pre = tuple((0, int(p), '') if p.isdigit() else (1, 0, p)
+                for p in match.group(4).split('.'))
+    return (1, release, (0,) + pre, '')
+
+
+def check_entry(entry):
+    """Raise ValueError if a versions.json entry can't be served"""
+    if not isinstance(entry, dict):
+        raise ValueError("not an object")
+    for name in ('version', 'filename'):
+        if not isinstance(entry.get(name), str) or not entry[name]:
+            raise ValueError(f"'{name}' must be a non-empty string")
+    entry_validators(entry)
+    for name in ('deltas', 'mirrors', 'changelog'):
+        if not isinstance(entry.get(name, []), list):
+            raise ValueError(f"'{name}' must be a list")
+    for delta in entry.get('deltas', []):
+        if not isinstance(delta, dict) or not isinstance(delta.get('filename'), str):
+            raise ValueError("every delta needs a 'filename'")
+        entry_validators(delta)
+
+
+def valid_entries(versions, path):
+    """The entries of a versions.json list that pass check_entry, warning about the rest"""
+    entries = []
+    for i, entry in enumerate(versions):
+        try:
+            check_entry(entry)
+        except ValueError as e:
+            name = entry.get('version', f'#{i}') if isinstance(entry, dict) else f'#{i}'
+            print(f"Warning: skipping entry {name!r} in {path}: {e}", file=sys.stderr)
+            continue
+        entries.append(entry)
+    return entries
+
+
+def sort_versions(versions):
+    """Sort: non-legacy versions first (newest first), then legacy versions"""
+    non_legacy = [v for v in versions if not v.get('legacy', False)]
+    legacy = [v for v in versions if v.get('legacy', False)]
+    non_legacy.sort(key=lambda x: version_key(x.get('version', '0')), reverse=True)
+    return non_legacy + legacy
+
+
+def dump_api_payload(versions):
+    """Serialize versions the same way Flask's jsonify does"""
+    return json.dumps(versions, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def encode_cursor(version):
+    """Opaque pagination cursor pointing after a version"""
+    return base64.urlsafe_b64encode(version.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Version named by a cursor; raises ValueError if it is malformed"""
+    try:
+        return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def _parse_bool(value, name):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"'{name}' must be true or false")
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"'{name}' must be a YYYY-MM-DD date")
+
+
+def parse_version_query(args):
+    """Turn /api/versions query arguments into CatalogGeneration.query() kwargs.
+
+    Returns None when there are none (the full catalog is wanted) and raises
+    ValueError with a client-facing message for bad values.
+    """
+    query = {}
+    if args.get('platform'):
+        query['platform'] = args['platform']
+    if args.get('legacy'):
+        query['legacy'] = _parse_bool(args['legacy'], 'legacy')
+    for name in ('since', 'until'):
+        if args.get(name):
+            query[name] = _parse_date(args[name], name)
+    if args.get('fields'):
+        query['fields'] = tuple(f.strip() for f in args['fields'].split(',') if f.strip())
+    if args.get('cursor'):
+        query['cursor'] = decode_cursor(args['cursor'])
+    if args.get('limit') or 'cursor' in query:
+        try:
+            limit = int(args.get('limit') or DEFAULT_PAGE_SIZE)
+        except ValueError:
+            raise ValueError("'limit' must be a number")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+        query['limit'] = limit
+    return query or None
+
+
+class CatalogGeneration:
+    """One immutable snapshot of versions.json"""
+
+    def __init__(self, versions, stat_key, number):
+        self.number = number
+        # (mtime_ns, size) of the file this snapshot was read from, or None
+        self.stat_key = stat_key
+        self.mtime = stat_key[0] / 1e9 if stat_key else None
+        # Keep the first entry for a duplicated version, like the old next() scan,
+        # and drop the others: pagination cursors need one position per version
+        self.versions = []
+        self.by_version = {}
+        for v in sort_versions(versions):
+            if v.get('version') not in self.by_version:
+                self.by_version[v.get('version')] = v
+                self.versions.append(v)
+        # Published sha256/size/mtime turned into ready-to-send header values
+        self.validators = {}
+        for version, v in self.by_version.items():
+            validators = entry_validators(v)
+            if validators:
+                self.validators[version] = validators
+        # Mirror base URLs that also serve a version's file
+        self.mirrors = {}
+        for version, v in self.by_version.items():
+            urls = [url for url in v.get('mirrors', []) if isinstance(url, str) and url]
+            if urls:
+                self.mirrors[version] = urls
+        # Delta packages: (from, to) -> entry, plus edges for update planning
+        self.deltas = {}
+        self.deltas_from = {}
+        self.delta_validators = {}
+        for version, v in self.by_version.items():
+            for delta in v.get('deltas', []):
+                key = (delta.get('from'), version)
+                self.deltas[key] = delta
+                self.deltas_from.setdefault(key[0], []).append((version, delta))
+                validators = entry_validators(delta)
+                if validators:
+                    self.delta_validators[key] = validators
+        self._build_query_indexes()
+        # Newest non-legacy release, the target of every update
+        self.latest = next((v for v in self.versions if not v.get('legacy', False)), None)
+        self.api_payload = dump_api_payload(self.versions)
+        # Artifacts derived from this snapshot (rendered pages etc.)
+        self._derived = {}
+
+    def _build_query_indexes(self):
+        """Positions (in self.versions order) by platform, legacy flag and date"""
+        self.position = {}
+        self.by_platform = {}
+        self.by_legacy = {True: [], False: []}
+        dated = []
+        for i, v in enumerate(self.versions):
+            self.position[v.get('version')] = i
+            platform = str(v.get('platform', '')).lower()
+            self.by_platform.setdefault(platform, []).append(i)
+            self.by_legacy[bool(v.get('legacy', False))].append(i)
+            dated.append((str(v.get('date', '')), i))
+        dated.sort()
+        self.dates = [date for date, _ in dated]
+        self.date_positions = [i for _, i in dated]
+
+        # Ascending semver keys of current releases, per platform, for bisect.
+        # None covers every platform.
+        releases = sorted((version_key(self.versions[i].get('version', '0')), i)
+                          for i in self.by_legacy[False])
+        self.releases = {None: releases}
+        for platform in self.by_platform:
+            if platform == ALL_PLATFORMS:
+                continue
+            self.releases[platform] = [
+                (key, i) for key, i in releases
+                if str(self.versions[i].get('platform', '')).lower() in (platform, ALL_PLATFORMS)]
+        self.releases.setdefault(ALL_PLATFORMS, [
+            (key, i) for key, i in releases
+            if str(self.versions[i].get('platform', '')).lower() == ALL_PLATFORMS])
+
+    def find(self, version):
+        """Look up a version entry, or None"""
+        return self.by_version.get(version)
+
+    def _platform_positions(self, platform):
+        """Builds for a platform, including the ones for all platforms"""
+        platform = platform.lower()
+        positions = self.by_platform.get(platform, [])
+        if platform != ALL_PLATFORMS:
+            positions = list(heapq.merge(positions, self.by_platform.get(ALL_PLATFORMS, [])))
+        return positions
+
+    def latest_for(self, current=None, platform=None):
+        """Tiny update-check payload for /api/latest, or None if nothing matches.
+
+        platform picks that platform's builds plus "All Platforms" ones;
+        unknown platforms only get the latter. With current, the payload says
+        whether a newer release exists (current doesn't have to be listed).
+        """
+        if platform is not None:
+            platform = platform.lower()
+            if platform not in self.releases:
+                platform = ALL_PLATFORMS
+        releases = self.releases[platform]
+        if not releases:
+            return None
+        update_available = None
+        if current is not None:
+            position = bisect.bisect_right(releases, (version_key(current), len(self.versions)))
+            update_available = position < len(releases)
+        key = ('latest', platform, update_available)
+        return self.cached(key, lambda: self._latest_payload(releases[-1][1], update_available))
+
+    def _latest_payload(self, position, update_available):
+        latest = self.versions[position]
+        payload = {
+            "version": latest.get('version'),
+            "date": latest.get('date'),
+            "url": f"/download/{latest.get('version')}",
+            "bytes": latest.get('bytes'),
+            "sha256": latest.get('sha256'),
+        }
+        if update_available is not None:
+            payload["update_available"] = update_available
+        return dump_api_payload(payload)
+
+    def query(self, platform=None, legacy=None, since=None, until=None,
+              fields=None, cursor=None, limit=None):
+        """Filter, project and page the catalog from the load-time indexes.
+
+        Returns (entries, next_cursor); next_cursor is None on the last page
+        or when limit is None. since/until are inclusive YYYY-MM-DD dates.
+        Raises ValueError for a cursor naming an unknown version.
+        """
+        candidates = []
+        if platform is not None:
+            candidates.append(self._platform_positions(platform))
+        if legacy is not None:
+            candidates.append(self.by_legacy[legacy])
+        if since is not None or until is not None:
+            lo = bisect.bisect_left(self.dates, since) if since else 0
+            hi = bisect.bisect_right(self.dates, until) if until else len(self.dates)
+            candidates.append(sorted(self.date_positions[lo:hi]))
+
+        if candidates:
+            # Walk the smallest index, checking membership in the others
+            candidates.sort(key=len)
+            others = [set(c) for c in candidates[1:]]
+            positions = [i for i in candidates[0] if all(i in o for o in others)]
+        else:
+            positions = range(len(self.versions))
+
+        start = 0
+        if cursor is not None:
+            if cursor not in self.position:
+                raise ValueError("Invalid cursor")
+            start = bisect.bisect_right(positions, self.position[cursor])
+        end = len(positions) if limit is None else start + limit
+        page = [self.versions[i] for i in positions[start:end]]
+
+        next_cursor = None
+        if limit is not None and end < len(positions):
+            next_cursor = encode_cursor(page[-1].get('version', ''))
+        if fields:
+            page = [{k: v[k] for k in fields if k in v} for v in page]
+        return page, next_cursor
+
+    def query_payload(self, query):
+        """Serialized /api/versions response for parse_version_query() output.
+
+        Paginated queries (limit or cursor) get a {"versions", "next_cursor"}
+        object; plain filters keep the list shape of the full catalog.
+        """
+        entries, next_cursor = self.query(**query)
+        if 'limit' not in query:
+            return dump_api_payload(entries)
+        return dump_api_payload({"versions": entries, "next_cursor": next_cursor})
+
+    def find_delta(self, from_version, to_version):
+        """Look up a delta package entry, or None"""
+        return self.deltas.get((from_version, to_version))
+
+    def update_plan(self, from_version):
+        """Smallest download path from from_version to the latest release.
+
+        Returns None for unknown versions. Plans are computed once per
+        generation and version.
+        """
+        if from_version not in self.by_version or self.latest is None:
+            return None
+        return self.cached(('update', from_version), lambda: self._plan_update(from_version))
+
+    def _plan_update(self, from_version):
+        latest = self.latest
+        plan = {
+            "from": from_version,
+            "latest": latest['version'],
+            "up_to_date": from_version == latest['version'],
+            "steps": [],
+            "bytes": 0,
+        }
+        if plan["up_to_date"]:
+            return plan
+
+        # Dijkstra over delta packages, weighted by their size in bytes
+        best = {from_version: 0}
+        previous = {}
+        queue = [(0, from_version)]
+        while queue:
+            cost, version = heapq.heappop(queue)
+            if version == latest['version']:
+                break
+            if cost > best[version]:
+                continue
+            for to_version, delta in self.deltas_from.get(version, []):
+                if 'bytes' not in delta:
+                    continue
+                new_cost = cost + delta['bytes']
+                if new_cost < best.get(to_version, float('inf')):
+                    best[to_version] = new_cost
+                    previous[to_version] = (version, delta)
+                    heapq.heappush(queue, (new_cost, to_version))
+
+        full_cost = latest.get('bytes', float('inf'))
+        delta_cost = best.get(latest['version'], float('inf'))
+        if delta_cost < full_cost:
+            steps = []
+            version = latest['version']
+            while version != from_version:
+                from_step, delta = previous[version]
+                steps.append({
+                    "type": "delta",
+                    "from": from_step,
+                    "to": version,
+                    "url": f"/delta/{from_step}/{version}",
+                    "bytes": delta['bytes'],
+                    "sha256": delta.get('sha256'),
+                })
+                version = from_step
+            plan["steps"] = steps[::-1]
+            plan["bytes"] = delta_cost
+        else:
+            plan["steps"] = [{
+                "type": "full",
+                "version": latest['version'],
+                "url": f"/download/{latest['version']}",
+                "bytes": latest.get('bytes'),
+                "sha256": latest.get('sha256'),
+            }]
+            plan["bytes"] = latest.get('bytes')
+        return plan
+
+    def cached(self, key, build):
+        """Return build(), computed once per generation and stored under key"""
+        try:
+            return self._derived[key]
+        except KeyError:
+            # Concurrent builds are harmless, the last one simply wins
+            value = self._derived[key] = build()
+            return value
+
+
+class Catalog:
+    """Thread-safe view of a versions.json file.
+
+    By default every get() stats the file and reloads it when it changed.
+    With watch=True a background FileWatcher (inotify, or polling) swaps in
+    new generations as the file changes, and get() touches no files at all.
+    """
+
+    def __init__(self, path, watch=False, poll_interval=2.0):
+        self.path = path
+        self.watch = watch
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._current = None
+        self._count = 0
+        # Stat key of a file that failed to parse, so it isn't re-read per request
+        self._bad_key = None
+        # Threads don't survive fork(), so each worker process starts its own
+        self._watcher_pid = None
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        """Read the file and build a new generation (caller holds the lock)"""
+        versions = []
+        stat_key = None
+        try:
+            with open(self.path, 'r') as f:
+                # Stat the handle we read from so the key matches the content
+                st = os.fstat(f.fileno())
+                stat_key = (st.st_mtime_ns, st.st_size)
+                versions = json.load(f)
+            if not isinstance(versions, list):
+                raise ValueError("expected a list of versions")
+            versions = valid_entries(versions, self.path)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            # Half-written by an editor or a script that bypassed versions_file;
+            # keep serving the last good catalog until the file is fixed
+            self._bad_key = stat_key
+            if self._current is not None:
+                print(f"Warning: {self.path} is not a valid versions list ({e}), "
+                      f"keeping the previous catalog", file=sys.stderr)
+                return self._current
+            versions = []
+        self._count += 1
+        return CatalogGeneration(versions, stat_key, self._count)
+
+    def _stale(self, current, stat_key):
+        return current is None or (current.stat_key != stat_key and stat_key != self._bad_key)
+
+    def refresh(self):
+        """Reload now if the file changed; returns the current generation"""
+        stat_key = self._stat_key()
+        with self._lock:
+            if self._stale(self._current, stat_key):
+                self._current = self._load()
+            return self._current
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        watcher = FileWatcher(self.path, self.refresh, poll_interval=self.poll_interval)
+        watcher.start()
+
+    def get(self):
+        """Return the current generation, reloading if the file changed"""
+        current = self._current
+        if self.watch:
+            if current is not None and self._watcher_pid == os.getpid():
+                return current
+            current = self.refresh()
+            self._start_watcher()
+            # A change that landed before the watcher started
+            return self.refresh()
+        stat_key = self._stat_key()
+        if not self._stale(current, stat_key):
+            return current
+        return self.refresh()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Size-bounded disk cache of generated files with LRU eviction.
+
+Entries are written through a temp file and renamed into place, so readers
+(in any worker process) only ever see complete files. Each hit sets the
+file's access time explicitly, which works on noatime mounts too, and leaves
+the modification time alone for the caller's validators. When the cache
+grows past its limit, the least recently used entries are deleted.
+"""
+import os
+import tempfile
+import time
+
+
+class DiskCache:
+    """Directory of named files, trimmed to max_bytes by least recent use"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        """Path of a cached file (marking it as used), or None"""
+        path = self.path(name)
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_stream(self, name, chunks, mtime=None):
+        """Pass chunks through while writing them to the cache.
+
+        The entry only appears once every chunk has been consumed; if the
+        consumer stops early (a client disconnects) the partial file is
+        dropped. mtime, if given, becomes the entry's modification time.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            # mkstemp creates 0600 files; the proxy may serve these (SENDFILE_MODE)
+            os.chmod(tmp_path, 0o644)
+            if mtime is not None:
+                os.utime(tmp_path, (time.time(), mtime))
+            os.replace(tmp_path, self.path(name))
+            complete = True
+        finally:
+            if not complete:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+        self.evict()
+
+    def entries(self):
+        """(last use, size, path) of every complete entry"""
+        result = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((st.st_atime_ns, st.st_size, path))
+        return result
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
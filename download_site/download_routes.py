@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Download, delta and API routes shared by app.py and app_single.py.
+
+The two Flask apps differ only in how they render the page and serve
+static/; init_app() gives either one the same configuration (read from the
+environment), catalog, blob store, bundle cache, mirrors, metrics and
+download limits, and registers the routes below on it under their usual
+endpoint names (url_for('download', ...) keeps working).
+"""
+import os
+
+from flask import jsonify, redirect, request
+
+import admission
+import metrics
+from blob_store import BlobStore
+from bundles import StoreBundle, ZipBundle, bundle_filename
+from catalog import Catalog, parse_version_query
+from disk_cache import DiskCache
+from mirrors import MirrorPool
+from responses import (cached_response, check_sendfile_mode, offload_file, send_download,
+                       send_stream, uncached_response)
+
+
+def configure(app):
+    """Fill in app.config, from the environment where it can be overridden"""
+    config = app.config
+    config.setdefault('UPLOAD_FOLDER', 'downloads')
+    config.setdefault('VERSIONS_FILE', 'versions.json')
+    # Hand file transfers to the reverse proxy: '', 'x-accel' (nginx) or 'x-sendfile'
+    config.setdefault('SENDFILE_MODE', check_sendfile_mode(os.environ.get('SENDFILE_MODE', '')))
+    # Internal nginx location that aliases UPLOAD_FOLDER (x-accel mode only)
+    config.setdefault('ACCEL_DOWNLOADS_PREFIX', '/_protected/downloads/')
+    # How long clients may reuse an /api/latest answer without asking again
+    config.setdefault('LATEST_MAX_AGE', int(os.environ.get('LATEST_MAX_AGE', 3600)))
+    # Content-addressed store for releases published with package_game.py --store
+    config.setdefault('STORE_FOLDER', os.path.join(config['UPLOAD_FOLDER'], '.store'))
+    # Disk space for zips assembled from the store (least recently used are dropped)
+    config.setdefault('STORE_CACHE_BYTES',
+                      int(os.environ.get('STORE_CACHE_BYTES', 2 * 1024 ** 3)))
+    # Disk space for built ?bundle= zips (least recently used are dropped)
+    config.setdefault('BUNDLE_CACHE_BYTES', int(os.environ.get('BUNDLE_CACHE_BYTES', 1024 ** 3)))
+    # Base URLs of mirrors serving every release's file (comma-separated); versions
+    # can add their own with "mirrors" in versions.json
+    config.setdefault('MIRRORS',
+                      [url for url in os.environ.get('MIRRORS', '').split(',') if url])
+    # Seconds between checks of mirror files, and how long a check may take
+    config.setdefault('MIRROR_CHECK_INTERVAL',
+                      float(os.environ.get('MIRROR_CHECK_INTERVAL', 10)))
+    config.setdefault('MIRROR_TIMEOUT', float(os.environ.get('MIRROR_TIMEOUT', 2)))
+
+    # Latency and download metrics on /metrics, shared by all gunicorn workers
+    config.setdefault('METRICS_FILE', os.environ.get('METRICS_FILE', 'metrics.mmap'))
+
+    # Download limits, shared by all gunicorn workers (0 = off). Per client IP:
+    # DOWNLOAD_RATE requests per second with bursts of DOWNLOAD_BURST (429 beyond),
+    # and DOWNLOAD_BANDWIDTH bytes per second over all of its downloads.
+    # Globally: at most MAX_TRANSFERS downloads streamed by Python at once (503).
+    config.setdefault('ADMISSION_FILE', os.environ.get('ADMISSION_FILE', 'admission.mmap'))
+    config.setdefault('DOWNLOAD_RATE', float(os.environ.get('DOWNLOAD_RATE', 0)))
+    config.setdefault('DOWNLOAD_BURST', int(os.environ.get('DOWNLOAD_BURST', 10)))
+    config.setdefault('DOWNLOAD_BANDWIDTH', int(os.environ.get('DOWNLOAD_BANDWIDTH', 0)))
+    config.setdefault('MAX_TRANSFERS', int(os.environ.get('MAX_TRANSFERS', 0)))
+    # Seconds a client turned away by MAX_TRANSFERS is asked to wait
+    config.setdefault('TRANSFER_RETRY_AFTER', int(os.environ.get('TRANSFER_RETRY_AFTER', 10)))
+    # Header with the real client IP when behind a proxy, e.g. X-Real-IP
+    config.setdefault('CLIENT_IP_HEADER', os.environ.get('CLIENT_IP_HEADER', ''))
+
+
+def init_app(app):
+    """Configure app, add the download and API routes; returns its Catalog"""
+    configure(app)
+
+    # Ensure downloads directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Cached view of versions.json, swapped in the background when the file changes
+    catalog = Catalog(app.config['VERSIONS_FILE'], watch=True)
+
+    store = BlobStore(app.config['STORE_FOLDER'], cache_bytes=app.config['STORE_CACHE_BYTES'])
+    bundle_cache = DiskCache(os.path.join(app.config['UPLOAD_FOLDER'], '.bundle_cache'),
+                             app.config['BUNDLE_CACHE_BYTES'])
+    mirrors = MirrorPool(app.config['MIRRORS'], interval=app.config['MIRROR_CHECK_INTERVAL'],
+                         timeout=app.config['MIRROR_TIMEOUT'])
+
+    metrics.init_app(app)
+    admission.init_app(app)
+
+    @app.route('/download/<version>')
+    def download(version):
+        """Download a specific version (or a smaller ?bundle= of it)"""
+        generation = catalog.get()
+        version_info = generation.find(version)
+
+        if not version_info:
+            return "Version not found", 404
+
+        if request.args.get('bundle'):
+            return download_bundle(version, version_info['filename'], request.args['bundle'])
+
+        # Send the client to a healthy mirror that has the file; serve locally without one
+        mirror = mirrors.choose(generation.mirrors.get(version, []) + app.config['MIRRORS'],
+                                version_info['filename'], version_info.get('bytes'))
+        if mirror is not None:
+            return redirect(mirror.url_for(version_info['filename']))
+
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], version_info['filename'])
+        validators = generation.validators.get(version)
+
+        if not os.path.exists(file_path):
+            # Releases in the blob store are assembled on first request, then cached
+            manifest = store.manifest(version)
+            if manifest is None:
+                return "File not found", 404
+            file_path = store.cached_zip(manifest)
+            if file_path is None:
+                return send_stream(store.stream(manifest), store.zip_size(manifest),
+                                   manifest['created'], version_info['filename'],
+                                   validators=validators)
+
+        return send_release_file(file_path, version_info['filename'], validators)
+
+    def download_bundle(version, filename, bundle):
+        """Send a reduced bundle of a release, built while it is sent the first time"""
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        try:
+            if os.path.exists(file_path):
+                source = ZipBundle(file_path, bundle)
+            else:
+                manifest = store.manifest(version)
+                if manifest is None:
+                    return "File not found", 404
+                source = StoreBundle(store, manifest, bundle)
+            cached_path = bundle_cache.get(source.name)
+            size = source.size() if cached_path is None else None
+        except KeyError:
+            return "Bundle not found", 404
+        except ValueError as e:
+            # The release zip is damaged or uses a compression we can't copy
+            app.logger.warning("Can't build bundle %r of %s: %s", bundle, version, e)
+            return "Bundle not available for this version", 404
+
+        download_name = bundle_filename(filename, bundle)
+        if cached_path is None:
+            return send_stream(
+                bundle_cache.put_stream(source.name, source.iter_zip(), source.mtime),
+                size, source.mtime, download_name)
+        return send_release_file(cached_path, download_name)
+
+    def send_release_file(file_path, download_name, validators=None):
+        """Send a file under UPLOAD_FOLDER, through the proxy if SENDFILE_MODE is set"""
+        if app.config['SENDFILE_MODE']:
+            # The proxy streams the bytes (and handles Range) for us
+            relpath = os.path.relpath(file_path, app.config['UPLOAD_FOLDER'])
+            return offload_file(app.config['SENDFILE_MODE'], file_path,
+                                app.config['ACCEL_DOWNLOADS_PREFIX']
+                                + relpath.replace(os.sep, '/'),
+                                download_name=download_name, validators=validators)
+
+        # Supports Range / If-Range so interrupted downloads can resume
+        return send_download(file_path, download_name, validators=validators)
+
+    @app.route('/delta/<from_version>/<to_version>')
+    def delta(from_version, to_version):
+        """Download a delta update package between two versions"""
+        generation = catalog.get()
+        delta_info = generation.find_delta(from_version, to_version)
+
+        if not delta_info:
+            return "Delta not found", 404
+
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], delta_info['filename'])
+
+        if not os.path.exists(file_path):
+            return "File not found", 404
+
+        return send_release_file(file_path, delta_info['filename'],
+                                 generation.delta_validators.get((from_version, to_version)))
+
+    @app.route('/api/versions')
+    def api_versions():
+        """API endpoint to get all versions, optionally filtered and paginated"""
+        generation = catalog.get()
+        try:
+            query = parse_version_query(request.args)
+            payload = generation.query_payload(query) if query is not None else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if payload is not None:
+            return uncached_response(payload)
+        # Payload is serialized and compressed once per catalog generation
+        return cached_response(generation, 'api_versions', lambda: generation.api_payload,
+                               mimetype='application/json')
+
+    @app.route('/api/latest')
+    def api_latest():
+        """Update check: the newest release for ?platform= and whether ?current= is behind"""
+        generation = catalog.get()
+        payload = generation.latest_for(request.args.get('current') or None,
+                                        request.args.get('platform') or None)
+        if payload is None:
+            return jsonify({"error": "No releases available"}), 404
+        return cached_response(generation, ('api_latest', payload), lambda: payload,
+                               mimetype='application/json',
+                               max_age=app.config['LATEST_MAX_AGE'])
+
+    @app.route('/api/mirrors')
+    def api_mirrors():
+        """Health, latency, files found and recent redirects of this worker's mirrors"""
+        return jsonify(mirrors.stats())
+
+    @app.route('/api/update')
+    def api_update():
+        """Smallest download path from ?from=<version> to the latest release"""
+        from_version = request.args.get('from')
+        if not from_version:
+            return jsonify({"error": "Missing 'from' parameter"}), 400
+
+        plan = catalog.get().update_plan(from_version)
+        if plan is None:
+            return jsonify({"error": f"Unknown version {from_version}"}), 404
+        return jsonify(plan)
+
+    return catalog
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Helpers to fingerprint release files when they are published.
+
+The values are stored in versions.json so the server can send a strong
+ETag, Content-Length and digest headers without hashing per request.
+"""
+import base64
+import hashlib
+import os
+import re
+
+from versions_file import read_versions, versions_lock, write_versions
+
+CHUNK_SIZE = 1024 * 1024
+
+_SHA256 = re.compile(r'^[0-9a-fA-F]{64}$')
+
+
+def inspect_file(path):
+    """Hash a file in one streaming pass and return its publish metadata"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return {
+        "sha256": sha256.hexdigest(),
+        "bytes": st.st_size,
+        "mtime": int(st.st_mtime),
+    }
+
+
+def format_size(num_bytes):
+    """Human-readable size, as shown on the download page"""
+    size = float(num_bytes)
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+
+def record_file_info(versions_file, filename, info):
+    """Update every versions.json entry that points at filename; returns the count"""
+    if not os.path.exists(versions_file):
+        return 0
+    with versions_lock(versions_file):
+        versions = read_versions(versions_file)
+        updated = 0
+        for entry in versions:
+            if entry.get('filename') == filename:
+                entry.update(info)
+                entry['size'] = format_size(info['bytes'])
+                updated += 1
+        if updated:
+            write_versions(versions_file, versions)
+    return updated
+
+
+def entry_validators(entry):
+    """Precompute the response validators for a version entry, or None.
+
+    Raises ValueError if the entry's sha256, bytes or mtime are malformed.
+    """
+    sha256 = entry.get('sha256')
+    if not sha256 or 'bytes' not in entry or 'mtime' not in entry:
+        return None
+    if not isinstance(sha256, str) or not _SHA256.match(sha256):
+        raise ValueError(f"sha256 {sha256!r} is not 64 hex digits")
+    for name in ('bytes', 'mtime'):
+        if not isinstance(entry[name], int) or isinstance(entry[name], bool) or entry[name] < 0:
+            raise ValueError(f"{name} {entry[name]!r} is not a non-negative integer")
+    return {
+        "etag": 'sha256-' + sha256,
+        "digest": base64.b64encode(bytes.fromhex(sha256)).decode('ascii'),
+        "bytes": entry['bytes'],
+        "mtime": entry['mtime'],
+    }
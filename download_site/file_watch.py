@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Background notification when a file changes.
+
+On Linux the file's directory is watched with inotify (through ctypes, no
+extra packages), which also catches files renamed into place. Elsewhere, or
+if inotify is unavailable, the file is polled. Either way the callback runs
+on a daemon thread, and is also called every poll interval as a safety net
+for filesystems that don't deliver events (NFS, some container mounts).
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) constants
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+# Only whole writes: IN_MODIFY would fire mid-write, before the file is complete
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct('iIII')
+
+
+def _inotify():
+    """libc with inotify functions, or None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher(threading.Thread):
+    """Call callback() from a daemon thread whenever path may have changed"""
+
+    def __init__(self, path, callback, poll_interval=2.0, event_poll_interval=60.0):
+        super().__init__(daemon=True, name=f'watch {os.path.basename(path)}')
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.event_poll_interval = event_poll_interval
+        self._fd = self._start_inotify()
+        # 'inotify' or 'poll', for logs and tests
+        self.mode = 'inotify' if self._fd is not None else 'poll'
+
+    def _start_inotify(self):
+        libc = _inotify()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            return None
+        directory = os.path.dirname(self.path).encode(sys.getfilesystemencoding())
+        if libc.inotify_add_watch(fd, directory, WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _names(self, data):
+        """File names in a buffer of inotify events"""
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, _, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            yield data[offset:offset + length].rstrip(b'\0').decode(
+                sys.getfilesystemencoding(), 'replace')
+            offset += length
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            # Keep watching; the next change gets another chance
+            print(f"Warning: reloading {self.path} failed: {e}", file=sys.stderr)
+
+    def run(self):
+        name = os.path.basename(self.path)
+        if self._fd is None:
+            while True:
+                time.sleep(self.poll_interval)
+                self._notify()
+        while True:
+            readable, _, _ = select.select([self._fd], [], [], self.event_poll_interval)
+            if not readable:
+                self._notify()
+                continue
+            if name in self._names(os.read(self._fd, 64 * 1024)):
+                self._notify()
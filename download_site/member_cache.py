@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Reuse compressed zip members between builds.
+
+Each member is keyed by the SHA-256 of its content. Unchanged files are
+copied raw (already compressed, with their CRC) from a local cache of
+compressed members or from the previous release zip, so only changed files
+are deflated again. Members of the previous release are inflated and hashed
+before reuse, which is still much cheaper than deflating them again.
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+
+from zipwriter import (ZIP_DEFLATED, ZIP_STORED, Member, compress_bytes,
+                       dos_date_time, should_store)
+
+# compress_type, crc, file_size in front of the raw payload
+_CACHE_HEADER = struct.Struct('<HLL')
+# Local file header size; its last two fields are the name and extra lengths
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_NAME_LENGTHS = struct.Struct('<2H')
+
+
+def payload_offset(fp, info):
+    """Offset of a member's compressed data in an open zip file"""
+    fp.seek(info.header_offset)
+    header = fp.read(_LOCAL_HEADER_SIZE)
+    name_len, extra_len = _LOCAL_NAME_LENGTHS.unpack(header[26:30])
+    return info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+def can_copy_raw(info):
+    """True if a zip member's compressed data can be copied into a new zip as-is"""
+    # Encrypted members and other compression methods can't be copied
+    return not info.flag_bits & 0x1 and info.compress_type in (ZIP_STORED, ZIP_DEFLATED)
+
+
+class MemberCache:
+    """Directory of compressed members keyed by content hash and level"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, digest, level, stored):
+        # Stored members don't depend on the level
+        suffix = 'stored' if stored else f'L{level}'
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}-{suffix}')
+
+    def get(self, digest, level, member_args):
+        """Return a Member for this content, or None on a cache miss"""
+        arcname, date_time, external_attr = member_args
+        try:
+            with open(self._path(digest, level, should_store(arcname)), 'rb') as f:
+                header = f.read(_CACHE_HEADER.size)
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        if len(header) != _CACHE_HEADER.size:
+            return None
+        compress_type, crc, file_size = _CACHE_HEADER.unpack(header)
+        return Member(
+            arcname, compress_type, crc, len(payload), file_size,
+            date_time, external_attr, payload)
+
+    def put(self, digest, level, member):
+        """Store a freshly compressed member (atomically, so builds can overlap)"""
+        path = self._path(digest, level, should_store(member.arcname))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_CACHE_HEADER.pack(member.compress_type, member.crc, member.file_size))
+            f.write(member.data)
+        os.replace(tmp_path, path)
+
+
+class PreviousRelease:
+    """Raw access to the compressed members of an earlier release zip"""
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        with zipfile.ZipFile(zip_path) as zf:
+            self.infos = {info.filename: info for info in zf.infolist()}
+        self._lock = threading.Lock()
+        self._fp = open(zip_path, 'rb')
+
+    def close(self):
+        self._fp.close()
+
+    def get(self, digest, crc, file_size, member_args):
+        """Return the previous member if its content has this SHA-256, or None.
+
+        CRC and size only pick out candidates; the payload is inflated and
+        hashed before it is reused, so a CRC collision can't ship stale bytes.
+        """
+        arcname, date_time, external_attr = member_args
+        info = self.infos.get(arcname.replace(os.sep, '/'))
+        if info is None or info.CRC != crc or info.file_size != file_size:
+            return None
+        if not can_copy_raw(info):
+            return None
+        if should_store(arcname) and info.compress_type != ZIP_STORED:
+            return None
+        with self._lock:
+            self._fp.seek(payload_offset(self._fp, info))
+            payload = self._fp.read(info.compress_size)
+        try:
+            content = payload if info.compress_type == ZIP_STORED else \
+                zlib.decompress(payload, -zlib.MAX_WBITS)
+        except zlib.error:
+            return None
+        if hashlib.sha256(content).hexdigest() != digest:
+            return None
+        return Member(
+            arcname, info.compress_type, crc, len(payload), file_size,
+            date_time, external_attr, payload)
+
+
+def compress_file_incremental(path, arcname, level=6, cache=None, previous=None):
+    """Like zipwriter.compress_file but reusing unchanged members.
+
+    Returns (member, source) where source is 'cache', 'previous' or
+    'compressed'.
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    return reuse_or_compress(data, st, arcname, level, cache, previous)
+
+
+def reuse_or_compress(data, st, arcname, level=6, cache=None, previous=None):
+    """compress_file_incremental for content that has already been read"""
+    member_args = (arcname, dos_date_time(st.st_mtime), (st.st_mode & 0xFFFF) << 16)
+    digest = hashlib.sha256(data).hexdigest()
+
+    if cache is not None:
+        member = cache.get(digest, level, member_args)
+        if member is not None:
+            return member, 'cache'
+
+    crc = zlib.crc32(data)
+    if previous is not None:
+        member = previous.get(digest, crc, len(data), member_args)
+        if member is not None:
+            return member, 'previous'
+
+    member = compress_bytes(arcname, data, level, member_args[1], member_args[2])
+    if cache is not None:
+        cache.put(digest, level, member)
+    return member, 'compressed'
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Request and download metrics shared across gunicorn workers.
+
+Values live in a memory-mapped file. Every worker process owns one row of
+slots and is the only writer of that row, so recording a metric is a
+thread-locked float add with no cross-process locking. /metrics sums the
+rows of all workers and renders them in the Prometheus text format.
+
+File layout: header | key table | owner pid per row | rows of float64 values.
+Row 0 holds counters retired from workers that have exited.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from flask import Response, g, request
+from werkzeug.wsgi import FileWrapper
+
+from responses import call_on_close
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; fine for a single dev server
+    fcntl = None
+
+MAGIC = b'SIMETRC1'
+MAX_KEYS = 1024
+KEY_SIZE = 128
+MAX_PROCS = 64
+
+_HEADER = struct.Struct('<8sI4x')
+_KEYS_OFFSET = _HEADER.size
+_PIDS_OFFSET = _KEYS_OFFSET + MAX_KEYS * KEY_SIZE
+_VALUES_OFFSET = _PIDS_OFFSET + MAX_PROCS * 8
+FILE_SIZE = _VALUES_OFFSET + MAX_PROCS * MAX_KEYS * 8
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER, GAUGE, HISTOGRAM = 'counter', 'gauge', 'histogram'
+
+HELP = {
+    'snake_idle_request_duration_seconds': "Time to produce a response, by route",
+    'snake_idle_downloads_total': "Download responses started, by version and kind",
+    'snake_idle_download_bytes_total': "Download bytes sent by Python, by version and kind",
+    'snake_idle_transfers_in_flight': "Downloads currently being streamed by Python",
+    'snake_idle_mirror_redirects_total': "Downloads redirected to a mirror, by mirror",
+}
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in labels.items())
+
+
+class SharedMetrics:
+    """Counters, gauges and histograms stored in a shared mmap file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._file_lock():
+            if os.fstat(self._fd).st_size != FILE_SIZE:
+                os.ftruncate(self._fd, FILE_SIZE)
+            self._mm = mmap.mmap(self._fd, FILE_SIZE)
+            if self._mm[:len(MAGIC)] != MAGIC:
+                # New file or an incompatible layout: start from zero
+                self._mm[:] = bytes(FILE_SIZE)
+                _HEADER.pack_into(self._mm, 0, MAGIC, 0)
+        view = memoryview(self._mm)
+        self._pids = view[_PIDS_OFFSET:_VALUES_OFFSET].cast('q')
+        self._values = view[_VALUES_OFFSET:].cast('d')
+        self._index = {}
+        self._pid = None
+        self._base = None
+        self._lock = threading.Lock()
+        self._bucket_keys = {}
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read_keys(self):
+        """All keys in the shared table, in index order"""
+        count = _HEADER.unpack_from(self._mm, 0)[1]
+        keys = []
+        for i in range(count):
+            raw = self._mm[_KEYS_OFFSET + i * KEY_SIZE:_KEYS_OFFSET + (i + 1) * KEY_SIZE]
+            keys.append(raw.rstrip(b'\0').decode('utf-8'))
+        return keys
+
+    def _key_index(self, key):
+        """Slot index of a key, registering it in the shared table if needed"""
+        index = self._index.get(key)
+        if index is not None:
+            return index
+        with self._file_lock():
+            keys = self._read_keys()
+            self._index = {k: i for i, k in enumerate(keys)}
+            if key not in self._index:
+                encoded = key.encode('utf-8')
+                if len(keys) >= MAX_KEYS or len(encoded) > KEY_SIZE:
+                    return None
+                offset = _KEYS_OFFSET + len(keys) * KEY_SIZE
+                self._mm[offset:offset + KEY_SIZE] = encoded.ljust(KEY_SIZE, b'\0')
+                _HEADER.pack_into(self._mm, 0, MAGIC, len(keys) + 1)
+                self._index[key] = len(keys)
+        return self._index[key]
+
+    def _row(self):
+        """Offset of this process's row, claiming one after start or fork"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._base
+        # Locks may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self._pid = pid
+        self._base = None
+        with self._file_lock():
+            keys = self._read_keys()
+            for row in range(1, MAX_PROCS):
+                owner = self._pids[row]
+                if owner == pid:
+                    break
+                if owner == 0 or not pid_alive(owner):
+                    self._retire(row, keys)
+                    self._pids[row] = pid
+                    break
+            else:
+                # Every row is in use; this worker simply isn't counted
+                return None
+        self._base = row * MAX_KEYS
+        return self._base
+
+    def _retire(self, row, keys):
+        """Fold a dead worker's counters into row 0 and clear its row"""
+        base = row * MAX_KEYS
+        for i, key in enumerate(keys):
+            if not key.startswith(GAUGE):
+                self._values[i] += self._values[base + i]
+            self._values[base + i] = 0.0
+
+    def inc(self, key, amount=1.0):
+        """Add to a metric key (type|name|labels)"""
+        base = self._row()
+        index = self._key_index(key)
+        if base is None or index is None:
+            return
+        with self._lock:
+            self._values[base + index] += amount
+
+    def counter(self, name, amount=1.0, **labels):
+        self.inc(f'{COUNTER}|{name}|{_labels(**labels)}', amount)
+
+    def gauge(self, name, amount, **labels):
+        self.inc(f'{GAUGE}|{name}|{_labels(**labels)}', amount)
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation (three increments)"""
+        label_str = _labels(**labels)
+        keys = self._bucket_keys.get((name, label_str))
+        if keys is None:
+            prefix = f'{HISTOGRAM}|{name}|{label_str}{"," if label_str else ""}'
+            keys = [f'{prefix}le="{le}"' for le in LATENCY_BUCKETS]
+            keys.append(f'{prefix}le="+Inf"')
+            keys.append(f'{HISTOGRAM}|{name}_sum|{label_str}')
+            keys.append(f'{HISTOGRAM}|{name}_count|{label_str}')
+            self._bucket_keys[(name, label_str)] = keys
+        self.inc(keys[bisect.bisect_left(LATENCY_BUCKETS, value)])
+        self.inc(keys[-2], value)
+        self.inc(keys[-1])
+
+    def collect(self):
+        """Sum every row: {key: value}. Gauges only count live workers."""
+        keys = self._read_keys()
+        # Rows of exited workers keep their counters until the row is reused
+        all_rows = [row for row in range(MAX_PROCS) if row == 0 or self._pids[row]]
+        live = [row for row in all_rows if row and pid_alive(self._pids[row])]
+        totals = {}
+        for i, key in enumerate(keys):
+            rows = live if key.startswith(GAUGE) else all_rows
+            totals[key] = sum(self._values[row * MAX_KEYS + i] for row in rows)
+        return totals
+
+    def render(self):
+        """Prometheus text exposition of the collected values"""
+        families = {}
+        for key, value in self.collect().items():
+            kind, name, labels = key.split('|', 2)
+            family = name
+            if kind == HISTOGRAM:
+                for suffix in ('_sum', '_count'):
+                    if family.endswith(suffix):
+                        family = family[:-len(suffix)]
+            families.setdefault((family, kind), []).append((name, labels, value))
+
+        lines = []
+        for (family, kind), samples in sorted(families.items()):
+            if family in HELP:
+                lines.append(f'# HELP {family} {HELP[family]}')
+            lines.append(f'# TYPE {family} {kind}')
+            if kind == HISTOGRAM:
+                samples = self._cumulative(family, samples)
+            for name, labels, value in samples:
+                name = f'{name}_bucket' if kind == HISTOGRAM and name == family else name
+                lines.append(f'{name}{{{labels}}} {value:g}' if labels else f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _cumulative(family, samples):
+        """Turn per-bucket counts into Prometheus' cumulative buckets"""
+        buckets = {}
+        others = []
+        for name, labels, value in samples:
+            if name != family:
+                others.append((name, labels, value))
+                continue
+            series, _, le = labels.rpartition('le=')
+            buckets.setdefault(series, {})[le.strip('"')] = value
+        result = []
+        for series, counts in sorted(buckets.items()):
+            running = 0.0
+            for le in [str(b) for b in LATENCY_BUCKETS] + ['+Inf']:
+                running += counts.get(le, 0.0)
+                result.append((family, f'{series}le="{le}"', running))
+        return result + sorted(others)
+
+
+_stores = {}
+
+
+class CountedBody:
+    """Response body that reports how many bytes it actually yielded when closed"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close(self.sent)
+
+
+def _sends_file(response):
+    """Whether the body is a send_file() file wrapper the server can sendfile()"""
+    if not response.direct_passthrough:
+        return False
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    return isinstance(response.response, FileWrapper) or (
+        isinstance(wrapper, type) and isinstance(response.response, wrapper))
+
+
+def open_metrics(path):
+    """One SharedMetrics per file and process"""
+    path = os.path.abspath(path)
+    if path not in _stores:
+        _stores[path] = SharedMetrics(path)
+    return _stores[path]
+
+
+def init_app(app):
+    """Record request latency and downloads for app and add /metrics"""
+    metrics = open_metrics(app.config['METRICS_FILE'])
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop('metrics_start', None)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        if start is not None:
+            metrics.observe('snake_idle_request_duration_seconds',
+                            time.perf_counter() - start, route=route)
+
+        if (request.endpoint == 'download' and response.status_code == 302
+                and response.location):
+            metrics.counter('snake_idle_mirror_redirects_total',
+                            mirror=urlsplit(response.location).netloc)
+        elif (request.endpoint in ('download', 'delta') and request.method == 'GET'
+                and response.status_code in (200, 206)):
+            args = request.view_args
+            version = args.get('version') or args.get('to_version')
+            if request.endpoint == 'delta':
+                kind = 'delta'
+            else:
+                kind = 'bundle' if request.args.get('bundle') else 'full'
+            metrics.counter('snake_idle_downloads_total', version=version, kind=kind)
+            # Offloaded transfers are streamed by the proxy, not by us; their
+            # bytes are in its access log
+            if 'X-Accel-Redirect' not in response.headers and 'X-Sendfile' not in response.headers:
+                metrics.gauge('snake_idle_transfers_in_flight', 1)
+
+                def done(sent):
+                    metrics.counter('snake_idle_download_bytes_total', sent,
+                                    version=version, kind=kind)
+                    metrics.gauge('snake_idle_transfers_in_flight', -1)
+                if _sends_file(response):
+                    # Wrapping the file would cost the server its sendfile(), so
+                    # count Content-Length, even for a client that left early
+                    size = response.content_length or 0
+                    call_on_close(response, lambda: done(size))
+                else:
+                    # What was written before the transfer ended or the client left
+                    response.response = CountedBody(response.response, done)
+        return response
+
+    def metrics_view():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return metrics
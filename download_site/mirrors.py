@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Download mirrors with background availability checks.
+
+Mirrors are base URLs that serve the same files as downloads/ (set for every
+release with MIRRORS, or per version with "mirrors" in versions.json). A
+mirror only gets a download once a HEAD request has found that very release
+file on it (with the expected size, when versions.json records one), so a
+release that hasn't synced to a mirror yet is served locally instead of
+sending players to a 404.
+
+A daemon thread in each worker re-checks every (mirror, file) pair that was
+asked for recently and keeps a smoothed latency per mirror. Among the
+mirrors holding the file, a download goes to the one this worker has
+redirected the fewest recent downloads to, latency breaking ties. That count
+is per worker; it is a stand-in for the mirror's load, which the site can't
+see.
+"""
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+# Weight of the newest probe in the smoothed latency
+LATENCY_SMOOTHING = 0.3
+# Failed probes in a row before a mirror is taken out of rotation
+MAX_FAILURES = 2
+# Redirects older than this count half as much towards a mirror's recent redirects
+LOAD_HALF_LIFE = 60.0
+# Files nobody has downloaded for this long are no longer checked
+FILE_TTL = 3600.0
+
+
+class Mirror:
+    """Health, latency, files found and recent redirects of one mirror"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        # Unknown until the first probe; never used before that
+        self.healthy = False
+        self.checked = None
+        self.latency = None
+        self.failures = 0
+        # filename -> True/False from the last check of that file
+        self.files = {}
+        self._load = 0.0
+        self._load_time = time.monotonic()
+
+    def url_for(self, filename):
+        return f'{self.base_url}/{quote(filename)}'
+
+    def has(self, filename):
+        """Whether the last check found filename here (None: not checked yet)"""
+        return self.files.get(filename)
+
+    def load(self, now=None):
+        """Redirects this worker sent here recently, decaying with LOAD_HALF_LIFE"""
+        now = time.monotonic() if now is None else now
+        return self._load * 0.5 ** ((now - self._load_time) / LOAD_HALF_LIFE)
+
+    def add_load(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._load = self.load(now) + 1
+        self._load_time = now
+
+    def record_probe(self, filename, status, latency):
+        """Record a file check: an HTTP status, or None if the mirror didn't answer"""
+        self.checked = time.time()
+        if status is None or status >= 500:
+            self.failures += 1
+            if self.failures >= MAX_FAILURES or self.latency is None:
+                self.healthy = False
+            return
+        self.failures = 0
+        self.healthy = True
+        self.latency = latency if self.latency is None else (
+            LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+        self.files[filename] = status == 200
+
+    def stats(self):
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "recent_redirects": round(self.load(), 2),
+            "files": dict(self.files),
+            "checked": self.checked,
+        }
+
+
+class MirrorPool:
+    """Known mirrors and the files asked of them, checked every interval seconds"""
+
+    def __init__(self, urls=(), interval=10.0, timeout=2.0):
+        self.interval = interval
+        self.timeout = timeout
+        self._mirrors = {}
+        # (base_url, filename) -> (expected bytes or None, last asked for)
+        self._wanted = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._checker_pid = None
+        for url in urls:
+            self.mirror(url)
+
+    def mirror(self, base_url):
+        """The Mirror for a base URL, registering it if new"""
+        key = base_url.rstrip('/')
+        mirror = self._mirrors.get(key)
+        if mirror is None:
+            with self._lock:
+                mirror = self._mirrors.setdefault(key, Mirror(key))
+        return mirror
+
+    def want(self, mirror, filename, size=None, now=None):
+        """Keep checking filename on mirror; wakes the checker the first time"""
+        now = time.monotonic() if now is None else now
+        key = (mirror.base_url, filename)
+        with self._lock:
+            new = key not in self._wanted
+            self._wanted[key] = (size, now)
+        if new:
+            self._wake.set()
+
+    def probe(self, mirror, filename, size=None):
+        """HEAD filename on the mirror; a 200 with a different size counts as missing"""
+        request = urllib.request.Request(mirror.url_for(filename), method='HEAD')
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status = response.status
+                length = response.headers.get('Content-Length')
+                if status == 200 and size is not None and length is not None \
+                        and int(length) != size:
+                    # Still uploading, or a different build under the same name
+                    status = 404
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (OSError, ValueError):
+            status = None
+        mirror.record_probe(filename, status, time.perf_counter() - start)
+
+    def probe_all(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key, (_, asked) in list(self._wanted.items()):
+                if now - asked > FILE_TTL:
+                    del self._wanted[key]
+                    self._mirrors[key[0]].files.pop(key[1], None)
+            wanted = list(self._wanted.items())
+        for (base_url, filename), (size, _) in wanted:
+            self.probe(self._mirrors[base_url], filename, size)
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self.probe_all()
+            self._wake.wait(self.interval)
+
+    def start(self):
+        """Start the checker thread, once per process (gunicorn forks workers)"""
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name='mirror health').start()
+
+    def choose(self, urls, filename, size=None):
+        """The healthy mirror among urls known to hold filename, or None.
+
+        Mirrors that haven't been checked for filename yet are queued for a
+        check and skipped, so the first downloads of a new release are
+        served locally.
+        """
+        if not urls:
+            return None
+        self.start()
+        now = time.monotonic()
+        candidates = []
+        for mirror in map(self.mirror, urls):
+            self.want(mirror, filename, size, now)
+            if mirror.healthy and mirror.has(filename):
+                candidates.append(mirror)
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda m: (round(m.load(now)), m.latency))
+        with self._lock:
+            best.add_load(now)
+        return best
+
+    def stats(self):
+        with self._lock:
+            return [mirror.stats() for mirror in self._mirrors.values()]
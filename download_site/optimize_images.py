@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Image optimization stage for packaging.
+
+PNG/JPEG assets are downscaled to a target size (where one is configured for
+their directory) and re-encoded on a process pool, as decoding, resampling
+and encoding are all CPU-bound. Results are cached by the hash of the input
+and the settings, so a repeat build only touches images that changed. Needs
+Pillow (pip install Pillow); without it the stage is skipped and images ship
+as they are.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+# Bump when optimize_image's output changes, so cached results are redone
+OUTPUT_VERSION = 2
+
+# max_sizes maps an arcname prefix (a directory or file) to the (width, height)
+# its images are shrunk to fit; images matching no prefix keep their size
+ImageSettings = namedtuple('ImageSettings', ['max_sizes', 'jpeg_quality'])
+
+
+def is_image(arcname):
+    return os.path.splitext(arcname)[1].lower() in IMAGE_EXTENSIONS
+
+
+def max_size_for(arcname, settings):
+    """Target (width, height) for an image, or None to keep its size"""
+    arcname = arcname.replace(os.sep, '/')
+    for prefix, size in settings.max_sizes.items():
+        if arcname == prefix or arcname.startswith(prefix + '/'):
+            return tuple(size)
+    return None
+
+
+def settings_key(arcname, settings):
+    """The settings that affect one image's output, as a short hash"""
+    key = json.dumps([max_size_for(arcname, settings), settings.jpeg_quality, OUTPUT_VERSION,
+                      Image.__version__ if Image is not None else None])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+def optimize_image(file_path, out_path, max_size, jpeg_quality):
+    """Write an optimized copy of an image to out_path (runs in a worker process).
+
+    Returns False, writing nothing, when the result would be no smaller and
+    the image didn't need resizing.
+
+    The ICC colour profile is kept. Other EXIF data (camera details,
+    thumbnails) is dropped; an EXIF rotation is applied to the pixels first,
+    so the image still displays the right way up.
+    """
+    with Image.open(file_path) as img:
+        img.load()
+        image_format = img.format
+        icc_profile = img.info.get('icc_profile')
+        img = ImageOps.exif_transpose(img)
+        resized = bool(max_size) and (img.width > max_size[0] or img.height > max_size[1])
+        if resized:
+            img.thumbnail(max_size, Image.LANCZOS)
+        options = {'optimize': True}
+        if icc_profile:
+            options['icc_profile'] = icc_profile
+        if image_format == 'JPEG':
+            options.update(quality=jpeg_quality, progressive=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, format=image_format, **options)
+            if not resized and os.path.getsize(tmp_path) >= os.path.getsize(file_path):
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return True
+
+
+class ImageCache:
+    """Optimized images keyed by input hash and settings"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def paths(self, digest, key, arcname):
+        """(optimized image path, marker path for images left as they are)"""
+        base = os.path.join(self.cache_dir, digest[:2], f'{digest}-{key}')
+        return base + os.path.splitext(arcname)[1].lower(), base + '.keep'
+
+
+def _staged_copy(file_path, out_path, staging_dir, index):
+    """Copy of a cached image with its source's mtime and permissions (zip entries use them).
+
+    The cache entry itself is left alone, as other builds may share it.
+    """
+    staged = os.path.join(staging_dir, f'{index}{os.path.splitext(out_path)[1]}')
+    shutil.copyfile(out_path, staged)
+    st = os.stat(file_path)
+    shutil.copymode(file_path, staged)
+    os.utime(staged, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return staged
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def optimize_members(members, settings, cache_dir, staging_dir, workers=None):
+    """Swap the image files among (file_path, arcname) pairs for optimized copies.
+
+    The copies are written to staging_dir, which the caller removes once the
+    release has been packaged.
+
+    Returns (members, stats) where stats counts images 'optimized', 'kept'
+    as they were (no smaller) and served from the 'cache'.
+    """
+    stats = {'optimized': 0, 'kept': 0, 'cache': 0}
+    if Image is None:
+        print("  Warning: Pillow is not installed, images are not optimized")
+        return members, stats
+
+    cache = ImageCache(cache_dir)
+    results = list(members)
+    pending = []
+    for index, (file_path, arcname) in enumerate(members):
+        if not is_image(arcname):
+            continue
+        out_path, keep_path = cache.paths(_file_digest(file_path),
+                                          settings_key(arcname, settings), arcname)
+        if os.path.exists(out_path):
+            results[index] = (_staged_copy(file_path, out_path, staging_dir, index), arcname)
+            stats['cache'] += 1
+        elif os.path.exists(keep_path):
+            stats['cache'] += 1
+        else:
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            pending.append((index, file_path, arcname, out_path, keep_path))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(optimize_image, file_path, out_path,
+                                       max_size_for(arcname, settings), settings.jpeg_quality)
+                       for _, file_path, arcname, out_path, _ in pending]
+            for (index, file_path, arcname, out_path, keep_path), future in zip(pending, futures):
+                if future.result():
+                    results[index] = (_staged_copy(file_path, out_path, staging_dir, index),
+                                      arcname)
+                    stats['optimized'] += 1
+                else:
+                    open(keep_path, 'w').close()
+                    stats['kept'] += 1
+    return results, stats
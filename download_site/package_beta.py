@@ -1,133 +1,202 @@
 #!/usr/bin/env python3
 """
 Script to package the Beta_1 version from git commit
+
+Blobs are streamed straight from the object database through one long-lived
+`git cat-file --batch` process, so no clone or checkout is needed.
 """
+import contextlib
 import os
-import shutil
-import zipfile
 import subprocess
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from zipwriter import ZipWriter, compress_bytes, dos_date_time
+
+# Files to include
+FILES_TO_INCLUDE = [
+    'snake_idle_pygame.py',
+    'requirements.txt',
+    'README.md',
+]
+
+# Directories to include
+DIRS_TO_INCLUDE = [
+    'images',
+]
+
+# Optional files/dirs
+OPTIONAL_ITEMS = [
+    'background.png',
+    'snaketummy.png',
+    'education.png',
+    'locked.png',
+    'memes',
+]
 
-def package_beta_version(commit_hash='524bae9', output_dir='downloads'):
-    """Package the Beta_1 version from a specific commit"""
+class BlobReader:
+    """Read blobs through a single `git cat-file --batch` pipe"""
+    
+    def __init__(self, repo_dir):
+        self.process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            cwd=repo_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+    
+    def read(self, object_id):
+        """Return the contents of one blob"""
+        self.process.stdin.write(object_id.encode('ascii') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            raise ValueError(f"git cat-file: {b' '.join(header).decode()}")
+        size = int(header[2])
+        data = self.process.stdout.read(size)
+        self.process.stdout.read(1)  # trailing newline
+        return data
+    
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process.wait()
+
+def list_tree(repo_dir, commit_hash):
+    """Map path -> (mode, object id) for every blob in a commit"""
+    result = subprocess.run(
+        ['git', 'ls-tree', '-r', '-z', '--full-tree', commit_hash],
+        cwd=repo_dir,
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise ValueError(result.stderr.decode(errors='replace').strip())
+    entries = {}
+    for record in result.stdout.split(b'\0'):
+        if not record:
+            continue
+        info, path = record.split(b'\t', 1)
+        mode, kind, object_id = info.decode('ascii').split()
+        if kind == 'blob':
+            entries[path.decode('utf-8')] = (mode, object_id)
+    return entries
+
+def commit_time(repo_dir, commit_hash):
+    """Committer timestamp of a commit, used as every member's date"""
+    result = subprocess.run(
+        ['git', 'show', '-s', '--format=%ct', commit_hash],
+        cwd=repo_dir,
+        capture_output=True,
+        text=True,
+    )
+    return int(result.stdout.strip()) if result.returncode == 0 else None
+
+def select_members(entries):
+    """Pick (path, mode, object id) from the tree using the include lists"""
+    members = []
+    
+    def directory(item):
+        prefix = item + '/'
+        return [(path, *entries[path]) for path in sorted(entries) if path.startswith(prefix)]
+    
+    # Add required files
+    for item in FILES_TO_INCLUDE:
+        if item in entries:
+            members.append((item, *entries[item]))
+            print(f"  Added: {item}")
+        elif directory(item):
+            members.extend(directory(item))
+            print(f"  Added directory: {item}/")
+        else:
+            print(f"  Warning: {item} not found, skipping")
+    
+    # Add required directories
+    for item in DIRS_TO_INCLUDE:
+        if directory(item):
+            members.extend(directory(item))
+            print(f"  Added directory: {item}/")
+        else:
+            print(f"  Warning: {item} not found, skipping")
+    
+    # Add optional items if they exist
+    for item in OPTIONAL_ITEMS:
+        if item in entries:
+            members.append((item, *entries[item]))
+            print(f"  Added (optional): {item}")
+        elif directory(item):
+            members.extend(directory(item))
+            print(f"  Added directory (optional): {item}/")
+    
+    return members
+
+def _untimed(phase):
+    return contextlib.nullcontext()
+
+def package_beta_version(commit_hash='524bae9', output_dir='downloads', repo_dir=None,
+                         workers=None, level=6, timer=_untimed):
+    """Package the Beta_1 version from a specific commit
+
+    repo_dir defaults to the project root. timer(phase) is entered around
+    each stage (ls_tree, compress, write); see bench_package.py.
+    """
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
     # Get the script's directory and project root
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
-    
-    # Create temporary directory for checkout
-    with tempfile.TemporaryDirectory() as temp_dir:
-        print(f"Checking out commit {commit_hash}...")
-        
-        # Clone to temp directory
-        result = subprocess.run(
-            ['git', 'clone', project_root, temp_dir],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print(f"Error cloning: {result.stderr}")
-            return False
-        
-        # Checkout the specific commit
-        result = subprocess.run(
-            ['git', 'checkout', commit_hash],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print(f"Error checking out commit: {result.stderr}")
-            return False
-        
-        # Files to include
-        files_to_include = [
-            'snake_idle_pygame.py',
-            'requirements.txt',
-            'README.md',
-        ]
-        
-        # Directories to include
-        dirs_to_include = [
-            'images',
-        ]
-        
-        # Optional files/dirs
-        optional_items = [
-            'background.png',
-            'snaketummy.png',
-            'education.png',
-            'locked.png',
-            'memes',
-        ]
-        
-        # Create zip filename
-        zip_filename = 'snake_idle_beta1.zip'
-        zip_path = os.path.join(script_dir, output_dir, zip_filename)
-        
-        print(f"Packaging Beta_1 version...")
-        print(f"Output: {zip_path}")
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Add required files
-            for item in files_to_include:
-                item_path = os.path.join(temp_dir, item)
-                if os.path.exists(item_path):
-                    if os.path.isfile(item_path):
-                        zipf.write(item_path, item)
-                        print(f"  Added: {item}")
-                    else:
-                        for root, dirs, files in os.walk(item_path):
-                            for file in files:
-                                file_path = os.path.join(root, file)
-                                arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                                zipf.write(file_path, arcname)
-                        print(f"  Added directory: {item}/")
-                else:
-                    print(f"  Warning: {item} not found, skipping")
-            
-            # Add required directories
-            for item in dirs_to_include:
-                item_path = os.path.join(temp_dir, item)
-                if os.path.exists(item_path):
-                    for root, dirs, files in os.walk(item_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                            zipf.write(file_path, arcname)
-                    print(f"  Added directory: {item}/")
-                else:
-                    print(f"  Warning: {item} not found, skipping")
-            
-            # Add optional items if they exist
-            for item in optional_items:
-                item_path = os.path.join(temp_dir, item)
-                if os.path.exists(item_path):
-                    if os.path.isfile(item_path):
-                        zipf.write(item_path, item)
-                        print(f"  Added (optional): {item}")
-                    else:
-                        for root, dirs, files in os.walk(item_path):
-                            for file in files:
-                                file_path = os.path.join(root, file)
-                                arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                                zipf.write(file_path, arcname)
-                        print(f"  Added directory (optional): {item}/")
-        
-        # Get file size
-        size = os.path.getsize(zip_path)
-        size_mb = size / (1024 * 1024)
-        
-        print(f"\n✓ Beta_1 package created successfully!")
-        print(f"  File: {zip_filename}")
-        print(f"  Size: {size_mb:.2f} MB")
-        return True
+    project_root = repo_dir or os.path.dirname(script_dir)
+    
+    print(f"Reading commit {commit_hash}...")
+    
+    try:
+        with timer('ls_tree'):
+            entries = list_tree(project_root, commit_hash)
+            timestamp = commit_time(project_root, commit_hash)
+    except ValueError as e:
+        print(f"Error reading commit: {e}")
+        return False
+    
+    date_time = dos_date_time(timestamp) if timestamp else None
+    
+    # Create zip filename
+    zip_filename = 'snake_idle_beta1.zip'
+    zip_path = os.path.join(script_dir, output_dir, zip_filename)
+    
+    print(f"Packaging Beta_1 version...")
+    print(f"Output: {zip_path}")
+    
+    members = select_members(entries)
+    
+    # Blobs come off the pipe one at a time; deflate them on a pool meanwhile
+    reader = BlobReader(project_root)
+    try:
+        with timer('compress'), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for path, mode, object_id in members:
+                data = reader.read(object_id)
+                futures.append(executor.submit(
+                    compress_bytes, path, data, level, date_time, int(mode, 8) << 16))
+            compressed = [future.result() for future in futures]
+    finally:
+        reader.close()
+    
+    tmp_path = zip_path + '.tmp'
+    with timer('write'):
+        with open(tmp_path, 'wb') as f:
+            writer = ZipWriter(f)
+            for member in compressed:
+                writer.add(member)
+            writer.close()
+        os.replace(tmp_path, zip_path)
+    
+    # Get file size
+    size = os.path.getsize(zip_path)
+    size_mb = size / (1024 * 1024)
+    
+    print(f"\n✓ Beta_1 package created successfully!")
+    print(f"  File: {zip_filename}")
+    print(f"  Size: {size_mb:.2f} MB")
+    return True
 
 if __name__ == '__main__':
     package_beta_version()
-
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Script to build a delta update package between two released versions.
+
+The delta zip holds delta.json (added/changed/removed files), full copies of
+added and small changed files under files/, and binary patches for large
+changed files under patches/. The delta is recorded on the target version in
+versions.json so /api/update can offer it to players.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import zipfile
+
+from file_info import inspect_file
+from versions_file import read_versions, update_versions
+from zipwriter import ZipWriter, compress_bytes
+
+VERSIONS_FILE = 'versions.json'
+
+# Changed files at least this big get a binary patch instead of a full copy
+PATCH_MIN_SIZE = 64 * 1024
+# Only keep a patch when it is smaller than this fraction of the new file
+PATCH_MAX_RATIO = 0.5
+
+# Granularity of matches between the old and new file, and of the comparisons
+# that extend them
+BLOCK_SIZE = 32
+MATCH_STEP = 4096
+
+PATCH_MAGIC = b'SIDP1'
+_COPY = struct.Struct('<cQL')
+_INSERT = struct.Struct('<cL')
+
+
+def _match_length(old, i, new, j):
+    """Length of the common run starting at old[i] and new[j]"""
+    limit = min(len(old) - i, len(new) - j)
+    length = 0
+    while length < limit:
+        size = min(MATCH_STEP, limit - length)
+        if old[i + length:i + length + size] == new[j + length:j + length + size]:
+            length += size
+            continue
+        # Binary search for the first differing byte inside this step
+        lo, hi = 0, size - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[i + length:i + length + mid] == new[j + length:j + length + mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return length + lo
+    return length
+
+
+def make_patch(old, new):
+    """Binary patch turning old into new: COPY(offset, length) and INSERT(data) ops.
+
+    Old is indexed by its aligned BLOCK_SIZE blocks; new is scanned for those
+    blocks at every offset, and each hit is grown backwards and forwards
+    into the longest matching run, so moved or shifted data is found in
+    binary files as well as text.
+    """
+    ops = [PATCH_MAGIC]
+    index = {}
+    for i in range(0, len(old) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        index.setdefault(old[i:i + BLOCK_SIZE], i)
+
+    literal_start = 0
+    j = 0
+    while j <= len(new) - BLOCK_SIZE:
+        i = index.get(new[j:j + BLOCK_SIZE])
+        if i is None:
+            j += 1
+            continue
+        # The match may begin inside the bytes we were about to insert
+        while j > literal_start and i > 0 and old[i - 1] == new[j - 1]:
+            i -= 1
+            j -= 1
+        length = _match_length(old, i, new, j)
+        if j > literal_start:
+            ops.append(_INSERT.pack(b'I', j - literal_start) + new[literal_start:j])
+        ops.append(_COPY.pack(b'C', i, length))
+        j += length
+        literal_start = j
+    if literal_start < len(new):
+        ops.append(_INSERT.pack(b'I', len(new) - literal_start) + new[literal_start:])
+    return b''.join(ops)
+
+
+def apply_patch(old, patch):
+    """Rebuild the new file from old and a patch made by make_patch"""
+    if not patch.startswith(PATCH_MAGIC):
+        raise ValueError("Not a Snake Idle patch")
+    out = []
+    pos = len(PATCH_MAGIC)
+    while pos < len(patch):
+        op = patch[pos:pos + 1]
+        if op == b'C':
+            _, start, length = _COPY.unpack_from(patch, pos)
+            out.append(old[start:start + length])
+            pos += _COPY.size
+        elif op == b'I':
+            _, length = _INSERT.unpack_from(patch, pos)
+            pos += _INSERT.size
+            out.append(patch[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError(f"Corrupt patch at byte {pos}")
+    return b''.join(out)
+
+
+def _read_members(zip_path):
+    """Map arcname -> content for every file in a release zip"""
+    with zipfile.ZipFile(zip_path) as zf:
+        return {info.filename: zf.read(info) for info in zf.infolist() if not info.is_dir()}
+
+
+def build_delta(old_zip, new_zip, from_version, to_version, delta_path):
+    """Write the delta package and return its manifest"""
+    old_files = _read_members(old_zip)
+    new_files = _read_members(new_zip)
+
+    manifest = {
+        "from": from_version,
+        "to": to_version,
+        "added": sorted(set(new_files) - set(old_files)),
+        "removed": sorted(set(old_files) - set(new_files)),
+        "changed": sorted(name for name in set(old_files) & set(new_files)
+                          if old_files[name] != new_files[name]),
+        "patches": {},
+    }
+
+    members = []
+    for name in manifest["added"] + manifest["changed"]:
+        data = new_files[name]
+        if name in old_files and len(data) >= PATCH_MIN_SIZE:
+            patch = make_patch(old_files[name], data)
+            if len(patch) < len(data) * PATCH_MAX_RATIO:
+                patch_name = f'patches/{name}.patch'
+                manifest["patches"][name] = {
+                    "patch": patch_name,
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                }
+                members.append(compress_bytes(patch_name, patch))
+                continue
+        members.append(compress_bytes(f'files/{name}', data))
+
+    manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+    tmp_path = delta_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        writer = ZipWriter(f)
+        writer.add(compress_bytes('delta.json', manifest_bytes))
+        for member in members:
+            writer.add(member)
+        writer.close()
+    os.replace(tmp_path, delta_path)
+    return manifest
+
+
+def _target_path(game_dir, name):
+    """Path of a manifest entry inside game_dir; ValueError if it would escape it"""
+    if not isinstance(name, str):
+        raise ValueError(f"Unsafe path in delta manifest: {name!r}")
+    parts = name.replace('\\', '/').split('/')
+    if (not name or name.startswith(('/', '\\')) or os.path.isabs(name)
+            or os.path.splitdrive(name)[0] or '..' in parts):
+        raise ValueError(f"Unsafe path in delta manifest: {name!r}")
+    return os.path.join(game_dir, *parts)
+
+
+def apply_delta(game_dir, delta_path):
+    """Update an extracted game directory in place from a delta package"""
+    with zipfile.ZipFile(delta_path) as zf:
+        manifest = json.loads(zf.read('delta.json'))
+        # Check every path before touching any file
+        targets = {name: _target_path(game_dir, name)
+                   for name in manifest["added"] + manifest["changed"] + manifest["removed"]}
+        for name in manifest["added"] + manifest["changed"]:
+            target = targets[name]
+            patch = manifest["patches"].get(name)
+            if patch:
+                with open(target, 'rb') as f:
+                    data = apply_patch(f.read(), zf.read(patch["patch"]))
+                if hashlib.sha256(data).hexdigest() != patch["sha256"]:
+                    raise ValueError(f"Patched {name} does not match the release")
+            else:
+                data = zf.read(f'files/{name}')
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+        for name in manifest["removed"]:
+            target = targets[name]
+            if os.path.exists(target):
+                os.remove(target)
+    return manifest
+
+
+def package_delta(from_version, to_version, output_dir='downloads'):
+    """Build the delta between two versions and record it in versions.json"""
+    entries = {v['version']: v for v in read_versions(VERSIONS_FILE)}
+    for version in (from_version, to_version):
+        if version not in entries:
+            print(f"Version {version} not found in {VERSIONS_FILE}")
+            return False
+
+    old_zip = os.path.join(output_dir, entries[from_version]['filename'])
+    new_zip = os.path.join(output_dir, entries[to_version]['filename'])
+    delta_filename = f'snake_idle_delta_{from_version}_to_{to_version}.zip'
+    delta_path = os.path.join(output_dir, delta_filename)
+
+    print(f"Building delta {from_version} -> {to_version}...")
+    manifest = build_delta(old_zip, new_zip, from_version, to_version, delta_path)
+    file_info = inspect_file(delta_path)
+
+    # Record on the target version, replacing an older delta from the same version.
+    # Re-read under the lock: the catalog may have changed while we were building.
+    with update_versions(VERSIONS_FILE) as versions:
+        for target in versions:
+            if target.get('version') == to_version:
+                deltas = [d for d in target.get('deltas', []) if d.get('from') != from_version]
+                deltas.append(dict({"from": from_version, "filename": delta_filename}, **file_info))
+                target['deltas'] = deltas
+
+    full_size = os.path.getsize(new_zip)
+    print("\n✓ Delta package created successfully!")
+    print(f"  File: {delta_filename}")
+    print(f"  Added: {len(manifest['added'])}, changed: {len(manifest['changed'])} "
+          f"({len(manifest['patches'])} patched), removed: {len(manifest['removed'])}")
+    print(f"  Size: {file_info['bytes'] / 1024:.1f} KB "
+          f"({file_info['bytes'] / max(full_size, 1):.1%} of the full download)")
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build a delta update package between two versions",
+        epilog="Example: python package_delta.py 1.0.0 1.0.1")
+    parser.add_argument('from_version', help="version players are updating from")
+    parser.add_argument('to_version', help="version players are updating to")
+    args = parser.parse_args()
+
+    if not package_delta(args.from_version, args.to_version):
+        sys.exit(1)
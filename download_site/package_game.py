@@ -2,40 +2,152 @@
 """
 Script to package the game for distribution
 """
+import argparse
+import contextlib
 import os
 import shutil
-import zipfile
-from datetime import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-def package_game(version, output_dir='downloads'):
-    """Package the game into a zip file"""
+from blob_store import BlobStore, file_digest
+from file_info import inspect_file, record_file_info
+from member_cache import MemberCache, PreviousRelease, compress_file_incremental
+from optimize_images import ImageSettings, optimize_members
+from release_layout import DIRS_TO_INCLUDE, FILES_TO_INCLUDE, OPTIONAL_ITEMS
+from zipwriter import ZipWriter, compress_file
+
+# Images under these paths are shrunk to fit (width, height) by --optimize-images;
+# others are only recompressed
+IMAGE_MAX_SIZES = {
+    'memes': (512, 512),
+}
+
+def image_size(value):
+    """argparse type for a WxH size such as 512x512"""
+    width, sep, height = value.lower().partition('x')
+    try:
+        size = (int(width), int(height))
+    except ValueError:
+        size = None
+    if not sep or size is None or min(size) < 1:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, e.g. 512x512, not {value!r}")
+    return size
+
+def _walk_files(item_path, item):
+    """Yield (file_path, arcname) for every file under a directory, in a stable order"""
+    for root, dirs, files in os.walk(item_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            arcname = os.path.join(item, os.path.relpath(file_path, item_path))
+            yield file_path, arcname
+
+def collect_members(root_dir):
+    """List (file_path, arcname) pairs to package, in archive order"""
+    members = []
+    
+    # Add required files
+    for item in FILES_TO_INCLUDE:
+        item_path = os.path.join(root_dir, item)
+        if os.path.exists(item_path):
+            if os.path.isfile(item_path):
+                members.append((item_path, item))
+                print(f"  Added: {item}")
+            else:
+                members.extend(_walk_files(item_path, item))
+                print(f"  Added directory: {item}/")
+        else:
+            print(f"  Warning: {item} not found, skipping")
+    
+    # Add required directories
+    for item in DIRS_TO_INCLUDE:
+        item_path = os.path.join(root_dir, item)
+        if os.path.exists(item_path):
+            members.extend(_walk_files(item_path, item))
+            print(f"  Added directory: {item}/")
+        else:
+            print(f"  Warning: {item} not found, skipping")
+    
+    # Add optional items if they exist
+    for item in OPTIONAL_ITEMS:
+        item_path = os.path.join(root_dir, item)
+        if os.path.exists(item_path):
+            if os.path.isfile(item_path):
+                members.append((item_path, item))
+                print(f"  Added (optional): {item}")
+            else:
+                members.extend(_walk_files(item_path, item))
+                print(f"  Added directory (optional): {item}/")
+    
+    return members
+
+def compress_members(members, workers=None, level=6, cache=None, previous=None):
+    """Compress (file_path, arcname) pairs into zip Members, keeping their order.
+
+    zlib releases the GIL while deflating, so a thread pool scales with the
+    number of cores: workers defaults to the CPU count, and workers=1
+    compresses serially. PNG/JPEG and other
+    already-compressed formats are stored as-is.
+
+    With a MemberCache and/or PreviousRelease, unchanged files are copied
+    raw instead of being deflated again. Returns (members, sources).
+    """
+    def compress(member):
+        file_path, arcname = member
+        if cache is None and previous is None:
+            return compress_file(file_path, arcname, level), 'compressed'
+        return compress_file_incremental(file_path, arcname, level, cache, previous)
+    
+    if workers == 1:
+        results = list(map(compress, members))
+    else:
+        # Deflating is CPU-bound, so ThreadPoolExecutor's I/O-sized default
+        # (CPU count + 4) would only add contention
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            results = list(executor.map(compress, members))
+    return [member for member, _ in results], [source for _, source in results]
+
+def find_previous_release(output_dir):
+    """Newest release zip in output_dir, or None"""
+    candidates = []
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if (name.startswith('snake_idle_') and name.endswith('.zip')
+                and not name.startswith('snake_idle_delta_')):
+            candidates.append((os.path.getmtime(path), path))
+    return max(candidates)[1] if candidates else None
+
+def _untimed(phase):
+    return contextlib.nullcontext()
+
+def package_game(version, output_dir='downloads', workers=None, level=6,
+                 incremental=False, previous_zip=None, cache_dir=None, store_dir=None,
+                 image_settings=None, root_dir=None, versions_file='versions.json',
+                 timer=_untimed):
+    """Package the game into a zip file
+
+    With incremental=True unchanged members are reused from cache_dir
+    (default: <output_dir>/.member_cache) and from previous_zip (default:
+    the newest release in output_dir, or the zip being rebuilt).
+
+    With store_dir the release is published into that blob store instead of
+    being written as a zip; the server assembles the zip on demand.
+
+    With image_settings (an optimize_images.ImageSettings) PNG/JPEG files are
+    resized and recompressed first, cached in <output_dir>/.image_cache.
+
+    root_dir defaults to the project root. timer(phase) is entered around
+    each stage (walk, images, compress, hash, write, fingerprint); see
+    bench_package.py. Returns (file_info, sources), sources naming where
+    each member came from.
+    """
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Files to include
-    files_to_include = [
-        'snake_idle_pygame.py',
-        'requirements.txt',
-        'README.md',
-    ]
-    
-    # Directories to include
-    dirs_to_include = [
-        'images',
-    ]
-    
-    # Optional files/dirs
-    optional_items = [
-        'background.png',
-        'snaketummy.png',
-        'education.png',
-        'locked.png',
-        'memes',
-    ]
-    
     # Check what exists
-    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root_dir is None:
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     
     # Create zip filename
     zip_filename = f'snake_idle_v{version}.zip'
@@ -44,72 +156,128 @@ def package_game(version, output_dir='downloads'):
     print(f"Packaging game version {version}...")
     print(f"Output: {zip_path}")
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Add required files
-        for item in files_to_include:
-            item_path = os.path.join(root_dir, item)
-            if os.path.exists(item_path):
-                if os.path.isfile(item_path):
-                    zipf.write(item_path, item)
-                    print(f"  Added: {item}")
+    with timer('walk'):
+        members = collect_members(root_dir)
+    
+    staging_dir = None
+    previous = None
+    try:
+        if image_settings is not None:
+            # Optimized images for this build only; removed once they are
+            # compressed, or if anything below fails
+            staging_dir = tempfile.mkdtemp(prefix='.images-', dir=output_dir)
+            with timer('images'):
+                members, image_stats = optimize_members(
+                    members, image_settings, os.path.join(output_dir, '.image_cache'),
+                    staging_dir, workers)
+            print(f"  Images: optimized {image_stats['optimized']}, "
+                  f"already optimized {image_stats['cache']}, left as-is {image_stats['kept']}")
+        
+        cache = None
+        if incremental:
+            cache = MemberCache(cache_dir or os.path.join(output_dir, '.member_cache'))
+            if previous_zip is None:
+                if os.path.exists(zip_path):
+                    previous_zip = zip_path
                 else:
-                    for root, dirs, files in os.walk(item_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                            zipf.write(file_path, arcname)
-                    print(f"  Added directory: {item}/")
-            else:
-                print(f"  Warning: {item} not found, skipping")
+                    previous_zip = find_previous_release(output_dir)
+            if previous_zip:
+                print(f"Reusing unchanged members from {previous_zip}")
+                previous = PreviousRelease(previous_zip)
         
-        # Add required directories
-        for item in dirs_to_include:
-            item_path = os.path.join(root_dir, item)
-            if os.path.exists(item_path):
-                for root, dirs, files in os.walk(item_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                        zipf.write(file_path, arcname)
-                print(f"  Added directory: {item}/")
-            else:
-                print(f"  Warning: {item} not found, skipping")
+        with timer('compress'):
+            compressed, sources = compress_members(members, workers=workers, level=level,
+                                                   cache=cache, previous=previous)
+        digests = None
+        if store_dir:
+            with timer('hash'):
+                digests = [file_digest(file_path) for file_path, _ in members]
+    finally:
+        if previous is not None:
+            previous.close()
+        if staging_dir is not None:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    if incremental:
+        reused = len(sources) - sources.count('compressed')
+        print(f"  Reused {reused} of {len(sources)} members, compressed {sources.count('compressed')}")
+    
+    if store_dir:
+        # Only content the store doesn't have yet takes up space
+        with timer('write'):
+            store = BlobStore(store_dir)
+            records = [store.add(member, digest) for member, digest in zip(compressed, digests)]
+            manifest = store.publish(version, records)
+        print(f"Published to {store_dir}")
+        if os.path.exists(zip_path):
+            print(f"  Warning: {zip_path} exists and is served instead of the store; remove it")
+        # Fingerprint the zip the server will assemble
+        with timer('fingerprint'):
+            file_info = store.zip_info(manifest)
+    else:
+        # Assemble in the collected order so builds are deterministic. Write to a
+        # temp file first: the previous release may be the zip being rebuilt.
+        tmp_path = zip_path + '.tmp'
+        with timer('write'):
+            with open(tmp_path, 'wb') as f:
+                writer = ZipWriter(f)
+                for member in compressed:
+                    writer.add(member)
+                writer.close()
+            os.replace(tmp_path, zip_path)
         
-        # Add optional items if they exist
-        for item in optional_items:
-            item_path = os.path.join(root_dir, item)
-            if os.path.exists(item_path):
-                if os.path.isfile(item_path):
-                    zipf.write(item_path, item)
-                    print(f"  Added (optional): {item}")
-                else:
-                    for root, dirs, files in os.walk(item_path):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.join(item, os.path.relpath(file_path, item_path))
-                            zipf.write(file_path, arcname)
-                    print(f"  Added directory (optional): {item}/")
+        # Fingerprint once at publish time so the server never hashes per request
+        with timer('fingerprint'):
+            file_info = inspect_file(zip_path)
     
-    # Get file size
-    size = os.path.getsize(zip_path)
-    size_mb = size / (1024 * 1024)
+    size_mb = file_info['bytes'] / (1024 * 1024)
+    updated = record_file_info(versions_file, zip_filename, file_info)
     
     print(f"\n✓ Package created successfully!")
     print(f"  File: {zip_filename}")
-    print(f"  Size: {size_mb:.2f} MB")
+    print(f"  Size: {size_mb:.2f} MB ({file_info['bytes']} bytes)")
+    print(f"  SHA-256: {file_info['sha256']}")
+    if updated:
+        print(f"  Updated {updated} existing entry in versions.json")
     print(f"\nNext steps:")
     print(f"  1. Run: python add_version.py")
     print(f"  2. Enter version: {version}")
     print(f"  3. Enter filename: {zip_filename}")
+    return file_info, sources
 
 if __name__ == '__main__':
-    import sys
+    parser = argparse.ArgumentParser(
+        description="Package the game for distribution",
+        epilog="Example: python package_game.py 1.0.0")
+    parser.add_argument('version', help="version number, e.g. 1.0.0")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="compression threads (default: CPU count, 1 = serial)")
+    parser.add_argument('--level', type=int, default=6, choices=range(0, 10),
+                        metavar='0-9', help="deflate level (default: 6)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse compressed members of unchanged files")
+    parser.add_argument('--previous', metavar='ZIP', default=None,
+                        help="release zip to reuse members from (implies --incremental)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="compressed member cache (default: downloads/.member_cache)")
+    parser.add_argument('--store', metavar='DIR', nargs='?', default=None,
+                        const=os.path.join('downloads', '.store'),
+                        help="publish into a blob store instead of writing a zip "
+                             "(default: downloads/.store)")
+    parser.add_argument('--optimize-images', action='store_true',
+                        help="resize and recompress PNG/JPEG files (needs Pillow)")
+    parser.add_argument('--meme-size', type=image_size, default=(512, 512), metavar='WxH',
+                        help="size memes/ images are shrunk to fit (default: 512x512)")
+    parser.add_argument('--image-quality', type=int, default=85, choices=range(1, 96),
+                        metavar='1-95', help="JPEG quality (default: 85)")
+    args = parser.parse_args()
     
-    if len(sys.argv) < 2:
-        print("Usage: python package_game.py <version>")
-        print("Example: python package_game.py 1.0.0")
-        sys.exit(1)
+    image_settings = None
+    if args.optimize_images:
+        max_sizes = dict(IMAGE_MAX_SIZES, memes=args.meme_size)
+        image_settings = ImageSettings(max_sizes, args.image_quality)
     
-    version = sys.argv[1]
-    package_game(version)
-
+    package_game(args.version, workers=args.workers, level=args.level,
+                 incremental=args.incremental or bool(args.previous),
+                 previous_zip=args.previous, cache_dir=args.cache_dir, store_dir=args.store,
+                 image_settings=image_settings)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+What goes into a release zip.
+
+Shared by package_game.py, which builds releases, and bundles.py, which the
+web servers use to cut smaller bundles from them, so the servers don't have
+to import the packaging script.
+"""
+
+# Files to include
+FILES_TO_INCLUDE = [
+    'snake_idle_pygame.py',
+    'requirements.txt',
+    'README.md',
+]
+
+# Directories to include
+DIRS_TO_INCLUDE = [
+    'images',
+]
+
+# Optional files/dirs
+OPTIONAL_ITEMS = [
+    'background.png',
+    'snaketummy.png',
+    'education.png',
+    'locked.png',
+    'memes',
+]
+
+# Smaller downloads served as /download/<version>?bundle=<name>: the files and
+# directories of the full release each bundle keeps
+BUNDLES = {
+    'lite': FILES_TO_INCLUDE + DIRS_TO_INCLUDE,
+}
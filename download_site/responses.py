@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Response helpers shared by the download site apps
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from werkzeug.http import (http_date, is_resource_modified, parse_if_range_header,
+                           parse_range_header)
+from werkzeug.security import safe_join
+
+# Read size used when streaming byte ranges
+CHUNK_SIZE = 64 * 1024
+
+# More ranges than this in one request is treated as abuse; send the whole file
+MAX_RANGES = 16
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Server preference when the client accepts several encodings equally
+ENCODING_PREFERENCE = ('br', 'gzip', 'identity')
+
+# Text assets worth precompressing
+COMPRESSIBLE_TYPES = {
+    'text/css', 'text/html', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+MAX_PRECOMPRESS_SIZE = 1024 * 1024
+
+# Static files up to this size are served from memory...
+MAX_STATIC_CACHE_SIZE = 1024 * 1024
+# ...within this much memory per worker, least recently used dropped first
+STATIC_CACHE_BYTES = 32 * 1024 * 1024
+
+# Names like style.<12 hex digits>.css (build_pages.fingerprinted_name, static_url)
+FINGERPRINTED_NAME = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+# Fingerprinted URLs change whenever the content does, so they never need revalidating
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class _StaticCache:
+    """LRU map of file path -> ((mtime_ns, size), entry), bounded by entry bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path, key):
+        with self._lock:
+            cached = self._entries.get(file_path)
+            if cached is None or cached[0] != key:
+                return None
+            self._entries.move_to_end(file_path)
+            return cached[2]
+
+    def put(self, file_path, key, entry, size):
+        with self._lock:
+            old = self._entries.pop(file_path, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[file_path] = (key, size, entry)
+            self.size += size
+            while self.size > self.max_bytes and self._entries:
+                _, (_, dropped, _) = self._entries.popitem(last=False)
+                self.size -= dropped
+
+
+_static_cache = _StaticCache(STATIC_CACHE_BYTES)
+
+
+def encode_variants(body):
+    """Precompress a body: {'identity': ..., 'gzip': ..., 'br': ...}.
+
+    Variants that don't come out smaller are left out. This is the only place
+    text responses get compressed, never on the request path.
+    """
+    variants = {'identity': body}
+    gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+    if len(gzipped) < len(body):
+        variants['gzip'] = gzipped
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        if len(compressed) < len(body):
+            variants['br'] = compressed
+    return variants
+
+
+def choose_encoding(variants, accept):
+    """Pick the best available variant for a parsed Accept-Encoding header"""
+    best, best_quality = 'identity', 0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding not in variants:
+            continue
+        quality = accept[encoding]
+        if encoding == 'identity' and 'identity' not in accept and quality == 0:
+            # identity is acceptable unless explicitly refused
+            quality = 0.001
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def send_variants(variants, etag, mimetype, last_modified=None, cache_control=None):
+    """Serve the negotiated precompressed variant with Vary and 304 support"""
+    encoding = choose_encoding(variants, request.accept_encodings)
+    response = Response(variants[encoding], mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding != 'identity':
+        response.content_encoding = encoding
+        # Each encoding is a different representation, so it needs its own ETag
+        etag = f'{etag}-{encoding}'
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+
+def precompress_body(render):
+    """Render a body once, fingerprint it and precompress it"""
+    body = render()
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return encode_variants(body), hashlib.sha256(body).hexdigest()[:32]
+
+
+def cached_response(generation, key, render, mimetype='text/html', max_age=None):
+    """Serve a body rendered once per catalog generation, answering 304s.
+
+    With max_age, clients and shared caches may reuse it for that many
+    seconds without asking.
+    """
+    variants, etag = generation.cached(key, lambda: precompress_body(render))
+    response = send_variants(variants, etag, mimetype, generation.mtime)
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        # Let browsers keep the page but revalidate so new releases show up
+        response.cache_control.no_cache = True
+    return response
+
+
+def uncached_response(body, mimetype='application/json'):
+    """Serve a per-request body with a content ETag so repeated polls get 304s"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response = send_variants({'identity': body}, hashlib.sha256(body).hexdigest()[:32],
+                             mimetype)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _static_entry(file_path):
+    """(send_variants() arguments, content hash) for a small static file, or None.
+
+    Kept in memory with text assets precompressed, and rebuilt when the
+    file's mtime or size changes.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    if st.st_size > MAX_STATIC_CACHE_SIZE:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    entry = _static_cache.get(file_path, key)
+    if entry is None:
+        with open(file_path, 'rb') as f:
+            body = f.read()
+        mimetype = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        if mimetype in COMPRESSIBLE_TYPES and len(body) <= MAX_PRECOMPRESS_SIZE:
+            variants = encode_variants(body)
+        else:
+            variants = {'identity': body}
+        entry = ((variants, file_etag(st), mimetype, int(st.st_mtime)),
+                 hashlib.sha256(body).hexdigest())
+        _static_cache.put(file_path, key, entry, sum(map(len, variants.values())))
+    return entry
+
+
+def static_variants(file_path):
+    """Small static file from the memory cache, text assets precompressed.
+
+    Returns the send_variants() arguments (variants, etag, mimetype,
+    last_modified), or None for files that are too big to cache and should
+    be sent from disk.
+    """
+    entry = _static_entry(file_path)
+    return entry[0] if entry else None
+
+
+def static_fingerprint(file_path):
+    """Short content hash of a cacheable static file, or None"""
+    entry = _static_entry(file_path)
+    return entry[1][:12] if entry else None
+
+
+def fingerprinted_path(static_dir, filename):
+    """The file a fingerprinted name (style.<hash>.css) stands for, if the hash is current"""
+    match = FINGERPRINTED_NAME.match(filename)
+    if not match:
+        return None
+    file_path = safe_join(static_dir, match.group(1) + match.group(3))
+    if file_path is None or static_fingerprint(file_path) != match.group(2):
+        return None
+    return file_path
+
+
+def file_etag(st):
+    """Strong validator for a file, stable for as long as the file is unchanged"""
+    return '%x-%x' % (st.st_mtime_ns, st.st_size)
+
+
+def content_disposition(filename):
+    """Attachment header value for a download name"""
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return "attachment; filename*=UTF-8''" + quote(filename)
+    return 'attachment; filename="%s"' % filename.replace('"', '')
+
+
+def _if_range_matches(etag, last_modified, if_range_header):
+    """Check If-Range against the current validators (strong comparison only)"""
+    if not if_range_header:
+        return True
+    if_range = parse_if_range_header(if_range_header)
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return http_date(if_range.date) == http_date(last_modified)
+    # Unparseable If-Range: play it safe and send the whole file
+    return False
+
+
+def resolve_ranges(size, etag, last_modified, range_header, if_range_header=None):
+    """Resolve a Range header to [(start, end), ...] with end exclusive.
+
+    Returns None when the whole file should be sent and [] when none of the
+    requested ranges can be satisfied.
+    """
+    if not range_header:
+        return None
+    if not _if_range_matches(etag, last_modified, if_range_header):
+        return None
+    parsed = parse_range_header(range_header)
+    # Invalid or non-byte ranges are ignored, as RFC 7233 allows
+    if parsed is None or parsed.units != 'bytes':
+        return None
+    if len(parsed.ranges) > MAX_RANGES:
+        return None
+
+    spans = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start = max(size + start, 0)
+            stop = size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            spans.append((start, stop))
+    return spans
+
+
+def _iter_file_ranges(file_path, spans, parts=None):
+    """Stream the given byte spans, with optional multipart headers between them"""
+    with open(file_path, 'rb') as f:
+        for index, (start, stop) in enumerate(spans):
+            if parts is not None:
+                yield parts[index]
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+        if parts is not None:
+            yield parts[-1]
+
+
+def multipart_byteranges(spans, size, mimetype):
+    """(content type, part headers, content length) for a multi-range response.
+
+    parts[i] goes before span i and parts[-1] closes the body.
+    """
+    boundary = uuid.uuid4().hex
+    parts = [
+        ('%s--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+         % ('\r\n' if index else '', boundary, mimetype, start, stop - 1, size)).encode('ascii')
+        for index, (start, stop) in enumerate(spans)
+    ]
+    parts.append(('\r\n--%s--\r\n' % boundary).encode('ascii'))
+    content_length = sum(len(p) for p in parts) + sum(stop - start for start, stop in spans)
+    return 'multipart/byteranges; boundary=' + boundary, parts, content_length
+
+
+def digest_headers(digest):
+    """Advertise the full file's SHA-256 (base64), also on partial responses"""
+    if not digest:
+        return {}
+    return {'Repr-Digest': 'sha-256=:%s:' % digest, 'Digest': 'SHA-256=' + digest}
+
+
+def content_validators(size, mtime_ns, validators=None):
+    """(etag, digest, last_modified) for content of a size and mtime, preferring publish-time values"""
+    digest = None
+    mtime = mtime_ns // 1000000000
+    if validators and validators['bytes'] == size and validators['mtime'] == mtime:
+        etag = validators['etag']
+        digest = validators['digest']
+    else:
+        etag = '%x-%x' % (mtime_ns, size)
+    last_modified = datetime.fromtimestamp(mtime, timezone.utc)
+    return etag, digest, last_modified
+
+
+def download_validators(st, validators=None):
+    """(etag, digest, last_modified) for a file, preferring publish-time values"""
+    return content_validators(st.st_size, st.st_mtime_ns, validators)
+
+
+def send_download(file_path, download_name, validators=None):
+    """Send a file as an attachment with full RFC 7233 range support.
+
+    Handles conditional GET (304), single ranges (206), multiple ranges
+    (206 multipart/byteranges), If-Range and unsatisfiable ranges (416).
+    HEAD requests get the same headers without a body.
+
+    validators are the values recorded at publish time (see file_info); they
+    are used for the ETag and digest headers while the file still matches.
+    """
+    file_path = os.path.abspath(file_path)
+    st = os.stat(file_path)
+    size = st.st_size
+    etag, digest, last_modified = download_validators(st, validators)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.accept_ranges = 'bytes'
+        return response
+
+    spans = None
+    if request.method in ('GET', 'HEAD'):
+        spans = resolve_ranges(size, etag, last_modified, request.headers.get('Range'),
+                               request.headers.get('If-Range'))
+
+    if spans is None:
+        response = send_file(file_path, mimetype=mimetype, as_attachment=True,
+                             download_name=download_name, conditional=False,
+                             etag=etag, last_modified=last_modified)
+        response.accept_ranges = 'bytes'
+        response.headers.update(digest_headers(digest))
+        return response
+
+    if not spans:
+        response = Response(status=416)
+        response.headers['Content-Range'] = 'bytes */%d' % size
+        response.accept_ranges = 'bytes'
+        return response
+
+    headers = {'Content-Disposition': content_disposition(download_name)}
+    if len(spans) == 1:
+        start, stop = spans[0]
+        response = Response(_iter_file_ranges(file_path, spans), status=206,
+                            mimetype=mimetype, headers=headers)
+        response.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+        response.content_length = stop - start
+    else:
+        content_type, parts, content_length = multipart_byteranges(spans, size, mimetype)
+        response = Response(_iter_file_ranges(file_path, spans, parts), status=206,
+                            headers=headers)
+        response.headers['Content-Type'] = content_type
+        response.content_length = content_length
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.accept_ranges = 'bytes'
+    response.headers.update(digest_headers(digest))
+    return response
+
+
+def send_stream(chunks, size, mtime, download_name, validators=None):
+    """Send a file that is being generated, as an attachment of known size.
+
+    The headers and validators match what send_download gives the finished
+    file (size bytes, modified at mtime), so caches and resumed downloads
+    carry over once it exists. Range requests get the whole file.
+    """
+    etag, digest, last_modified = content_validators(size, int(mtime) * 1000000000, validators)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    response = Response(chunks, mimetype=mimetype,
+                        headers={'Content-Disposition': content_disposition(download_name)})
+    response.content_length = size
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers.update(digest_headers(digest))
+    return response
+
+
+def call_on_close(response, callback):
+    """response.call_on_close() that also fires for send_file() responses.
+
+    Those are direct_passthrough: the server gets the file wrapper itself
+    (for sendfile) and only calls its close(), never the Response's.
+    """
+    body = response.response
+    if response.direct_passthrough and hasattr(body, 'close'):
+        close = body.close
+
+        def close_and_notify():
+            try:
+                close()
+            finally:
+                callback()
+        body.close = close_and_notify
+    else:
+        response.call_on_close(callback)
+
+
+# Values of the apps' SENDFILE_MODE; '' serves files from Python
+SENDFILE_MODES = ('', 'x-accel', 'x-sendfile')
+
+
+def check_sendfile_mode(mode):
+    """Normalize a SENDFILE_MODE setting; ValueError at startup rather than on every download"""
+    mode = (mode or '').strip().lower()
+    if mode not in SENDFILE_MODES:
+        raise ValueError(f"Unknown SENDFILE_MODE {mode!r}: use one of "
+                         + ', '.join(repr(m) for m in SENDFILE_MODES))
+    return mode
+
+
+def offload_file(mode, file_path, internal_uri, download_name=None, validators=None):
+    """Let the reverse proxy stream a file instead of a Python worker.
+
+    mode is 'x-accel' (nginx, internal_uri must map to an internal location)
+    or 'x-sendfile' (Apache/lighttpd, the absolute path is sent).
+
+    The ETag, Last-Modified and digest headers (and 304s) are the ones
+    send_download gives, so they don't depend on the deployment mode.
+    """
+    etag, digest, last_modified = download_validators(os.stat(file_path), validators)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.accept_ranges = 'bytes'
+        return response
+    mimetype = mimetypes.guess_type(download_name or file_path)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    if mode == 'x-accel':
+        response.headers['X-Accel-Redirect'] = quote(internal_uri)
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(file_path)
+    else:
+        raise ValueError('Unknown SENDFILE_MODE: %r' % mode)
+    if download_name:
+        response.headers['Content-Disposition'] = content_disposition(download_name)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers.update(digest_headers(digest))
+    return response
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The site's modules are plain scripts in download_site/, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
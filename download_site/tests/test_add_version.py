@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import add_version
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'add_version.py')
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """A scratch site directory with two release zips in downloads/"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'downloads').mkdir()
+    for version in ('1.0.0', '1.1.0'):
+        with zipfile.ZipFile(tmp_path / 'downloads' / f'snake_idle_v{version}.zip', 'w') as zf:
+            zf.writestr('snake_idle_pygame.py', f'VERSION = {version!r}\n')
+    return tmp_path
+
+
+def write_manifest(site, items):
+    path = site / 'builds.json'
+    path.write_text(json.dumps(items))
+    return str(path)
+
+
+def build(version, **extra):
+    return dict(version=version, filename=f'snake_idle_v{version}.zip', **extra)
+
+
+def test_manifest_publishes_every_build(site):
+    manifest = write_manifest(site, [build('1.0.0'), build('1.1.0', changelog=['Faster'])])
+    assert add_version.add_versions_from_manifest(manifest)
+    versions = json.loads((site / 'versions.json').read_text())
+    assert [v['version'] for v in versions] == ['1.0.0', '1.1.0']
+    assert all(len(v['sha256']) == 64 for v in versions)
+    assert versions[1]['changelog'] == ['Faster']
+
+
+@pytest.mark.parametrize('bad', [
+    'snake_idle_v1.1.0.zip',
+    ['1.1.0', 'snake_idle_v1.1.0.zip'],
+    {'version': '1.1.0'},
+    {'version': '1.1.0', 'filename': '../versions.json'},
+    build('1.1.0', changelog='not a list'),
+    build('1.0.0'),
+])
+def test_bad_builds_publish_nothing(site, bad, capsys):
+    manifest = write_manifest(site, [build('1.0.0'), bad])
+    assert add_version.add_versions_from_manifest(manifest) is False
+    assert '✗' in capsys.readouterr().out
+    assert not (site / 'versions.json').exists()
+
+
+def test_invalid_zip_publishes_nothing(site):
+    (site / 'downloads' / 'snake_idle_v1.1.0.zip').write_bytes(b'not a zip')
+    manifest = write_manifest(site, [build('1.0.0'), build('1.1.0')])
+    assert add_version.add_versions_from_manifest(manifest) is False
+    assert not (site / 'versions.json').exists()
+
+
+def test_cli_reports_errors_with_exit_code(site):
+    manifest = write_manifest(site, [42])
+    result = subprocess.run([sys.executable, SCRIPT, '--manifest', manifest],
+                            capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'Build #1' in result.stdout
+    assert 'Traceback' not in result.stderr
+
+    (site / 'versions.json').write_text('{not json')
+    result = subprocess.run([sys.executable, SCRIPT, '--manifest',
+                             write_manifest(site, [build('1.0.0')])],
+                            capture_output=True, text=True)
+    assert result.returncode == 1
+    assert result.stdout.splitlines()[-1].startswith('Error: ')
+    assert 'Traceback' not in result.stderr
@@ -0,0 +1,132 @@
+import pytest
+from flask import Flask, make_response
+
+import admission
+from admission import TABLE_SIZE, Admission, _client_key
+
+
+def make_app(tmp_path, rate=0.0, burst=10, max_transfers=0, bandwidth=0):
+    app = Flask(__name__)
+    app.config.update(ADMISSION_FILE=str(tmp_path / 'admission.mmap'), DOWNLOAD_RATE=rate,
+                      DOWNLOAD_BURST=burst, MAX_TRANSFERS=max_transfers,
+                      DOWNLOAD_BANDWIDTH=bandwidth, TRANSFER_RETRY_AFTER=7)
+
+    @app.route('/download')
+    def download():
+        return app.response_class([b'x' * 500] * 4)
+
+    @app.route('/')
+    def index():
+        return 'index'
+    return app, admission.init_app(app)
+
+
+def test_token_bucket_allows_burst_then_refills(tmp_path):
+    adm = Admission(str(tmp_path / 'admission.mmap'), rate=2.0, burst=3)
+    assert [adm.take_token('10.0.0.1', now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert adm.take_token('10.0.0.1', now=100.0) == pytest.approx(0.5)
+    # Other clients have their own bucket
+    assert adm.take_token('10.0.0.2', now=100.0) == 0
+    # Half a second later one token has refilled
+    assert adm.take_token('10.0.0.1', now=100.5) == 0
+
+
+def test_buckets_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'admission.mmap')
+    first = Admission(path, rate=1.0, burst=1)
+    second = Admission(path, rate=1.0, burst=1)
+    assert first.take_token('10.0.0.1', now=100.0) == 0
+    assert second.take_token('10.0.0.1', now=100.0) > 0
+
+
+def colliding_clients():
+    """Two addresses whose buckets start probing at the same slot"""
+    seen = {}
+    for i in range(100000):
+        client = f'10.{i // 65536}.{i // 256 % 256}.{i % 256}'
+        slot = _client_key(client) % TABLE_SIZE
+        if slot in seen:
+            return seen[slot], client
+        seen[slot] = client
+
+
+def test_colliding_client_keeps_its_bucket_behind_an_idle_slot(tmp_path):
+    first, second = colliding_clients()
+    adm = Admission(str(tmp_path / 'admission.mmap'), rate=1.0, burst=1)
+    assert adm.take_token(first, now=100.0) == 0
+    assert adm.take_token(second, now=100.9) == 0
+    # first's bucket is idle and full again, but second's is still empty
+    assert adm.take_token(second, now=101.0) == pytest.approx(0.9)
+
+
+def test_byte_bucket_goes_into_debt(tmp_path):
+    adm = Admission(str(tmp_path / 'admission.mmap'), bandwidth=1000)
+    # One second of bandwidth is free, the rest has to be slept off
+    assert adm.take_bytes('10.0.0.1', 1000, now=100.0) == 0
+    assert adm.take_bytes('10.0.0.1', 500, now=100.0) == pytest.approx(0.5)
+    # Independent of the request bucket
+    assert Admission(adm.path, rate=1.0, burst=1).take_token('10.0.0.1', now=100.0) == 0
+
+
+def test_transfer_limit(tmp_path):
+    adm = Admission(str(tmp_path / 'admission.mmap'), max_transfers=2)
+    assert adm.acquire_transfer()
+    assert adm.acquire_transfer()
+    assert not adm.acquire_transfer()
+    adm.release_transfer()
+    assert adm.in_flight() == 1
+    assert adm.acquire_transfer()
+
+
+def test_limits_off_by_default(tmp_path):
+    adm = Admission(str(tmp_path / 'admission.mmap'))
+    assert all(adm.take_token('10.0.0.1') == 0 for _ in range(100))
+    assert all(adm.acquire_transfer() for _ in range(100))
+
+
+def test_app_returns_429_with_retry_after(tmp_path):
+    app, _ = make_app(tmp_path, rate=0.5, burst=1)
+    client = app.test_client()
+    assert client.get('/download').status_code == 200
+    response = client.get('/download')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    # Only download routes are limited
+    assert client.get('/').status_code == 200
+
+
+def test_app_holds_transfer_slot_until_body_is_closed(tmp_path):
+    app, adm = make_app(tmp_path, max_transfers=1)
+    client = app.test_client()
+    response = client.get('/download', buffered=False)
+    assert adm.in_flight() == 1
+    busy = client.get('/download')
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == '7'
+    response.get_data()
+    response.close()
+    assert adm.in_flight() == 0
+    assert client.get('/download').status_code == 200
+
+
+def test_app_paces_download_body(tmp_path, monkeypatch):
+    app, _ = make_app(tmp_path, bandwidth=1000)
+    monkeypatch.setattr(admission, 'PACE_BYTES', 100)
+    slept = []
+    monkeypatch.setattr(admission.time, 'sleep', slept.append)
+    response = app.test_client().get('/download')
+    assert response.data == b'x' * 2000
+    response.close()
+    # The first second's worth goes out at once, then each chunk waits for its bytes
+    assert len(slept) == 2
+    assert slept[0] == pytest.approx(0.5, abs=0.05)
+    assert slept[1] == pytest.approx(1.0, abs=0.05)
+
+
+def test_offloaded_download_is_paced_by_nginx(tmp_path):
+    adm = Admission(str(tmp_path / 'admission.mmap'), bandwidth=1000)
+    with Flask(__name__).test_request_context():
+        response = make_response('')
+    response.headers['X-Accel-Redirect'] = '/protected/snake_idle_v1.0.0.zip'
+    admission._pace(response, adm, '10.0.0.1')
+    assert response.headers['X-Accel-Limit-Rate'] == '1000'
@@ -0,0 +1,89 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from blob_store import BlobStore
+
+GAME = b'print("snake idle")\n' * 500
+README = b'# Snake Idle\n' * 200
+PHOTO = os.urandom(4096)
+
+
+def write_release(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, data in members.items():
+            zf.writestr(arcname, data)
+
+
+@pytest.fixture
+def store(tmp_path):
+    write_release(tmp_path / 'v1.zip', {
+        'snake_idle_pygame.py': GAME, 'README.md': README, 'images/photo.png': PHOTO})
+    # 1.0.1 only changes the README
+    write_release(tmp_path / 'v2.zip', {
+        'snake_idle_pygame.py': GAME, 'README.md': README + b'v2\n', 'images/photo.png': PHOTO})
+    store = BlobStore(str(tmp_path / 'store'), cache_bytes=10 * 1024 ** 2)
+    store.import_zip('1.0.0', str(tmp_path / 'v1.zip'))
+    store.import_zip('1.0.1', str(tmp_path / 'v2.zip'))
+    return store
+
+
+def blob_names(store):
+    return sorted(name for _, _, files in os.walk(store.blob_dir) for name in files)
+
+
+def assembled(store, version):
+    return b''.join(store.iter_zip(store.manifest(version)))
+
+
+def test_shared_files_are_stored_once(store):
+    assert store.versions() == ['1.0.0', '1.0.1']
+    first, second = ({r['arcname']: r['blob'] for r in store.manifest(v)['members']}
+                     for v in ('1.0.0', '1.0.1'))
+    assert first['snake_idle_pygame.py'] == second['snake_idle_pygame.py']
+    assert first['images/photo.png'] == second['images/photo.png']
+    assert first['README.md'] != second['README.md']
+    assert len(blob_names(store)) == 4
+    versions, blob_bytes, zip_bytes = store.stats()
+    assert versions == 2
+    assert blob_bytes < zip_bytes
+
+
+def test_assembled_zip_has_every_member(store):
+    data = assembled(store, '1.0.1')
+    assert len(data) == store.zip_size(store.manifest('1.0.1'))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.read('snake_idle_pygame.py') == GAME
+        assert zf.read('README.md') == README + b'v2\n'
+        assert zf.read('images/photo.png') == PHOTO
+    # Always the same bytes, so published hashes stay valid
+    assert assembled(store, '1.0.1') == data
+    info = store.zip_info(store.manifest('1.0.1'))
+    assert info['bytes'] == len(data)
+
+
+def test_stream_caches_the_zip_once_sent(store):
+    manifest = store.manifest('1.0.0')
+    assert store.cached_zip(manifest) is None
+    chunks = store.stream(manifest)
+    next(chunks)
+    chunks.close()
+    # A download cut short leaves nothing behind
+    assert store.cached_zip(manifest) is None
+    data = b''.join(store.stream(manifest))
+    path = store.cached_zip(manifest)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert int(os.stat(path).st_mtime) == manifest['created']
+
+
+def test_gc_keeps_blobs_still_referenced(store):
+    os.remove(store.manifest_path('1.0.0'))
+    removed, freed = store.gc()
+    assert removed == 1 and freed > 0
+    assert len(blob_names(store)) == 3
+    with zipfile.ZipFile(io.BytesIO(assembled(store, '1.0.1'))) as zf:
+        assert zf.testzip() is None
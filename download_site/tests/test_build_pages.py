@@ -0,0 +1,43 @@
+import json
+import os
+
+from build_pages import build_pages
+
+
+def entry(version, **extra):
+    return dict(version=version, filename=f'snake_idle_v{version}.zip', date='2024-01-01',
+                **extra)
+
+
+def build(tmp_path, versions):
+    versions_file = tmp_path / 'versions.json'
+    versions_file.write_text(json.dumps(versions))
+    output_dir = tmp_path / 'site'
+    result = build_pages(str(output_dir), str(versions_file))
+    return result, output_dir
+
+
+def test_site_lists_valid_versions(tmp_path, capsys):
+    result, output_dir = build(tmp_path, [
+        entry('1.0.0'),
+        entry('2.0.0'),
+        {"version": "3.0.0"},
+        entry('4.0.0', sha256='not-a-hash', bytes=1, mtime=1),
+        entry('1.0.0', description='duplicate'),
+    ])
+    assert result
+    assert 'skipping entry' in capsys.readouterr().err
+    api = json.loads((output_dir / 'api' / 'versions.json').read_text())
+    assert [v['version'] for v in api] == ['2.0.0', '1.0.0']
+    html = (output_dir / 'index.html').read_text()
+    assert 'downloads/snake_idle_v2.0.0.zip' in html
+    assert 'downloads/snake_idle_v1.0.0.zip' in html
+    assert '3.0.0' not in html and '4.0.0' not in html
+    assert all(name in os.listdir(output_dir) for name in ('_headers', '.build_state.json'))
+
+
+def test_unusable_versions_file_fails_cleanly(tmp_path, capsys):
+    result, output_dir = build(tmp_path, {"version": "1.0.0"})
+    assert result is False
+    assert capsys.readouterr().out.splitlines()[-1].startswith('Error: ')
+    assert not (output_dir / 'index.html').exists()
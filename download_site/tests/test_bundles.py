@@ -0,0 +1,77 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from bundles import ZipBundle, bundle_filename
+from disk_cache import DiskCache
+
+FILES = {
+    'snake_idle_pygame.py': b'print("snake")\n' * 200,
+    'requirements.txt': b'pygame\n',
+    'README.md': b'# Snake Idle\n',
+    'images/snake.png': os.urandom(1024),
+    'background.png': os.urandom(4096),
+    'memes/meme.png': os.urandom(4096),
+}
+LITE = ['snake_idle_pygame.py', 'requirements.txt', 'README.md', 'images/snake.png']
+
+
+@pytest.fixture
+def release(tmp_path):
+    path = tmp_path / 'snake_idle_v1.0.0.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, data in FILES.items():
+            zf.writestr(arcname, data)
+    return path
+
+
+def test_bundle_filename():
+    assert bundle_filename('snake_idle_v1.0.0.zip', 'lite') == 'snake_idle_v1.0.0_lite.zip'
+
+
+def test_lite_bundle_keeps_declared_members(release):
+    bundle = ZipBundle(str(release), 'lite')
+    data = b''.join(bundle.iter_zip())
+    assert len(data) == bundle.size()
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == LITE
+        for arcname in LITE:
+            assert zf.read(arcname) == FILES[arcname]
+
+
+def test_unknown_bundle(release):
+    with pytest.raises(KeyError):
+        ZipBundle(str(release), 'huge')
+
+
+def test_bundle_name_changes_with_the_release(release):
+    name = ZipBundle(str(release), 'lite').name
+    os.utime(release, (1700000000, 1700000000))
+    assert ZipBundle(str(release), 'lite').name != name
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'), 1000)
+    for name in ('a.zip', 'b.zip'):
+        assert b''.join(cache.put_stream(name, [b'x' * 400], mtime=1700000000)) == b'x' * 400
+    # Make a.zip the older entry, then use it again
+    os.utime(cache.path('a.zip'), (1000, 1700000000))
+    os.utime(cache.path('b.zip'), (2000, 1700000000))
+    assert cache.get('a.zip') == cache.path('a.zip')
+    assert int(os.stat(cache.path('a.zip')).st_mtime) == 1700000000
+
+    b''.join(cache.put_stream('c.zip', [b'y' * 400]))
+    assert cache.get('b.zip') is None
+    assert cache.get('a.zip') and cache.get('c.zip')
+
+
+def test_disk_cache_drops_partial_entries(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'), 1000)
+    chunks = cache.put_stream('a.zip', [b'x' * 100, b'y' * 100])
+    next(chunks)
+    chunks.close()
+    assert cache.get('a.zip') is None
+    assert os.listdir(cache.directory) == []
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from catalog import (Catalog, CatalogGeneration, decode_cursor, parse_version_query,
+                     version_key)
+
+
+def entry(version, platform='Windows', date='2024-01-01', legacy=False):
+    return {"version": version, "filename": f"snake_idle_v{version}.zip",
+            "platform": platform, "date": date, "legacy": legacy}
+
+
+@pytest.fixture
+def generation():
+    return CatalogGeneration([
+        entry('1.0.0', date='2024-03-01'),
+        entry('10.0.0', platform='All Platforms', date='2024-09-01'),
+        entry('2.0.0-beta.1', platform='Linux', date='2024-05-01'),
+        entry('2.0.0', platform='Linux', date='2024-06-01'),
+        entry('Beta_1', date='2023-12-01', legacy=True),
+    ], None, 1)
+
+
+def test_version_key_orders_semver():
+    versions = ['1.0.0', '10.0.0', '9.0.0', '2.0.0-beta.1', '2.0.0', 'junk']
+    assert sorted(versions, key=version_key) == [
+        'junk', '1.0.0', '2.0.0-beta.1', '2.0.0', '9.0.0', '10.0.0']
+
+
+def test_current_releases_sort_newest_first_then_legacy(generation):
+    assert [v['version'] for v in generation.versions] == [
+        '10.0.0', '2.0.0', '2.0.0-beta.1', '1.0.0', 'Beta_1']
+
+
+def test_platform_filter_includes_all_platforms(generation):
+    page, _ = generation.query(platform='linux')
+    assert [v['version'] for v in page] == ['10.0.0', '2.0.0', '2.0.0-beta.1']
+
+
+def test_filters_combine(generation):
+    page, _ = generation.query(platform='Windows', legacy=False,
+                               since='2024-01-01', until='2024-12-31')
+    assert [v['version'] for v in page] == ['10.0.0', '1.0.0']
+
+
+def test_fields_projection(generation):
+    page, _ = generation.query(legacy=True, fields=('version', 'missing'))
+    assert page == [{'version': 'Beta_1'}]
+
+
+def test_pagination_walks_every_entry_once(generation):
+    seen = []
+    cursor = None
+    while True:
+        page, next_cursor = generation.query(cursor=cursor, limit=2)
+        seen.extend(v['version'] for v in page)
+        if next_cursor is None:
+            break
+        cursor = decode_cursor(next_cursor)
+    assert seen == [v['version'] for v in generation.versions]
+
+
+def test_duplicate_versions_page_to_the_end():
+    first = entry('2.0.0', date='2024-06-01')
+    generation = CatalogGeneration([
+        entry('3.0.0'), first, entry('1.0.0'), entry('2.0.0', date='2024-07-01'),
+        entry('0.5.0'),
+    ], None, 1)
+    assert [v['version'] for v in generation.versions] == ['3.0.0', '2.0.0', '1.0.0', '0.5.0']
+    assert generation.find('2.0.0') is first
+    seen = []
+    cursor = None
+    for _ in range(10):
+        page, next_cursor = generation.query(cursor=cursor, limit=1)
+        seen.extend(v['version'] for v in page)
+        if next_cursor is None:
+            break
+        cursor = decode_cursor(next_cursor)
+    assert seen == ['3.0.0', '2.0.0', '1.0.0', '0.5.0']
+
+
+def test_unknown_cursor_is_rejected(generation):
+    with pytest.raises(ValueError):
+        generation.query(cursor='3.0.0', limit=2)
+
+
+def test_parse_version_query():
+    assert parse_version_query({}) is None
+    query = parse_version_query({'platform': 'Linux', 'legacy': 'false', 'limit': '5',
+                                 'fields': 'version, date'})
+    assert query == {'platform': 'Linux', 'legacy': False, 'limit': 5,
+                     'fields': ('version', 'date')}
+    for bad in ({'limit': '0'}, {'limit': 'x'}, {'legacy': 'maybe'}, {'since': '2024-13-01'}):
+        with pytest.raises(ValueError):
+            parse_version_query(bad)
+
+
+def test_latest_for(generation):
+    latest = json.loads(generation.latest_for(current='2.0.0', platform='Linux'))
+    assert latest['version'] == '10.0.0'
+    assert latest['update_available'] is True
+    latest = json.loads(generation.latest_for(current='10.0.0'))
+    assert latest['update_available'] is False
+
+
+def test_bad_entries_are_skipped(tmp_path, capsys):
+    path = tmp_path / 'versions.json'
+    path.write_text(json.dumps([
+        entry('1.0.0'),
+        dict(entry('1.0.1'), sha256='not-hex', bytes=10, mtime=1),
+        'junk',
+    ]))
+    generation = Catalog(str(path)).get()
+    assert [v['version'] for v in generation.versions] == ['1.0.0']
+    assert 'skipping' in capsys.readouterr().err
+
+
+def test_invalid_file_keeps_previous_catalog(tmp_path):
+    path = tmp_path / 'versions.json'
+    path.write_text(json.dumps([entry('1.0.0')]))
+    catalog = Catalog(str(path))
+    first = catalog.get()
+    path.write_text(json.dumps({"version": "2.0.0"}, indent=2))
+    assert catalog.get() is first
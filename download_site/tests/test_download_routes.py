@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from flask import Flask
+
+import download_routes
+
+
+def entry(version, platform='All Platforms', legacy=False):
+    return {"version": version, "filename": f"snake_idle_v{version}.zip",
+            "platform": platform, "date": "2024-01-01", "legacy": legacy}
+
+
+def make_app(tmp_path, versions):
+    (tmp_path / 'versions.json').write_text(json.dumps(versions))
+    app = Flask(__name__)
+    app.config.update(
+        UPLOAD_FOLDER=str(tmp_path / 'downloads'),
+        VERSIONS_FILE=str(tmp_path / 'versions.json'),
+        METRICS_FILE=str(tmp_path / 'metrics.mmap'),
+        ADMISSION_FILE=str(tmp_path / 'admission.mmap'),
+        LATEST_MAX_AGE=60,
+    )
+    download_routes.init_app(app)
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    return make_app(tmp_path, [
+        entry('9.0.0'),
+        entry('10.0.0'),
+        entry('2.0.0'),
+        entry('10.1.0-rc.1', platform='Linux'),
+        entry('11.0.0', platform='Windows'),
+        entry('Beta_1', legacy=True),
+    ])
+
+
+def latest(client, **args):
+    response = client.get('/api/latest', query_string=args)
+    assert response.status_code == 200
+    return response, json.loads(response.data)
+
+
+def test_latest_orders_versions_semantically(app):
+    client = app.test_client()
+    # 10.0.0 beats 9.0.0 and 2.0.0, which a string sort would put first
+    _, payload = latest(client, platform='Mac')
+    assert payload['version'] == '10.0.0'
+    assert payload['url'] == '/download/10.0.0'
+    # A pre-release is newer than the release before it
+    _, payload = latest(client, platform='Linux')
+    assert payload['version'] == '10.1.0-rc.1'
+    _, payload = latest(client, platform='Windows')
+    assert payload['version'] == '11.0.0'
+    _, payload = latest(client)
+    assert payload['version'] == '11.0.0'
+
+
+def test_latest_reports_whether_current_is_behind(app):
+    client = app.test_client()
+    assert latest(client, current='9.9.9', platform='Mac')[1]['update_available'] is True
+    assert latest(client, current='10.0.0', platform='Mac')[1]['update_available'] is False
+    assert latest(client, current='10.0.0', platform='Linux')[1]['update_available'] is True
+    assert latest(client, current='10.1.0', platform='Linux')[1]['update_available'] is False
+    assert 'update_available' not in latest(client, platform='Linux')[1]
+
+
+def test_latest_is_cacheable(app):
+    client = app.test_client()
+    response, _ = latest(client, current='9.0.0')
+    assert response.headers['Cache-Control'] == 'public, max-age=60'
+    revalidated = client.get('/api/latest', query_string={'current': '9.0.0'},
+                             headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_latest_without_releases(tmp_path):
+    app = make_app(tmp_path, [entry('Beta_1', legacy=True)])
+    response = app.test_client().get('/api/latest')
+    assert response.status_code == 404
+
+
+def test_bundle_is_built_once_then_served_from_the_cache(app, tmp_path):
+    with zipfile.ZipFile(tmp_path / 'downloads' / 'snake_idle_v10.0.0.zip', 'w') as zf:
+        zf.writestr('snake_idle_pygame.py', b'print("snake")\n')
+        zf.writestr('memes/meme.png', b'meme')
+    client = app.test_client()
+    first = client.get('/download/10.0.0?bundle=lite')
+    assert first.status_code == 200
+    assert 'snake_idle_v10.0.0_lite.zip' in first.headers['Content-Disposition']
+    with zipfile.ZipFile(io.BytesIO(first.data)) as zf:
+        assert zf.namelist() == ['snake_idle_pygame.py']
+    assert len(os.listdir(tmp_path / 'downloads' / '.bundle_cache')) == 1
+    second = client.get('/download/10.0.0?bundle=lite')
+    assert second.data == first.data
+    assert client.get('/download/10.0.0?bundle=huge').status_code == 404
@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import json
+import os
+
+import pytest
+
+from file_info import entry_validators, format_size, inspect_file, record_file_info
+
+DATA = b'snake idle release\n' * 1000
+
+
+@pytest.fixture
+def release(tmp_path):
+    path = tmp_path / 'snake_idle_v1.0.0.zip'
+    path.write_bytes(DATA)
+    os.utime(path, (1700000000, 1700000000))
+    return path
+
+
+def test_inspect_file(release):
+    assert inspect_file(str(release)) == {
+        "sha256": hashlib.sha256(DATA).hexdigest(),
+        "bytes": len(DATA),
+        "mtime": 1700000000,
+    }
+
+
+def test_record_file_info_updates_matching_entries(release, tmp_path):
+    versions_file = tmp_path / 'versions.json'
+    versions_file.write_text(json.dumps([
+        {"version": "1.0.0", "filename": release.name, "size": "?"},
+        {"version": "0.9.0", "filename": "snake_idle_v0.9.0.zip"},
+    ]))
+    info = inspect_file(str(release))
+    assert record_file_info(str(versions_file), release.name, info) == 1
+    current, other = json.loads(versions_file.read_text())
+    assert current['sha256'] == info['sha256']
+    assert current['bytes'] == len(DATA)
+    assert current['mtime'] == 1700000000
+    assert current['size'] == format_size(len(DATA))
+    assert 'sha256' not in other
+
+
+def test_record_file_info_without_versions_file(release, tmp_path):
+    info = inspect_file(str(release))
+    assert record_file_info(str(tmp_path / 'missing.json'), release.name, info) == 0
+
+
+def test_entry_validators(release):
+    info = inspect_file(str(release))
+    validators = entry_validators(dict(info, version='1.0.0'))
+    digest = hashlib.sha256(DATA).digest()
+    assert validators == {
+        "etag": 'sha256-' + info['sha256'],
+        "digest": base64.b64encode(digest).decode('ascii'),
+        "bytes": len(DATA),
+        "mtime": 1700000000,
+    }
+    # Entries published before hashes were recorded have no validators
+    assert entry_validators({"version": "1.0.0", "sha256": info['sha256']}) is None
+
+
+@pytest.mark.parametrize('bad', [
+    {"sha256": "not-hex"},
+    {"sha256": "ab" * 31},
+    {"bytes": -1},
+    {"bytes": "10"},
+    {"mtime": True},
+])
+def test_malformed_validators_are_rejected(release, bad):
+    entry = dict(inspect_file(str(release)), **bad)
+    with pytest.raises(ValueError):
+        entry_validators(entry)
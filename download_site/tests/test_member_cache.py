@@ -0,0 +1,53 @@
+import hashlib
+import os
+import zipfile
+
+import pytest
+
+from member_cache import MemberCache, PreviousRelease, reuse_or_compress
+
+CONTENT = b'def main():\n    pass\n' * 500
+
+
+@pytest.fixture
+def previous(tmp_path):
+    zip_path = tmp_path / 'snake_idle_v1.0.0.zip'
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('snake_idle_pygame.py', CONTENT)
+    release = PreviousRelease(str(zip_path))
+    yield release
+    release.close()
+
+
+def stat_of(tmp_path, data):
+    path = tmp_path / 'file'
+    path.write_bytes(data)
+    return os.stat(path)
+
+
+def test_unchanged_member_is_copied_from_previous_release(tmp_path, previous):
+    member, source = reuse_or_compress(CONTENT, stat_of(tmp_path, CONTENT),
+                                       'snake_idle_pygame.py', previous=previous)
+    assert source == 'previous'
+    assert member.file_size == len(CONTENT)
+
+
+def test_previous_member_needs_matching_sha256(previous):
+    info = previous.infos['snake_idle_pygame.py']
+    member_args = ('snake_idle_pygame.py', (2024, 1, 1, 0, 0, 0), 0)
+    # Same CRC and size, but a different content hash: never reused
+    assert previous.get('0' * 64, info.CRC, info.file_size, member_args) is None
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    assert previous.get(digest, info.CRC, info.file_size, member_args) is not None
+
+
+def test_changed_member_is_compressed_then_cached(tmp_path, previous):
+    changed = CONTENT + b'# new\n'
+    cache = MemberCache(str(tmp_path / 'cache'))
+    st = stat_of(tmp_path, changed)
+    _, source = reuse_or_compress(changed, st, 'snake_idle_pygame.py', cache=cache,
+                                  previous=previous)
+    assert source == 'compressed'
+    member, source = reuse_or_compress(changed, st, 'snake_idle_pygame.py', cache=cache)
+    assert source == 'cache'
+    assert member.file_size == len(changed)
@@ -0,0 +1,62 @@
+import re
+
+import pytest
+from flask import Flask
+from werkzeug.wsgi import FileWrapper
+
+import metrics
+from responses import send_download
+
+DATA = b'0123456789' * 10000
+
+
+@pytest.fixture
+def app(tmp_path):
+    path = tmp_path / 'snake_idle_v1.0.0.zip'
+    path.write_bytes(DATA)
+    app = Flask(__name__)
+    app.config['METRICS_FILE'] = str(tmp_path / 'metrics.mmap')
+
+    @app.route('/download/<version>')
+    def download(version):
+        return send_download(str(path), path.name)
+
+    @app.after_request
+    def keep_body(response):
+        # Registered first, so it runs after metrics' hook
+        app.last_body = response.response
+        return response
+    metrics.init_app(app)
+    return app
+
+
+def value(app, name, **labels):
+    """Current value of a metric in the /metrics text, 0 if absent"""
+    text = app.test_client().get('/metrics').get_data(as_text=True)
+    for line in text.splitlines():
+        match = re.match(r'^(\w+)(?:\{(.*)\})? (\S+)$', line)
+        if match and match.group(1) == name and dict(
+                re.findall(r'(\w+)="([^"]*)"', match.group(2) or '')) == labels:
+            return float(match.group(3))
+    return 0.0
+
+
+def test_whole_file_keeps_file_wrapper_and_counts_on_close(app):
+    response = app.test_client().get('/download/1.0.0', buffered=False)
+    # Left as a file wrapper, so a WSGI server can still use sendfile()
+    assert isinstance(app.last_body, FileWrapper)
+    assert value(app, 'snake_idle_transfers_in_flight') == 1
+    response.get_data()
+    response.close()
+    assert value(app, 'snake_idle_transfers_in_flight') == 0
+    assert value(app, 'snake_idle_download_bytes_total', kind='full',
+                 version='1.0.0') == len(DATA)
+    assert value(app, 'snake_idle_downloads_total', kind='full', version='1.0.0') == 1
+
+
+def test_range_counts_bytes_actually_sent(app):
+    response = app.test_client().get('/download/1.0.0', headers={'Range': 'bytes=0-99'})
+    assert response.data == DATA[:100]
+    response.close()
+    assert value(app, 'snake_idle_download_bytes_total', kind='full', version='1.0.0') == 100
+    assert value(app, 'snake_idle_transfers_in_flight') == 0
@@ -0,0 +1,107 @@
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import mirrors
+from mirrors import MirrorPool
+
+FILENAME = 'snake_idle_v1.0.0.zip'
+DATA = b'release' * 100
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """Start a static file server over a directory; returns its base URL"""
+    servers = []
+
+    def start(files):
+        root = tmp_path / f'mirror{len(servers)}'
+        root.mkdir()
+        for name, data in files.items():
+            (root / name).write_bytes(data)
+        server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                     partial(QuietHandler, directory=str(root)))
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}/'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = MirrorPool(timeout=2.0)
+    # Checks are run by the tests instead of the background thread
+    monkeypatch.setattr(pool, 'start', lambda: None)
+    return pool
+
+
+def test_unchecked_mirror_is_not_used(pool, serve):
+    url = serve({FILENAME: DATA})
+    assert pool.choose([url], FILENAME) is None
+    pool.probe_all()
+    assert pool.choose([url], FILENAME).base_url == url.rstrip('/')
+
+
+def test_mirror_without_the_file_is_skipped(pool, serve):
+    synced = serve({FILENAME: DATA})
+    behind = serve({})
+    urls = [behind, synced]
+    pool.choose(urls, FILENAME)
+    pool.probe_all()
+    assert pool.mirror(behind).healthy
+    assert pool.mirror(behind).has(FILENAME) is False
+    for _ in range(3):
+        assert pool.choose(urls, FILENAME).base_url == synced.rstrip('/')
+
+
+def test_mirror_with_wrong_size_is_skipped(pool, serve):
+    url = serve({FILENAME: DATA[:-1]})
+    pool.choose([url], FILENAME, len(DATA))
+    pool.probe_all()
+    assert pool.choose([url], FILENAME, len(DATA)) is None
+    assert pool.mirror(url).has(FILENAME) is False
+    # The size isn't checked when versions.json doesn't record one
+    pool.choose([url], FILENAME)
+    pool.probe_all()
+    assert pool.choose([url], FILENAME) is not None
+
+
+def test_unreachable_mirror_is_never_used(pool, serve):
+    url = serve({FILENAME: DATA})
+    dead = 'http://127.0.0.1:9/'
+    pool.choose([dead, url], FILENAME)
+    pool.probe_all()
+    assert not pool.mirror(dead).healthy
+    assert pool.choose([dead], FILENAME) is None
+
+
+def test_downloads_are_spread_over_mirrors(pool, serve):
+    urls = [serve({FILENAME: DATA}), serve({FILENAME: DATA})]
+    pool.choose(urls, FILENAME)
+    pool.probe_all()
+    chosen = [pool.choose(urls, FILENAME).base_url for _ in range(4)]
+    assert sorted(chosen) == sorted([u.rstrip('/') for u in urls] * 2)
+
+
+def test_files_not_asked_for_are_dropped(pool, serve):
+    url = serve({FILENAME: DATA})
+    pool.want(pool.mirror(url), FILENAME, now=0.0)
+    pool.probe_all(now=1.0)
+    assert pool.mirror(url).has(FILENAME)
+    pool.probe_all(now=mirrors.FILE_TTL + 1.0)
+    assert pool.mirror(url).has(FILENAME) is None
+
+
+def test_no_mirrors(pool):
+    assert pool.choose([], FILENAME) is None
@@ -0,0 +1,101 @@
+import json
+import os
+import random
+import zipfile
+
+import pytest
+
+from package_delta import apply_delta, apply_patch, build_delta, make_patch
+
+
+def write_zip(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def read_tree(root):
+    tree = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, root).replace(os.sep, '/')] = f.read()
+    return tree
+
+
+def test_patch_round_trip_is_small_for_a_local_edit():
+    rng = random.Random(1)
+    old = bytes(rng.getrandbits(8) for _ in range(200_000))
+    new = old[:50_000] + b'inserted bytes' + old[50_000:150_000] + old[150_100:]
+    patch = make_patch(old, new)
+    assert apply_patch(old, patch) == new
+    assert len(patch) < 1000
+
+
+@pytest.mark.parametrize('old, new', [
+    (b'', b'brand new'),
+    (b'old content', b''),
+    (b'abc' * 10, b'xyz' * 10),
+])
+def test_patch_round_trip_edge_cases(old, new):
+    assert apply_patch(old, make_patch(old, new)) == new
+
+
+def test_delta_updates_old_release_to_new(tmp_path):
+    rng = random.Random(2)
+    big = bytes(rng.getrandbits(8) for _ in range(100_000))
+    old = {'game.py': b'print(1)\n', 'assets/big.bin': big, 'old.txt': b'gone'}
+    new = {'game.py': b'print(2)\n', 'assets/big.bin': big[:-10] + b'0123456789',
+           'assets/new.txt': b'added'}
+    old_zip = write_zip(tmp_path / 'old.zip', old)
+    new_zip = write_zip(tmp_path / 'new.zip', new)
+    delta = str(tmp_path / 'delta.zip')
+
+    manifest = build_delta(old_zip, new_zip, '1.0.0', '1.1.0', delta)
+    assert manifest['added'] == ['assets/new.txt']
+    assert manifest['removed'] == ['old.txt']
+    assert manifest['changed'] == ['assets/big.bin', 'game.py']
+    assert 'assets/big.bin' in manifest['patches']
+    assert os.path.getsize(delta) < len(big) // 2
+
+    game_dir = tmp_path / 'game'
+    with zipfile.ZipFile(old_zip) as zf:
+        zf.extractall(game_dir)
+    apply_delta(str(game_dir), delta)
+    assert read_tree(game_dir) == new
+
+
+@pytest.mark.parametrize('name', ['../escape.txt', '/etc/passwd', 'a/../../b'])
+def test_apply_delta_rejects_unsafe_paths_before_writing(tmp_path, name):
+    delta = tmp_path / 'evil.zip'
+    manifest = {'from': '1', 'to': '2', 'added': ['safe.txt', name],
+                'removed': [], 'changed': [], 'patches': {}}
+    with zipfile.ZipFile(delta, 'w') as zf:
+        zf.writestr('delta.json', json.dumps(manifest))
+        zf.writestr('files/safe.txt', b'ok')
+        zf.writestr(f'files/{name}', b'pwned')
+    game_dir = tmp_path / 'game'
+    game_dir.mkdir()
+
+    with pytest.raises(ValueError):
+        apply_delta(str(game_dir), str(delta))
+    assert read_tree(game_dir) == {}
+    assert not (tmp_path / 'escape.txt').exists()
+
+
+def test_apply_delta_checks_patched_content(tmp_path):
+    rng = random.Random(3)
+    data = bytes(rng.getrandbits(8) for _ in range(100_000))
+    old_zip = write_zip(tmp_path / 'old.zip', {'big.bin': data})
+    new_zip = write_zip(tmp_path / 'new.zip', {'big.bin': data[:-1] + b'!'})
+    delta = str(tmp_path / 'delta.zip')
+    build_delta(old_zip, new_zip, '1', '2', delta)
+
+    game_dir = tmp_path / 'game'
+    game_dir.mkdir()
+    # A locally modified file can't be patched into the release
+    (game_dir / 'big.bin').write_bytes(b'x' + data[1:])
+    with pytest.raises(ValueError):
+        apply_delta(str(game_dir), delta)
@@ -0,0 +1,53 @@
+import argparse
+import os
+import zipfile
+
+import pytest
+
+import package_game
+from optimize_images import ImageSettings
+
+
+@pytest.fixture
+def game_dir(tmp_path):
+    root = tmp_path / 'game'
+    (root / 'images').mkdir(parents=True)
+    (root / 'snake_idle_pygame.py').write_text('print("snake")\n' * 100)
+    (root / 'requirements.txt').write_text('pygame>=2.5.0\n')
+    (root / 'images' / 'sprite.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 100)
+    return root
+
+
+def package(game_dir, output_dir, **kwargs):
+    return package_game.package_game('1.2.3', str(output_dir), root_dir=str(game_dir),
+                                     versions_file=str(output_dir / 'versions.json'),
+                                     **kwargs)
+
+
+def test_package_game_writes_release_zip(game_dir, tmp_path):
+    output_dir = tmp_path / 'downloads'
+    file_info, sources = package(game_dir, output_dir)
+    zip_path = output_dir / 'snake_idle_v1.2.3.zip'
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        assert {'snake_idle_pygame.py', 'requirements.txt', 'images/sprite.png'} <= set(
+            zf.namelist())
+    assert file_info['bytes'] == os.path.getsize(zip_path)
+    assert sources == ['compressed'] * len(sources)
+
+
+def test_failed_image_stage_leaves_no_staging_dir(game_dir, tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError("cannot identify image file")
+    monkeypatch.setattr(package_game, 'optimize_members', fail)
+    output_dir = tmp_path / 'downloads'
+    with pytest.raises(OSError):
+        package(game_dir, output_dir, image_settings=ImageSettings({}, 85))
+    assert [name for name in os.listdir(output_dir) if name.startswith('.images-')] == []
+
+
+def test_image_size_argument():
+    assert package_game.image_size('640X480') == (640, 480)
+    for value in ('512', '0x512', 'axb', '-1x5'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            package_game.image_size(value)
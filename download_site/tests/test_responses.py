@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+
+import pytest
+from flask import Flask
+from werkzeug.http import http_date, parse_accept_header
+
+from catalog import CatalogGeneration
+from file_info import entry_validators, inspect_file
+from responses import (MAX_STATIC_CACHE_SIZE, _StaticCache, cached_response, choose_encoding,
+                       encode_variants, fingerprinted_path, offload_file, resolve_ranges,
+                       send_download, send_variants, static_fingerprint, static_variants)
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'snake_idle_v1.0.0.zip'
+    path.write_bytes(DATA)
+    os.utime(path, (1700000000, 1700000000))
+    app = Flask(__name__)
+
+    validators = entry_validators(inspect_file(str(path)))
+
+    @app.route('/download')
+    def download():
+        return send_download(str(path), path.name, validators=validators)
+
+    @app.route('/offload/<mode>')
+    def offload(mode):
+        return offload_file(mode, str(path), '/_protected/downloads/' + path.name,
+                            download_name=path.name, validators=validators)
+    return app.test_client()
+
+
+def get(client, **headers):
+    response = client.get('/download', headers=headers)
+    # Read the body before closing, which closes the file
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_resolve_ranges():
+    assert resolve_ranges(100, 'e', None, None) is None
+    assert resolve_ranges(100, 'e', None, 'bytes=0-9') == [(0, 10)]
+    assert resolve_ranges(100, 'e', None, 'bytes=90-') == [(90, 100)]
+    assert resolve_ranges(100, 'e', None, 'bytes=-10') == [(90, 100)]
+    assert resolve_ranges(100, 'e', None, 'bytes=95-200') == [(95, 100)]
+    assert resolve_ranges(100, 'e', None, 'bytes=100-') == []
+    assert resolve_ranges(100, 'e', None, 'items=0-9') is None
+
+
+def test_full_download(client):
+    response = get(client)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'attachment' in response.headers['Content-Disposition']
+
+
+def test_single_range(client):
+    response = get(client, Range='bytes=100-199')
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert response.content_length == 100
+
+
+def test_multiple_ranges(client):
+    response = get(client, Range='bytes=0-9,-10')
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert DATA[:10] in response.data and DATA[-10:] in response.data
+    assert response.content_length == len(response.data)
+
+
+def test_unsatisfiable_range(client):
+    response = get(client, Range=f'bytes={len(DATA)}-')
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_if_range_matching_etag_resumes(client):
+    etag = get(client).headers['ETag']
+    response = get(client, Range='bytes=10-19', **{'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == DATA[10:20]
+
+
+def test_if_range_stale_validator_sends_whole_file(client):
+    response = get(client, Range='bytes=10-19', **{'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+    old = http_date(datetime(2020, 1, 1, tzinfo=timezone.utc))
+    response = get(client, Range='bytes=10-19', **{'If-Range': old})
+    assert response.status_code == 200
+
+
+def test_conditional_get(client):
+    first = get(client)
+    response = get(client, **{'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+@pytest.mark.parametrize('mode', ['x-accel', 'x-sendfile'])
+def test_offloaded_download_has_the_same_validators(client, mode):
+    local = get(client)
+    response = client.get(f'/offload/{mode}')
+    assert response.data == b''
+    assert 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers
+    etag = '"sha256-%s"' % hashlib.sha256(DATA).hexdigest()
+    assert response.headers['ETag'] == local.headers['ETag'] == etag
+    for header in ('Last-Modified', 'Digest', 'Repr-Digest'):
+        assert response.headers[header] == local.headers[header]
+    revalidated = client.get(f'/offload/{mode}', headers={'If-None-Match': local.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_page_is_rendered_once_per_generation():
+    app = Flask(__name__)
+    renders = []
+    generations = [CatalogGeneration([], (1700000000 * 10 ** 9, 2), 1)]
+
+    def render():
+        renders.append(generations[-1].number)
+        return '<p>versions %d</p>' % generations[-1].number
+
+    @app.route('/')
+    def index():
+        return cached_response(generations[-1], 'index', render)
+
+    client = app.test_client()
+    first = client.get('/')
+    assert first.data == b'<p>versions 1</p>'
+    assert not first.headers['ETag'].startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/').headers['ETag'] == first.headers['ETag']
+    revalidated = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert renders == [1]
+
+    # versions.json changed: a new generation renders a new page and ETag
+    generations.append(CatalogGeneration([], (1700000100 * 10 ** 9, 2), 2))
+    response = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.data == b'<p>versions 2</p>'
+    assert response.headers['ETag'] != first.headers['ETag']
+    assert renders == [1, 2]
+
+
+def test_encode_variants_keeps_only_smaller_encodings():
+    text = b'<p>snake</p>' * 200
+    variants = encode_variants(text)
+    assert variants['identity'] == text
+    assert gzip.decompress(variants['gzip']) == text
+    assert 'gzip' not in encode_variants(os.urandom(64))
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('', 'identity'),
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('gzip;q=0, identity', 'identity'),
+    ('*', 'br'),
+])
+def test_choose_encoding(header, expected):
+    variants = {'identity': b'a', 'gzip': b'b', 'br': b'c'}
+    assert choose_encoding(variants, parse_accept_header(header)) == expected
+
+
+def test_choose_encoding_skips_missing_variants():
+    assert choose_encoding({'identity': b'a'}, parse_accept_header('br, gzip')) == 'identity'
+
+
+def test_send_variants_negotiates_encoding():
+    app = Flask(__name__)
+    variants = encode_variants(b'body { color: green; }\n' * 100)
+
+    @app.route('/style.css')
+    def style():
+        return send_variants(variants, 'abc', 'text/css')
+
+    client = app.test_client()
+    plain = client.get('/style.css')
+    assert plain.data == variants['identity']
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    gzipped = client.get('/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['Vary'] == 'Accept-Encoding'
+    assert gzipped.data == variants['gzip']
+    assert gzipped.headers['ETag'] == '"abc-gzip"' != plain.headers['ETag']
+    revalidated = client.get('/style.css', headers={'Accept-Encoding': 'gzip',
+                                                    'If-None-Match': '"abc-gzip"'})
+    assert revalidated.status_code == 304
+
+
+def test_static_cache_evicts_least_recently_used():
+    cache = _StaticCache(250)
+    cache.put('a.css', (1, 100), 'A', 100)
+    cache.put('b.css', (1, 100), 'B', 100)
+    assert cache.get('a.css', (1, 100)) == 'A'
+    cache.put('c.css', (1, 100), 'C', 100)
+    assert cache.get('b.css', (1, 100)) is None
+    assert cache.get('a.css', (1, 100)) == 'A' and cache.get('c.css', (1, 100)) == 'C'
+    assert cache.size == 200
+    # A changed file (new mtime/size key) misses
+    assert cache.get('a.css', (2, 100)) is None
+
+
+def test_static_variants_follow_file_changes(tmp_path):
+    path = tmp_path / 'style.css'
+    path.write_text('body { color: green; }\n' * 100)
+    os.utime(path, (1700000000, 1700000000))
+    variants, etag, mimetype, last_modified = static_variants(str(path))
+    assert mimetype == 'text/css'
+    assert gzip.decompress(variants['gzip']) == path.read_bytes()
+    assert last_modified == 1700000000
+    assert static_variants(str(path))[0] is variants
+
+    path.write_text('body { color: red; }\n')
+    os.utime(path, (1700000100, 1700000100))
+    assert static_variants(str(path))[0]['identity'] == b'body { color: red; }\n'
+    assert static_variants(str(path))[1] != etag
+
+
+def test_large_static_files_are_not_cached(tmp_path):
+    path = tmp_path / 'photo.jpeg'
+    path.write_bytes(b'\0' * (MAX_STATIC_CACHE_SIZE + 1))
+    assert static_variants(str(path)) is None
+    assert static_fingerprint(str(path)) is None
+
+
+def test_fingerprinted_path(tmp_path):
+    path = tmp_path / 'style.css'
+    path.write_text('body {}\n')
+    fingerprint = hashlib.sha256(b'body {}\n').hexdigest()[:12]
+    assert static_fingerprint(str(path)) == fingerprint
+    assert fingerprinted_path(str(tmp_path), f'style.{fingerprint}.css') == str(path)
+    assert fingerprinted_path(str(tmp_path), 'style.000000000000.css') is None
+    assert fingerprinted_path(str(tmp_path), 'style.css') is None
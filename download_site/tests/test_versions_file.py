@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from catalog import Catalog
+from versions_file import read_versions, update_versions, versions_lock, write_versions
+
+
+def entry(version):
+    return {"version": version, "filename": f"snake_idle_v{version}.zip"}
+
+
+def test_read_missing_file(tmp_path):
+    assert read_versions(str(tmp_path / 'versions.json')) == []
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    path = str(tmp_path / 'versions.json')
+
+    def publish(worker):
+        for i in range(10):
+            with update_versions(path) as versions:
+                versions.append(entry(f'{worker}.{i}.0'))
+
+    threads = [threading.Thread(target=publish, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(read_versions(path)) == 80
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = tmp_path / 'versions.json'
+    path.write_text(json.dumps([entry('1.0.0')]))
+    os.chmod(path, 0o640)
+    with pytest.raises(TypeError):
+        with versions_lock(str(path)):
+            write_versions(str(path), [entry('2.0.0'), object()])
+    assert read_versions(str(path)) == [entry('1.0.0')]
+    assert sorted(os.listdir(tmp_path)) == ['versions.json', 'versions.json.lock']
+
+    with update_versions(str(path)) as versions:
+        versions.append(entry('2.0.0'))
+    assert read_versions(str(path)) == [entry('1.0.0'), entry('2.0.0')]
+    # The replacement keeps the permissions of the file it replaced
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_watched_catalog_reloads_after_a_write(tmp_path):
+    path = str(tmp_path / 'versions.json')
+    with update_versions(path) as versions:
+        versions.append(entry('1.0.0'))
+    catalog = Catalog(path, watch=True, poll_interval=0.1)
+    first = catalog.get()
+    assert [v['version'] for v in first.versions] == ['1.0.0']
+
+    with update_versions(path) as versions:
+        versions.append(entry('2.0.0'))
+    deadline = time.monotonic() + 5
+    while catalog.get() is first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [v['version'] for v in catalog.get().versions] == ['2.0.0', '1.0.0']
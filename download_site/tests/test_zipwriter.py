@@ -0,0 +1,62 @@
+import io
+import os
+import zipfile
+
+from zipwriter import (ZIP_DEFLATED, ZIP_STORED, ZipWriter, archive_size, compress_bytes,
+                       stream_zip)
+
+DATE_TIME = (2024, 11, 9, 12, 30, 0)
+
+FILES = {
+    'snake_idle_pygame.py': b'print("snake")\n' * 200,
+    'images/background.png': os.urandom(2048),
+    'README.md': b'',
+    'memes/café.txt': 'déjà vu\n'.encode('utf-8') * 50,
+}
+
+
+def members():
+    return [compress_bytes(name, data, 6, DATE_TIME) for name, data in FILES.items()]
+
+
+def write_zip(members):
+    buffer = io.BytesIO()
+    writer = ZipWriter(buffer)
+    for member in members:
+        writer.add(member)
+    writer.close()
+    return buffer.getvalue()
+
+
+def test_zipfile_reads_what_zipwriter_writes():
+    data = write_zip(members())
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == list(FILES)
+        for name, content in FILES.items():
+            assert zf.read(name) == content
+            assert zf.getinfo(name).date_time == DATE_TIME
+
+
+def test_compression_choice():
+    by_name = {member.arcname: member for member in members()}
+    assert by_name['snake_idle_pygame.py'].compress_type == ZIP_DEFLATED
+    # Already-compressed formats and empty files are stored
+    assert by_name['images/background.png'].compress_type == ZIP_STORED
+    assert by_name['README.md'].compress_type == ZIP_STORED
+
+
+def test_archive_size_is_exact():
+    assert archive_size(members()) == len(write_zip(members()))
+
+
+def test_stream_zip_matches_zipwriter():
+    entries = []
+    for member in members():
+        chunks = [member.data[i:i + 100] for i in range(0, len(member.data), 100)]
+        entries.append((member._replace(data=None), chunks))
+    assert b''.join(stream_zip(entries)) == write_zip(members())
+
+
+def test_output_is_deterministic():
+    assert write_zip(members()) == write_zip(members())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Safe reads and writes of versions.json.
+
+Writers take an exclusive lock on versions.json.lock, write the new catalog
+to a temp file in the same directory and rename it over the old one, so a
+running server only ever sees the old or the new file, never a torn one,
+and concurrent scripts don't lose each other's changes.
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process locking on Windows; the rename is still atomic
+    fcntl = None
+
+
+@contextmanager
+def versions_lock(path):
+    """Hold the writer lock for a versions file"""
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def read_versions(path):
+    """Load a versions file, or [] if it doesn't exist yet"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def write_versions(path, versions):
+    """Atomically replace a versions file (call with versions_lock held)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.versions-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(versions, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600 files; keep the permissions of the file we replace
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextmanager
+def update_versions(path):
+    """Read-modify-write a versions file under the lock.
+
+    Yields the current list; whatever it holds when the block exits without
+    an error is written back atomically.
+    """
+    with versions_lock(path):
+        versions = read_versions(path)
+        yield versions
+        write_versions(path, versions)
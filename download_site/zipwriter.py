@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Minimal zip writer for members that are already compressed.
+
+zipfile.ZipFile always compresses while writing, which forces packaging to be
+serial and makes it impossible to reuse compressed data. Here members are
+compressed up front (possibly on a pool, see compress_file) and then written
+raw, in whatever order the caller chooses, to any writable file object.
+"""
+import os
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Formats that are already compressed; deflating them again wastes CPU
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.zip', '.gz', '.bz2', '.xz', '.7z',
+    '.mp3', '.ogg', '.m4a', '.mp4',
+}
+
+# One zip member, ready to be written without further compression
+Member = namedtuple('Member', [
+    'arcname', 'compress_type', 'crc', 'compress_size', 'file_size',
+    'date_time', 'external_attr', 'data',
+])
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_UTF8_FLAG = 0x800
+
+
+def dos_date_time(timestamp):
+    """Zip date_time tuple for a timestamp (zip can't store years before 1980)"""
+    date_time = time.localtime(timestamp)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    return date_time
+
+
+def should_store(arcname):
+    """True for members whose format is already compressed"""
+    return os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+
+
+def compress_bytes(arcname, data, level=6, date_time=None, external_attr=0o644 << 16):
+    """Build a Member from raw bytes, deflating unless that doesn't pay off"""
+    crc = zlib.crc32(data)
+    compress_type = ZIP_STORED
+    payload = data
+    if data and not should_store(arcname):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            compress_type = ZIP_DEFLATED
+            payload = deflated
+    if date_time is None:
+        date_time = dos_date_time(time.time())
+    return Member(arcname, compress_type, crc, len(payload), len(data),
+                  date_time, external_attr, payload)
+
+
+def compress_file(path, arcname, level=6):
+    """Read and compress one file into a Member (safe to run on a pool)"""
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    return compress_bytes(arcname, data, level, dos_date_time(st.st_mtime),
+                          (st.st_mode & 0xFFFF) << 16)
+
+
+def _encoded_name_length(arcname):
+    return len(ZipWriter._encode_name(arcname)[0])
+
+
+def archive_size(members):
+    """Exact size of the archive ZipWriter writes for members (data not needed)"""
+    total = _END_RECORD.size
+    for member in members:
+        name_length = _encoded_name_length(member.arcname)
+        total += (_LOCAL_HEADER.size + _CENTRAL_HEADER.size + 2 * name_length
+                  + member.compress_size)
+    return total
+
+
+class _Pending:
+    """File-like sink that keeps written bytes until they are collected"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+    def collect(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_zip(entries):
+    """Yield an archive piece by piece from (member, chunks) pairs.
+
+    member.data is ignored; chunks must yield exactly member.compress_size
+    bytes of payload. Only one chunk is held at a time, so archives of any
+    size can be sent without a temp file.
+    """
+    pending = _Pending()
+    writer = ZipWriter(pending)
+    for member, chunks in entries:
+        writer.begin(member)
+        yield pending.collect()
+        for chunk in chunks:
+            writer.write_data(chunk)
+            yield pending.collect()
+    writer.close()
+    yield pending.collect()
+
+
+class ZipWriter:
+    """Write pre-compressed Members to a file object and finish the archive"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.offset = 0
+        self._entries = []
+        # Where the current member's payload has to end
+        self._member_end = 0
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.offset += len(data)
+
+    @staticmethod
+    def _encode_name(arcname):
+        arcname = arcname.replace(os.sep, '/')
+        try:
+            return arcname.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return arcname.encode('utf-8'), _UTF8_FLAG
+
+    @staticmethod
+    def _dos_fields(date_time):
+        year, month, day, hour, minute, second = date_time
+        dos_date = (year - 1980) << 9 | month << 5 | day
+        dos_time = hour << 11 | minute << 5 | (second // 2)
+        return dos_time, dos_date
+
+    def local_header(self, member):
+        """Bytes of the local file header for member"""
+        name, flags = self._encode_name(member.arcname)
+        dos_time, dos_date = self._dos_fields(member.date_time)
+        return _LOCAL_HEADER.pack(
+            b'PK\x03\x04', 20, flags, member.compress_type, dos_time, dos_date,
+            member.crc, member.compress_size, member.file_size, len(name), 0) + name
+
+    def _check_member_end(self):
+        if self.offset != self._member_end:
+            member, start = self._entries[-1]
+            written = self.offset - start - len(self.local_header(member))
+            raise ValueError(f"{member.arcname}: got {written} bytes of data, "
+                             f"expected {member.compress_size}")
+
+    def begin(self, member):
+        """Start a member whose payload follows through write_data()"""
+        self._check_member_end()
+        if member.compress_size > _ZIP32_LIMIT or member.file_size > _ZIP32_LIMIT:
+            raise ValueError(f"{member.arcname} is too large for a zip32 archive")
+        self._entries.append((member, self.offset))
+        self._write(self.local_header(member))
+        self._member_end = self.offset + member.compress_size
+
+    def write_data(self, data):
+        """Write part of the current member's (already compressed) payload"""
+        self._write(data)
+
+    def add(self, member):
+        """Append a member"""
+        self.begin(member)
+        self.write_data(member.data)
+
+    def close(self):
+        """Write the central directory; the file object is left open"""
+        self._check_member_end()
+        start = self.offset
+        for member, offset in self._entries:
+            name, flags = self._encode_name(member.arcname)
+            dos_time, dos_date = self._dos_fields(member.date_time)
+            self._write(_CENTRAL_HEADER.pack(
+                b'PK\x01\x02', 3 << 8 | 20, 20, flags, member.compress_type,
+                dos_time, dos_date, member.crc, member.compress_size,
+                member.file_size, len(name), 0, 0, 0, 0,
+                member.external_attr, offset) + name)
+        if len(self._entries) > 0xFFFF or self.offset > _ZIP32_LIMIT:
+            raise ValueError("Archive is too large for a zip32 archive")
+        self._write(_END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, len(self._entries), len(self._entries),
+            self.offset - start, start, 0))
+